@@ -3,14 +3,20 @@
 from functools import partial
 import inspect
 import os
+from datetime import timedelta
 import pickle
 import time
 
+from rq import Queue, get_current_job
 from rq.compat import string_types, as_text
+from rq_scheduler import Scheduler
 
 import frappe
 from frappe.utils import cstr
 
+from btu.btu_core.btu_worker import connect_site, release_site
+from btu.btu_core.retry_policy import get_retry_policy
+
 
 class Sanchez():
 
@@ -62,7 +68,7 @@ def execute_job(site, method, event, job_name, kwargs, user=None, is_async=True,
 	Executes job in a worker, performs commit/rollback and logs if there is any error
 	"""
 	if is_async:
-		frappe.connect(site)
+		connect_site(site)  # In a BTUWorker, this reuses a warm database connection.
 		if os.environ.get('CI'):
 			frappe.flags.in_test = True
 
@@ -86,17 +92,20 @@ def execute_job(site, method, event, job_name, kwargs, user=None, is_async=True,
 	except (frappe.db.InternalError, frappe.RetryBackgroundJobError) as ex:
 		frappe.db.rollback()
 
-		if (retry < 5 and
-			(isinstance(ex, frappe.RetryBackgroundJobError) or
-				(frappe.db.is_deadlocked(ex) or frappe.db.is_timedout(ex)))):
-			# retry the job if
-			# 1213 = deadlock
-			# 1205 = lock wait timeout
-			# or RetryBackgroundJobError is explicitly raised
-			frappe.destroy()
-			time.sleep(retry+1)
-			return execute_job(site, method, event, job_name, kwargs,
-				is_async=is_async, retry=retry+1)
+		# retry the job if
+		# 1213 = deadlock
+		# 1205 = lock wait timeout
+		# or RetryBackgroundJobError is explicitly raised
+		retry_policy = get_retry_policy(method)
+		rq_job = get_current_job()
+		if is_async and rq_job and retry_policy.should_retry(ex, attempt=retry + 1):
+			# Instead of sleeping in this Worker, schedule another attempt; the Worker is free to run other Jobs meanwhile.
+			delay_seconds = retry_policy.delay_for(retry + 1)
+			print(f"Job '{job_name}' failed on attempt {retry + 1} of {retry_policy.max_attempts}.  Retrying in {delay_seconds} seconds.")
+			_log_failed_attempt(method, ex, retry + 1, retry_policy.max_attempts, delay_seconds)
+			enqueue_in(delay_seconds, method, queue=rq_job.origin, timeout=rq_job.timeout, job_name=job_name, retry=retry + 1,
+			           user=user, kwargs=kwargs)
+			return
 
 		frappe.log_error(title=method_name)
 		raise
@@ -114,7 +123,163 @@ def execute_job(site, method, event, job_name, kwargs, user=None, is_async=True,
 	finally:
 		frappe.monitor.stop()
 		if is_async:
-			frappe.destroy()
+			release_site()
+
+
+def enqueue(method, queue='default', timeout=None, job_name=None, **kwargs):
+	"""
+	Similar to frappe.enqueue(), except the Job is executed by the BTU 'execute_job' function.
+	This allows a BTUWorker to keep Site connections warm between Jobs.
+	"""
+	from frappe.utils.background_jobs import get_queue
+
+	queue_args = {
+		"site": frappe.local.site,
+		"user": frappe.session.user,
+		"method": method,
+		"event": None,
+		"job_name": job_name or cstr(getattr(method, "__name__", method)),
+		"is_async": True,
+		"kwargs": kwargs or None
+	}
+	return get_queue(queue).enqueue_call(execute_job, timeout=timeout, kwargs=queue_args)
+
+
+def enqueue_many(jobs, queue='default', timeout=None, batch_size=1000):
+	"""
+	Enqueue many Jobs at once.  Each batch is sent to Redis in a single pipeline, instead of several round-trips per Job.
+
+	Arguments:
+		jobs:  An iterable of tuples (method, job_name, kwargs)
+		batch_size:  The maximum number of Jobs per pipeline.
+
+	Returns a list of RQ Jobs.
+	"""
+	from frappe.utils.background_jobs import get_queue
+
+	rq_queue = get_queue(queue)
+	site_name, user = frappe.local.site, frappe.session.user
+	rq_jobs = []
+	batch = []
+	for method, job_name, kwargs in jobs:
+		queue_args = {
+			"site": site_name,
+			"user": user,
+			"method": method,
+			"event": None,
+			"job_name": job_name or cstr(getattr(method, "__name__", method)),
+			"is_async": True,
+			"kwargs": kwargs or None
+		}
+		batch.append(Queue.prepare_data(execute_job, kwargs=queue_args, timeout=timeout))
+		if len(batch) >= batch_size:
+			rq_jobs.extend(rq_queue.enqueue_many(batch))
+			batch = []
+	if batch:
+		rq_jobs.extend(rq_queue.enqueue_many(batch))
+	return rq_jobs
+
+
+def _log_failed_attempt(method, exception, attempt, max_attempts, delay_seconds):
+	"""
+	When the method of a retried Job belongs to a BTU Task (a TaskRunner or a TaskComponentWrapper), record the failed
+	attempt in BTU Task Log.  Other Jobs have no Task, so their attempts are only printed.
+	"""
+	from btu import Result
+	from btu.btu_core.doctype.btu_task_log.btu_task_log import write_log_for_task  # late import to avoid circular reference
+
+	owner = getattr(method, "__self__", None)
+	btu_task = getattr(owner, "btu_task", None)
+	task_id = btu_task.name if btu_task else getattr(owner, "btu_task_id", None)
+	if not task_id:
+		return
+	message = f"{exception}\n(Attempt {attempt} of {max_attempts}.  Retrying in {delay_seconds} seconds.)"
+	try:
+		write_log_for_task(task_id, Result(False, message),
+		                   schedule_id=getattr(owner, "schedule_id", None) or getattr(owner, "btu_task_schedule_id", None),
+		                   task_component=getattr(owner, "btu_component_id", None),
+		                   attempt=attempt)
+	except Exception as ex:
+		print(f"Unable to record attempt {attempt} of BTU Task '{task_id}' in BTU Task Log: {ex}")
+
+
+PROMOTER_KEY = "btu:scheduled_job_promoter"  # Bench-wide, like rq-scheduler's own keys.
+
+
+def is_rq_scheduler_running():
+	"""
+	Returns True if an rq-scheduler process ('rqscheduler') is registered in Redis.
+	"""
+	from frappe.utils.background_jobs import get_redis_conn
+
+	conn = get_redis_conn()
+	prefix = getattr(Scheduler, "redis_scheduler_namespace_prefix", "rq:scheduler_instance:")
+	for key in conn.scan_iter(match=f"{prefix}*", count=100):
+		if not conn.hexists(key, "death"):
+			return True
+	return False
+
+
+def is_delayed_enqueue_available():
+	"""
+	Returns True if something moves the Jobs of enqueue_in() into their queues when they are due:  either an rq-scheduler
+	process, or promote_scheduled_jobs() (run every minute by the Frappe scheduler, see hooks.py)
+	"""
+	from frappe.utils.background_jobs import get_redis_conn
+	return bool(get_redis_conn().exists(PROMOTER_KEY)) or is_rq_scheduler_running()
+
+
+def promote_scheduled_jobs():
+	"""
+	Move the due Jobs of enqueue_in() into their queues.  Called every minute via a cron schedule in BTU hooks.py
+
+	This does the work of an rq-scheduler process, for benches that do not run one.  It takes the same Redis lock as
+	rq-scheduler, so a Job is never enqueued twice.  The Jobs of every Site on the bench are promoted.
+	"""
+	from frappe.utils.background_jobs import get_redis_conn
+
+	conn = get_redis_conn()
+	conn.set(PROMOTER_KEY, 1, ex=180)  # enqueue_in() may rely on this function for the next 3 minutes.
+	scheduler = Scheduler(connection=conn)
+	if not scheduler.acquire_lock():
+		return 0  # rq-scheduler, or another Site's run of this function, is already promoting Jobs.
+	try:
+		promoted = scheduler.enqueue_jobs()
+	finally:
+		scheduler.remove_lock()
+	return len(promoted or [])
+
+
+def enqueue_in(delay_seconds, method, queue='default', timeout=None, job_name=None, retry=0, user=None, kwargs=None):
+	"""
+	Like enqueue(), except rq-scheduler moves the Job into the queue after 'delay_seconds'.
+
+	Arguments:
+		retry:  The number of attempts that already failed.  Passed to execute_job() so retry policies can count attempts.
+		kwargs:  A dictionary of keyword arguments for 'method'.  Unlike enqueue(), these are not passed as **kwargs, so
+		         the method may have arguments named 'user', 'queue', 'timeout', etc.
+
+	NOTE: The Job is promoted into its queue by rq-scheduler, or by promote_scheduled_jobs().  (see docs/installation.md)
+	      When neither is running, this function waits 'delay_seconds' in the calling process, then enqueues the Job.
+	"""
+	from frappe.utils.background_jobs import get_queue, get_redis_conn
+
+	queue_args = {
+		"site": frappe.local.site,
+		"user": user or frappe.session.user,
+		"method": method,
+		"event": None,
+		"job_name": job_name or cstr(getattr(method, "__name__", method)),
+		"is_async": True,
+		"kwargs": kwargs or None,
+		"retry": retry
+	}
+	if not is_delayed_enqueue_available():
+		print(f"Nothing promotes delayed Jobs (see docs/installation.md).  Waiting {delay_seconds} seconds here, instead of scheduling Job '{queue_args['job_name']}'.")
+		time.sleep(delay_seconds)
+		return get_queue(queue).enqueue_call(execute_job, timeout=timeout, kwargs=queue_args)
+	scheduler = Scheduler(queue_name=get_queue(queue).name, connection=get_redis_conn())
+	return scheduler.enqueue_in(timedelta(seconds=delay_seconds), execute_job, timeout=timeout, **queue_args)
 
 
 class TransientTask():
@@ -3,6 +3,9 @@
 # NOTE: This describes how to get rid of the outer 'message" key in Frappe HTTP responses:
 # https://discuss.erpnext.com/t/returning-plain-text-from-whitelisted-method/32621
 
+# Standard Library
+import json
+
 # Third Party
 from werkzeug.wrappers import Response
 
@@ -10,8 +13,10 @@ from werkzeug.wrappers import Response
 import frappe
 
 # BTU Library
+from btu.btu_core import pickled_task_cache
 from btu.btu_core.task_runner import TaskRunner
 from btu.btu_api import Sanchez, execute_job
+from btu.btu_api.payload_bundle import STATUS_ERROR, STATUS_OK, pack_bundle
 
 
 @frappe.whitelist()
@@ -26,16 +31,80 @@ def get_pickled_task(task_id, task_schedule_id=None):
 	Steps:
 		1. Create some pickled, binary data for a Task's function.
 		2. Return the binary data to the caller.
+
+	Unless the Task or Schedule has changed, the binary data is returned from a cache. (see pickled_task_cache.py)
+	"""
+	version = pickled_task_cache.get_version(task_id, task_schedule_id)
+	http_result = pickled_task_cache.get_payload(task_id, task_schedule_id, frappe.session.user, version)
+	if http_result is None:
+		http_result = build_pickled_task(task_id, task_schedule_id)
+		pickled_task_cache.store_payload(task_id, task_schedule_id, frappe.session.user, version, http_result)
+	return http_result
+
+
+@frappe.whitelist()
+def get_pickled_tasks(task_pairs):
+	"""
+	RPC HTTP Endpoint called by BTU Scheduler daemon.  Like 'get_pickled_task', but for many Tasks in one request.
+
+	args:
+		task_pairs:		A list (or JSON string of a list) of pairs [task_id, task_schedule_id]
+
+	Returns a framed, binary bundle of serialized RQ Jobs, in the same order as 'task_pairs'.  (see payload_bundle.py)
+	A pair that fails (for example, a Task that no longer exists) gets an error frame; the other pairs are unaffected.
 	"""
+	if isinstance(task_pairs, str):
+		task_pairs = json.loads(task_pairs)
+	task_pairs = [ (task_id, task_schedule_id or None) for task_id, task_schedule_id in task_pairs ]
+
+	# Prefetch every Document with one query per DocType, instead of one get_doc() per pair.
+	task_rows = { row.name: row for row in frappe.get_all("BTU Task", fields=["*"],
+	              filters={"name": ["in", list({ task_id for task_id, _ in task_pairs })]}) }
+	schedule_ids = list({ task_schedule_id for _, task_schedule_id in task_pairs if task_schedule_id })
+	schedule_rows = { row.name: row for row in frappe.get_all("BTU Task Schedule", fields=["*"],
+	                  filters={"name": ["in", schedule_ids]}) } if schedule_ids else {}
+
+	frames = []
+	for task_id, task_schedule_id in task_pairs:
+		try:
+			if task_id not in task_rows:
+				raise frappe.DoesNotExistError(f"BTU Task {task_id} not found")
+			if task_schedule_id and task_schedule_id not in schedule_rows:
+				raise frappe.DoesNotExistError(f"BTU Task Schedule {task_schedule_id} not found")
+			task_row = task_rows[task_id]
+			schedule_row = schedule_rows.get(task_schedule_id)
+			version = pickled_task_cache.make_version(task_row.modified, schedule_row.modified if schedule_row else None)
+			payload = pickled_task_cache.get_payload(task_id, task_schedule_id, frappe.session.user, version)
+			if payload is None:
+				payload = build_pickled_task(task_id, task_schedule_id,
+				                             doc_task=frappe.get_doc({"doctype": "BTU Task", **task_row}),
+				                             doc_schedule=frappe.get_doc({"doctype": "BTU Task Schedule", **schedule_row}) if schedule_row else None)
+				pickled_task_cache.store_payload(task_id, task_schedule_id, frappe.session.user, version, payload)
+			frames.append((task_id, task_schedule_id, STATUS_OK, payload))
+		except Exception as ex:
+			frames.append((task_id, task_schedule_id, STATUS_ERROR, str(ex)))
+
+	return pack_bundle(frames)
+
+
+def build_pickled_task(task_id, task_schedule_id=None, doc_task=None, doc_schedule=None, serialization=None):
+	"""
+	Returns the pickled RQ Job for a Task and (optional) Task Schedule.
+	Callers that already have the Documents can pass them as 'doc_task' and 'doc_schedule'.
+
+	serialization:  'Full' or 'By Reference'.  By default, the value in BTU Configuration.
+	"""
+	serialization = serialization or frappe.db.get_single_value("BTU Configuration", "job_serialization", cache=True) or "Full"
 
 	# Step 1: Retrieve the BTU Task Document.
-	doc_task = frappe.get_doc("BTU Task", task_id)
+	doc_task = doc_task or frappe.get_doc("BTU Task", task_id)
 
 	# Step 2: Wrap it in the TaskRunner class.  This handles logging, capturing Standard Output, and much more.
 	this_taskrunner = TaskRunner(btu_task=doc_task,
 	                             site_name=frappe.local.site,
 								 schedule_id=task_schedule_id,	# very important, so TaskRunner can Log per Schedule!
-								 enable_debug_mode=True)
+								 enable_debug_mode=True,
+								 schedule_doc=doc_schedule)
 
 	# This allows for adding additional keyword arguments to a Task:
 	extra_arguments = doc_task.built_in_arguments()
@@ -52,6 +121,15 @@ def get_pickled_task(task_id, task_schedule_id=None):
 		"is_async": True,  # always true; we want to run things in the Redis Queue, not on the Web Server.
 		"kwargs": None  # if function requires keyword arguments, this is where you'd store them.
 	}
+	if serialization == "By Reference":
+		# Instead of the pickled TaskRunner (and its BTU Task Document), the Job only carries names and arguments.
+		queue_args["method"] = "btu.btu_core.task_runner.run_task_by_reference"
+		queue_args["kwargs"] = {
+			"task_id": doc_task.name,
+			"schedule_id": task_schedule_id,
+			"task_kwargs": this_taskrunner.kwarg_dict,
+			"enable_debug_mode": this_taskrunner.debug_mode_enabled
+		}
 
 	# Step 4. Use the Sanchez class to pickle the Task Runner
 	new_sanchez = Sanchez()
@@ -61,6 +139,48 @@ def get_pickled_task(task_id, task_schedule_id=None):
 	http_result: bytes = new_sanchez.get_serialized_rq_job()
 	return http_result
 
+@frappe.whitelist()
+def get_pickled_task_cache_statistics(reset=False):
+	"""
+	Returns the hits and misses of the cache used by 'get_pickled_task'
+	"""
+	frappe.only_for("System Manager")
+	statistics = pickled_task_cache.get_cache_statistics()
+	if frappe.utils.cint(reset):
+		pickled_task_cache.reset_cache_statistics()
+	return statistics
+
+@frappe.whitelist()
+def job_payload_size_report():
+	"""
+	For every enabled BTU Task Schedule, compare the size of its RQ Job with 'Full' and 'By Reference' serialization.
+	Prints a table, and returns a list of dictionaries.
+	"""
+	frappe.only_for("System Manager")
+	schedules = frappe.get_all("BTU Task Schedule", filters={"enabled": True}, fields=["name", "task"], order_by="name")
+	report = []
+	for each_schedule in schedules:
+		row = { "schedule": each_schedule.name, "task": each_schedule.task }
+		try:
+			row["full_bytes"] = len(build_pickled_task(each_schedule.task, each_schedule.name, serialization="Full"))
+			row["by_reference_bytes"] = len(build_pickled_task(each_schedule.task, each_schedule.name, serialization="By Reference"))
+			row["ratio"] = round(row["by_reference_bytes"] / row["full_bytes"], 3)
+		except Exception as ex:
+			row["error"] = str(ex)
+		report.append(row)
+
+	print(f"{'Schedule':<20} {'Task':<20} {'Full':>10} {'By Reference':>14} {'Ratio':>7}")
+	for row in report:
+		if "error" in row:
+			print(f"{row['schedule']:<20} {row['task']:<20} Error: {row['error']}")
+		else:
+			print(f"{row['schedule']:<20} {row['task']:<20} {row['full_bytes']:>10} {row['by_reference_bytes']:>14} {row['ratio']:>7}")
+	measured = [ row for row in report if "error" not in row ]
+	if measured:
+		print(f"Total: {sum(row['full_bytes'] for row in measured)} bytes (Full), "
+		      f"{sum(row['by_reference_bytes'] for row in measured)} bytes (By Reference)")
+	return report
+
 # The purpose of the following endpoints: to enable the BTU CLI and Scheduler
 # to test and validate connectivity with the Frappe web server.
 
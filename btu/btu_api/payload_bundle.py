@@ -0,0 +1,71 @@
+""" payload_bundle.py """
+
+# --------
+#
+# The binary format returned by the endpoint 'get_pickled_tasks'.  Many serialized RQ Jobs in one HTTP response.
+#
+# All integers are unsigned and big-endian.
+#
+#   Header:   4 bytes   magic number b"BTUB"
+#             1 byte    format version (1)
+#             4 bytes   number of frames
+#
+#   Frame:    2 bytes   length of the Task ID
+#             2 bytes   length of the Task Schedule ID (0 when there is no Schedule)
+#             1 byte    status:  0 = the payload is a serialized RQ Job,  1 = the payload is a UTF-8 error message
+#             4 bytes   length of the payload
+#             ...       Task ID (UTF-8), Task Schedule ID (UTF-8), payload
+#
+# --------
+
+import struct
+
+MAGIC = b"BTUB"
+FORMAT_VERSION = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_header = struct.Struct(">4sBI")
+_frame_header = struct.Struct(">HHBI")
+
+
+def pack_bundle(frames):
+	"""
+	Arguments:
+		frames:  An iterable of tuples (task_id, task_schedule_id, status, payload)
+	"""
+	frames = list(frames)
+	parts = [ _header.pack(MAGIC, FORMAT_VERSION, len(frames)) ]
+	for task_id, task_schedule_id, status, payload in frames:
+		task_bytes = task_id.encode("utf-8")
+		schedule_bytes = (task_schedule_id or "").encode("utf-8")
+		if isinstance(payload, str):
+			payload = payload.encode("utf-8")
+		parts.append(_frame_header.pack(len(task_bytes), len(schedule_bytes), status, len(payload)))
+		parts.extend((task_bytes, schedule_bytes, payload))
+	return b"".join(parts)
+
+
+def unpack_bundle(data):
+	"""
+	The inverse of pack_bundle().  Returns a list of tuples (task_id, task_schedule_id, status, payload)
+	"""
+	view = memoryview(data)
+	magic, version, frame_count = _header.unpack_from(view, 0)
+	if magic != MAGIC or version != FORMAT_VERSION:
+		raise ValueError(f"Not a BTU payload bundle (magic number {bytes(magic)}, version {version})")
+	offset = _header.size
+	frames = []
+	for _ in range(frame_count):
+		task_length, schedule_length, status, payload_length = _frame_header.unpack_from(view, offset)
+		offset += _frame_header.size
+		task_id = bytes(view[offset:offset + task_length]).decode("utf-8")
+		offset += task_length
+		task_schedule_id = bytes(view[offset:offset + schedule_length]).decode("utf-8") or None
+		offset += schedule_length
+		payload = bytes(view[offset:offset + payload_length])
+		offset += payload_length
+		if len(payload) != payload_length:
+			raise ValueError("The payload bundle is truncated.")
+		frames.append((task_id, task_schedule_id, status, payload))
+	return frames
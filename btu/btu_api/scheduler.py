@@ -4,17 +4,31 @@ from enum import Enum
 import time
 
 import json
+import os
 import pathlib
 import socket
+import struct
+import threading
 import frappe
+from frappe.utils.background_jobs import get_redis_conn
 
 # https://realpython.com/python-sockets/#application-protocol-header
 
+SOCKET_TIMEOUT_SECONDS = 5
+BATCH_TIMEOUT_SECONDS = 120  # The daemon processes every Task Schedule in a batch before it replies.
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+LEGACY_RECEIVE_BYTES = 65536  # With the Legacy protocol, the reply must arrive in a single read.
+LATENCY_SAMPLE_SIZE = 1000  # How many recent round-trip times are kept.
+
+_frame_header = struct.Struct(">I")  # The length of each request and response.
+
 # pylint: disable=invalid-name
 class RequestType(Enum):
 	create_task_schedule = 0
 	ping = 1
 	cancel_task_schedule = 2
+	create_task_schedules = 3  # Batch of 'create_task_schedule'.  The content is a list of Task Schedule IDs.
+	cancel_task_schedules = 4  # Batch of 'cancel_task_schedule'.  The content is a list of Task Schedule IDs.
 
 class SchedulerAPI():
 	"""
@@ -51,8 +65,33 @@ class SchedulerAPI():
 		                                       content=task_schedule_id)
 		return response
 
+	@frappe.whitelist()
+	@staticmethod
+	def reload_task_schedules(task_schedule_ids):
+		"""
+		Ask the BTU Scheduler to reload many Task Schedules, with a single request.
+		Returns a dictionary of Task Schedule ID --> { 'okay': bool or None, 'message': str }  (see parse_batch_response)
+		"""
+		if isinstance(task_schedule_ids, str):
+			task_schedule_ids = json.loads(task_schedule_ids)
+		response = SchedulerAPI().send_message(RequestType.create_task_schedules, content=list(task_schedule_ids),
+		                                       timeout=BATCH_TIMEOUT_SECONDS)
+		return parse_batch_response(response, task_schedule_ids)
+
+	@frappe.whitelist()
+	@staticmethod
+	def cancel_task_schedules(task_schedule_ids):
+		"""
+		Ask the BTU Scheduler to cancel many Task Schedules, with a single request.
+		Returns a dictionary of Task Schedule ID --> { 'okay': bool or None, 'message': str }  (see parse_batch_response)
+		"""
+		if isinstance(task_schedule_ids, str):
+			task_schedule_ids = json.loads(task_schedule_ids)
+		response = SchedulerAPI().send_message(RequestType.cancel_task_schedules, content=list(task_schedule_ids),
+		                                       timeout=BATCH_TIMEOUT_SECONDS)
+		return parse_batch_response(response, task_schedule_ids)
 
-	def send_message(self, request_type: RequestType, content):
+	def send_message(self, request_type: RequestType, content, timeout=None):
 
 		if not isinstance(request_type, RequestType):
 			raise Exception("Argument 'request_type' must be an enum of RequestType.")
@@ -61,52 +100,229 @@ class SchedulerAPI():
 			'request_content': content
 		}
 		message_as_string = json.dumps(new_message)
-		return self._send_message_to_scheduler_socket(message_as_string)
+		return self._send_message_to_scheduler_socket(message_as_string, timeout=timeout)
 
-	def _send_message_to_scheduler_socket(self, message, debug=False):
+	@frappe.whitelist()
+	@staticmethod
+	def get_latency_statistics():
+		"""
+		Round-trip times (in milliseconds) of the most recent requests to the BTU Scheduler daemon.
 		"""
-		Establish a connection to the BTU scheduler daemon's Unix Domain Socket, and send a message.
+		samples = sorted(float(each) for each in get_redis_conn().lrange(_latency_key(), 0, -1))
+		if not samples:
+			return { "count": 0 }
+		return {
+			"count": len(samples),
+			"average_ms": round(sum(samples) / len(samples), 3),
+			"median_ms": samples[len(samples) // 2],
+			"p95_ms": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+			"max_ms": samples[-1]
+		}
+
+	def _send_message_to_scheduler_socket(self, message, debug=False, timeout=None):
+		"""
+		Send a message to the BTU scheduler daemon's Unix Domain Socket, and return its reply.
 		"""
 		if not isinstance(message, str):
 			raise TypeError("Argument 'message' must be a UTF-8 string.")
 
-		socket_str = frappe.db.get_single_value("BTU Configuration", "path_to_btu_scheduler_uds")
+		socket_str = frappe.db.get_single_value("BTU Configuration", "path_to_btu_scheduler_uds", cache=True)
 		if not socket_str:
 			raise ValueError("BTU Configuration is missing a path to the Unix Domain Socket for the scheduler daemon.")
 
-		# Create a UDS socket; connect to the port where the BTU Scheduler daemon is listening.
 		socket_path = pathlib.Path(socket_str)
 		if not socket_path.exists():
 			raise FileNotFoundError(f"Path to socket file does not exists: '{socket_path.absolute()}'")
 
+		protocol = frappe.db.get_single_value("BTU Configuration", "scheduler_protocol", cache=True) or "Legacy"
+		if protocol != "Framed":
+			return self._send_legacy_message(str(socket_path.absolute()), message, debug=debug, timeout=timeout)
+
+		connection = SchedulerConnection.for_path(str(socket_path.absolute()))
+		uds_response = None
+		try:
+			time_start = time.perf_counter()
+			uds_response = connection.request(message.encode('utf-8'), debug=debug, timeout=timeout)
+			_record_latency((time.perf_counter() - time_start) * 1000)
+			if debug:
+				print(f"Response (as bytes) from BTU Scheduler: {uds_response}")
+		except OSError as ex:
+			if not connection.is_connected():
+				return f"Exception while connecting to BTU Scheduler socket: {str(ex)}"
+			print(f"Exception while communicating with the BTU Scheduler daemon's Unix Domain Socket: {ex}")
+			connection.close()
+
+		if uds_response:
+			uds_response = uds_response.decode('utf-8')  # return UTF-8 string
+		return uds_response
+
+	@staticmethod
+	def _send_legacy_message(socket_path, message, debug=False, timeout=None):
+		"""
+		The original protocol, for scheduler daemons that do not support framing: a new connection for every request,
+		the message is sent as-is, and the reply is a single read.
+		"""
 		try:
 			scheduler_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-			scheduler_socket.settimeout(5)  # Very important, otherwise indefinite wait time.
-			scheduler_socket.connect(str(socket_path.absolute()))
+			scheduler_socket.settimeout(timeout or SOCKET_TIMEOUT_SECONDS)  # Very important, otherwise indefinite wait time.
+			scheduler_socket.connect(socket_path)
 			if debug:
 				print(f"Connected to BTU Scheduler daemon via Unix Domain Socket at '{socket_path}'")
-				print(f"Blocking: {scheduler_socket.getblocking()}")
-				print(f"Timeout: {scheduler_socket.gettimeout()}")
 		except Exception as ex:
 			return f"Exception while connecting to BTU Scheduler socket: {str(ex)}"
 
-		message_bytes = message.encode('utf-8')
 		uds_response = None
 		try:
-			bytes_sent = scheduler_socket.send(message_bytes)
+			time_start = time.perf_counter()
+			scheduler_socket.sendall(message.encode('utf-8'))
 			if debug:
-				print(f"Transmitted this quantity of bytes to UDS server: {bytes_sent}")
+				print(f"Transmitted this quantity of bytes to UDS server: {len(message.encode('utf-8'))}")
 			time.sleep(0.5)  # brief wait for server to reply
-			uds_response = scheduler_socket.recv(2048)  # response should be much smaller than 2kb
+			uds_response = scheduler_socket.recv(LEGACY_RECEIVE_BYTES)
+			_record_latency((time.perf_counter() - time_start) * 1000)
 			if debug:
 				print(f"Response (as bytes) from BTU Scheduler: {uds_response}")
 		except Exception as ex:
 			print(f"Exception while communicating with the BTU Scheduler daemon's Unix Domain Socket: {ex}")
 		finally:
 			scheduler_socket.close()
-			if debug:
-				print("Socket connection to BTU Scheduler daemon is now closed.")
 
 		if uds_response:
 			uds_response = uds_response.decode('utf-8')  # return UTF-8 string
 		return uds_response
+
+
+class SchedulerConnection():
+	"""
+	A reusable connection to the BTU Scheduler daemon's Unix Domain Socket.
+
+	Every request and response is a frame:  a 4-byte, unsigned, big-endian length, followed by that many bytes of UTF-8.
+	The connection stays open between requests.  If the daemon closed it in the meantime, it is reopened and the request
+	is sent again (once)
+	"""
+	_pool = {}  # (process id, socket path) --> SchedulerConnection
+	_pool_lock = threading.Lock()
+
+	def __init__(self, socket_path, timeout=SOCKET_TIMEOUT_SECONDS):
+		self.socket_path = socket_path
+		self.timeout = timeout
+		self._socket = None
+		self._lock = threading.Lock()  # One request at a time per connection.
+
+	@classmethod
+	def for_path(cls, socket_path):
+		"""
+		Returns the connection of this process for 'socket_path'.  A forked child process gets its own.
+		"""
+		key = (os.getpid(), socket_path)
+		with cls._pool_lock:
+			if key not in cls._pool:
+				cls._pool[key] = cls(socket_path)
+			return cls._pool[key]
+
+	def is_connected(self):
+		return self._socket is not None
+
+	def connect(self, debug=False):
+		new_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		new_socket.settimeout(self.timeout)  # Very important, otherwise indefinite wait time.
+		try:
+			new_socket.connect(self.socket_path)
+		except OSError:
+			new_socket.close()
+			raise
+		self._socket = new_socket
+		if debug:
+			print(f"Connected to BTU Scheduler daemon via Unix Domain Socket at '{self.socket_path}'")
+
+	def close(self):
+		if self._socket is not None:
+			try:
+				self._socket.close()
+			finally:
+				self._socket = None
+
+	def request(self, message_bytes, debug=False, timeout=None):
+		"""
+		Send one framed request, and return the bytes of the framed response.
+		Optionally, 'timeout' overrides the socket timeout for this request only.
+		"""
+		if len(message_bytes) > MAX_FRAME_BYTES:
+			raise ValueError(f"Message of {len(message_bytes)} bytes is larger than the maximum ({MAX_FRAME_BYTES})")
+		frame = _frame_header.pack(len(message_bytes)) + message_bytes
+		with self._lock:
+			reused = self._socket is not None
+			if not reused:
+				self.connect(debug=debug)
+			self._socket.settimeout(timeout or self.timeout)
+			try:
+				return self._round_trip(frame, debug)
+			except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+				# A pooled connection may have been closed by the daemon while it was idle.  Retry once, on a new one.
+				self.close()
+				if not reused:
+					raise
+				if debug:
+					print("The pooled connection was closed by the BTU Scheduler daemon.  Reconnecting.")
+				self.connect(debug=debug)
+				self._socket.settimeout(timeout or self.timeout)
+				return self._round_trip(frame, debug)
+
+	def _round_trip(self, frame, debug):
+		self._socket.sendall(frame)
+		if debug:
+			print(f"Transmitted this quantity of bytes to UDS server: {len(frame)}")
+		(response_length,) = _frame_header.unpack(self._receive_exactly(_frame_header.size))
+		if response_length > MAX_FRAME_BYTES:
+			self.close()
+			raise ConnectionAbortedError(f"Response of {response_length} bytes is larger than the maximum ({MAX_FRAME_BYTES})")
+		return self._receive_exactly(response_length)
+
+	def _receive_exactly(self, quantity):
+		buffer = bytearray(quantity)
+		view = memoryview(buffer)
+		received = 0
+		while received < quantity:
+			count = self._socket.recv_into(view[received:], quantity - received)
+			if not count:
+				raise ConnectionResetError("The BTU Scheduler daemon closed the connection.")
+			received += count
+		return bytes(buffer)
+
+
+def parse_batch_response(response, task_schedule_ids):
+	"""
+	The BTU Scheduler replies to a batch request with JSON:
+
+		{ "results": [ { "task_schedule_id": "TS000001", "okay": true, "message": "..." }, ... ] }
+
+	Returns a dictionary of Task Schedule ID --> { 'okay': bool or None, 'message': str }.  'okay' is only False when
+	the daemon explicitly reported a failure.  It is None for an ID missing from the reply (or without a boolean
+	'okay'), because nothing is known about its outcome.  Returns None if the reply is not a batch reply (for example,
+	the daemon does not support batch requests, or could not be reached)
+	"""
+	try:
+		results = json.loads(response)["results"]
+	except (TypeError, ValueError, KeyError):
+		return None
+	by_id = {}
+	for each in results:
+		okay = each.get("okay")
+		by_id[each["task_schedule_id"]] = { "okay": okay if isinstance(okay, bool) else None, "message": each.get("message") }
+	for each_id in task_schedule_ids:
+		by_id.setdefault(each_id, { "okay": None, "message": "No result from the BTU Scheduler daemon." })
+	return by_id
+
+
+def _latency_key():
+	return f"btu:{frappe.local.site}:scheduler_latency"
+
+
+def _record_latency(milliseconds):
+	"""
+	Keep the round-trip times of the most recent requests in Redis.  (see SchedulerAPI.get_latency_statistics)
+	"""
+	pipeline = get_redis_conn().pipeline(transaction=False)
+	pipeline.lpush(_latency_key(), round(milliseconds, 3))
+	pipeline.ltrim(_latency_key(), 0, LATENCY_SAMPLE_SIZE - 1)
+	pipeline.execute()
@@ -0,0 +1,33 @@
+# Copyright (c) 2026, Datahenge LLC and contributors
+# For license information, please see license.txt
+
+import unittest
+
+from btu.btu_api.payload_bundle import STATUS_ERROR, STATUS_OK, pack_bundle, unpack_bundle
+
+
+class TestPayloadBundle(unittest.TestCase):
+
+	def test_round_trip(self):
+		frames = [
+			("TASK-0001", "TS-0001", STATUS_OK, b"\x80\x05binary\x00payload"),
+			("TASK-0002", None, STATUS_OK, b""),
+			("TASK-ÄÖÜ", "TS-0003", STATUS_ERROR, b"No such BTU Task Schedule"),
+		]
+		self.assertEqual(unpack_bundle(pack_bundle(frames)), frames)
+
+	def test_text_payload_is_encoded(self):
+		self.assertEqual(unpack_bundle(pack_bundle([("TASK-0001", None, STATUS_ERROR, "Error: ß")])),
+		                 [("TASK-0001", None, STATUS_ERROR, "Error: ß".encode("utf-8"))])
+
+	def test_empty_bundle(self):
+		self.assertEqual(unpack_bundle(pack_bundle([])), [])
+
+	def test_wrong_magic_number_is_rejected(self):
+		with self.assertRaises(ValueError):
+			unpack_bundle(b"XXXX" + pack_bundle([])[4:])
+
+	def test_truncated_bundle_is_rejected(self):
+		data = pack_bundle([("TASK-0001", None, STATUS_OK, b"0123456789")])
+		with self.assertRaises(ValueError):
+			unpack_bundle(data[:-3])
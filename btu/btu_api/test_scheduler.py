@@ -0,0 +1,120 @@
+# Copyright (c) 2026, Datahenge LLC and contributors
+# For license information, please see license.txt
+
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+from btu.btu_api.scheduler import SchedulerConnection, parse_batch_response
+
+_frame_header = struct.Struct(">I")
+
+
+class FramedEchoServer():
+	"""
+	A stand-in for the BTU Scheduler daemon.  Replies to each framed request with the same bytes, repeated 'repeat' times.
+	After 'requests_per_connection' requests, it closes the connection, like a daemon closing an idle client.
+	"""
+
+	def __init__(self, socket_path, repeat=1, requests_per_connection=None):
+		self.repeat = repeat
+		self.requests_per_connection = requests_per_connection
+		self.connection_count = 0
+		self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self._listener.bind(socket_path)
+		self._listener.listen(1)
+		self._thread = threading.Thread(target=self._serve, daemon=True)
+		self._thread.start()
+
+	def _serve(self):
+		while True:
+			try:
+				client, _ = self._listener.accept()
+			except OSError:
+				return  # The listener was closed.
+			self.connection_count += 1
+			with client:
+				handled = 0
+				while self.requests_per_connection is None or handled < self.requests_per_connection:
+					header = self._receive_exactly(client, _frame_header.size)
+					if not header:
+						break
+					request = self._receive_exactly(client, _frame_header.unpack(header)[0])
+					reply = request * self.repeat
+					# Send the reply in small pieces, so the client must reassemble it.
+					data = _frame_header.pack(len(reply)) + reply
+					for index in range(0, len(data), 1000):
+						client.sendall(data[index:index + 1000])
+					handled += 1
+
+	@staticmethod
+	def _receive_exactly(client, quantity):
+		data = b""
+		while len(data) < quantity:
+			chunk = client.recv(quantity - len(data))
+			if not chunk:
+				return None
+			data += chunk
+		return data
+
+	def close(self):
+		self._listener.close()
+
+
+class TestSchedulerConnection(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+		self.addCleanup(directory.cleanup)
+		self.socket_path = os.path.join(directory.name, "btu_scheduler.sock")
+
+	def start_server(self, **kwargs):
+		server = FramedEchoServer(self.socket_path, **kwargs)
+		self.addCleanup(server.close)
+		connection = SchedulerConnection(self.socket_path, timeout=5)
+		self.addCleanup(connection.close)
+		return server, connection
+
+	def test_large_reply_is_read_completely(self):
+		_, connection = self.start_server(repeat=5000)
+		self.assertEqual(connection.request(b"pong "), b"pong " * 5000)
+
+	def test_connection_is_reused(self):
+		server, connection = self.start_server()
+		for each in range(3):
+			self.assertEqual(connection.request(f"ping {each}".encode()), f"ping {each}".encode())
+		self.assertEqual(server.connection_count, 1)
+
+	def test_reconnects_when_the_daemon_closed_the_connection(self):
+		server, connection = self.start_server(requests_per_connection=1)
+		self.assertEqual(connection.request(b"first"), b"first")
+		self.assertEqual(connection.request(b"second"), b"second")
+		self.assertEqual(server.connection_count, 2)
+
+	def test_oversized_request_is_rejected(self):
+		_, connection = self.start_server()
+		with self.assertRaises(ValueError):
+			connection.request(b"x" * (16 * 1024 * 1024 + 1))
+
+
+class TestParseBatchResponse(unittest.TestCase):
+
+	def test_only_explicit_failures_are_false(self):
+		response = json.dumps({ "results": [
+			{ "task_schedule_id": "TS000001", "okay": True, "message": "Reloaded" },
+			{ "task_schedule_id": "TS000002", "okay": False, "message": "Invalid cron" },
+			{ "task_schedule_id": "TS000003", "message": "No status" },
+		]})
+		results = parse_batch_response(response, ["TS000001", "TS000002", "TS000003", "TS000004"])
+		self.assertIs(results["TS000001"]["okay"], True)
+		self.assertIs(results["TS000002"]["okay"], False)
+		self.assertIsNone(results["TS000003"]["okay"])
+		self.assertIsNone(results["TS000004"]["okay"])  # Missing from the reply.
+
+	def test_reply_that_is_not_a_batch_reply(self):
+		self.assertIsNone(parse_batch_response("pong", ["TS000001"]))
+		self.assertIsNone(parse_batch_response(None, ["TS000001"]))
@@ -196,7 +196,7 @@ def email_on_task_conclusion(doc_task_log, send_via_queue=False):
 	doc_schedule = frappe.get_doc("BTU Task Schedule", doc_task_log.schedule)
 	for each_recipient in doc_schedule.email_recipients:
 
-		if doc_task_log.success_fail == 'Success' and not each_recipient.email_on_success:
+		if doc_task_log.success_fail in ('Success', 'Cached') and not each_recipient.email_on_success:
 			continue
 		if doc_task_log.success_fail == 'Failed' and not each_recipient.email_on_error:
 			continue
@@ -209,10 +209,12 @@ def email_on_task_conclusion(doc_task_log, send_via_queue=False):
 		# Create a string that represents the "Body" of the email:
 		body = f"Task {doc_task_log.task} : '{doc_task_log.task_desc_short}'\n"
 		body += f"Outcome: {doc_task_log.success_fail}\n\n"
-		if doc_task_log.result_message:
-			body += f"Function returned this Result:\n'{doc_task_log.result_message}'\n\n"
-		if doc_task_log.stdout:
-			body += f"Standard Output:\n{doc_task_log.stdout}"
+		result_message = doc_task_log.get_result_message()
+		stdout = doc_task_log.get_stdout()
+		if result_message:
+			body += f"Function returned this Result:\n'{result_message}'\n\n"
+		if stdout:
+			body += f"Standard Output:\n{stdout}"
 		if doc_task_log.success_fail == 'Timeout':
 			body += "\nTimeout!\n"
 			body += "Task has not returned results in a timely manner; it may have timed-out or died inside Python RQ."
@@ -6,17 +6,27 @@
 #
 # --------
 
-from contextlib import redirect_stdout
 import io
 import time
+import uuid
 import frappe
 
+from btu.btu_api import enqueue, enqueue_many
+from btu.btu_core import component_semaphore, payload_store
+from btu.btu_core.btu_worker import ensure_site_connection
+from btu.btu_core.component_group import record_component_result, record_group_payloads
+from btu.btu_core.run_metrics import RunMetrics
+from btu.btu_core.stdout_capture import redirect_task_stdout
+
 # pylint: disable=too-many-instance-attributes
 
+STDOUT_EXCERPT_LENGTH = 1000  # With the 'Aggregated' Component Log Mode, the last characters of standard output are kept.
+
 class TaskComponent():
 
 	def __init__(self, btu_task_id, btu_component_id, btu_task_schedule_id, frappe_site_name,
-				 function, queue='default', timeout=None, debug_mode=False, **kwargs):
+				 function, queue='default', timeout=None, debug_mode=False, max_concurrency=None,
+				 parent_log_name=None, **kwargs):
 		"""
 		Initialize the class instance.
 		"""
@@ -24,10 +34,13 @@ class TaskComponent():
 		self.btu_component_id = btu_component_id
 		self.btu_task_schedule_id = btu_task_schedule_id or None
 		self.function_to_run = function
-		self.max_runtime_seconds = 3600
+		self.max_runtime_seconds = int(timeout) if timeout else 3600  # The RQ Job timeout, in seconds.
 		self.queue_name = queue
 		self.timeout = timeout
 		self.debug_mode_enabled = bool(debug_mode)
+		self.group_id = None  # set by ComponentGroup.enqueue()
+		self.max_concurrency = max_concurrency  # Optional.  How many Components of the same parent may run at once.
+		self.parent_log_name = parent_log_name  # Optional.  Required for the 'Aggregated' Component Log Mode.
 		if kwargs:
 			self.kwarg_dict = kwargs
 		else:
@@ -53,9 +66,9 @@ class TaskComponent():
 		if self.debug_mode_enabled:
 			print(object_foo)
 
-	def enqueue(self):
+	def create_wrapper(self):
 		"""
-		Put this thingie into a queue.
+		Returns the TaskComponentWrapper whose 'function_payload' is placed into the queue.
 		"""
 		component_wrapper = TaskComponentWrapper(btu_task_id=self.btu_task_id,
 												 btu_component_id=self.btu_component_id,
@@ -67,14 +80,77 @@ class TaskComponent():
 		# This supports the idea of passing special keyword arguments to a Task:
 		if self.kwarg_dict:
 			component_wrapper.add_keyword_arguments(**self.kwarg_dict)  # pass them as kwargs
+		component_wrapper.group_id = self.group_id
+		component_wrapper.max_concurrency = self.max_concurrency
+		component_wrapper.parent_log_name = self.parent_log_name
+		component_wrapper.max_runtime_seconds = self.max_runtime_seconds  # Used when the wrapper defers itself.
+		return component_wrapper
+
+	def job_name(self):
+		return f"{self.btu_task_id}-{self.btu_component_id}"
+
+	def enqueue(self):
+		"""
+		Put this thingie into a queue.
+		"""
+		component_wrapper = self.create_wrapper()
 
-		# Use standard frappe.enqueue() to place the 'function_payload' into RQ.
-		frappe.enqueue(
-			method=component_wrapper.function_payload,
-			queue=self.queue_name,
-			timeout=self.max_runtime_seconds,
-			is_async=True
-		)
+		# Like frappe.enqueue(), place the 'function_payload' into RQ.  But executed by BTU, so a BTUWorker can keep connections warm.
+		enqueue(method=component_wrapper.function_payload,
+		        queue=self.queue_name,
+		        timeout=self.max_runtime_seconds,
+		        job_name=self.job_name())
+
+	@staticmethod
+	def enqueue_many(task_components, batch_size=1000, payload_ttl=payload_store.DEFAULT_TTL_SECONDS):
+		"""
+		Put many Task Components into their queues.  Much faster than calling enqueue() in a loop, because the
+		Jobs for each queue are sent to Redis in pipelines of 'batch_size', instead of one at a time.
+
+		Large keyword arguments are written to Redis once, and the Jobs only carry a reference.  (see payload_store.py)
+
+		Returns the number of Task Components enqueued.
+		"""
+		wrappers = [ (each_component, each_component.create_wrapper()) for each_component in task_components ]
+		by_group = {}  # Each group holds one reference to its payloads, and releases it when the group finishes.
+		for each_component, wrapper in wrappers:
+			by_group.setdefault(each_component.group_id, []).append(wrapper.kwarg_dict)
+		for group_id, kwarg_dicts in by_group.items():
+			digests = payload_store.store_kwargs(kwarg_dicts, ttl_seconds=payload_ttl)
+			if group_id:
+				record_group_payloads(group_id, digests)  # Before any Component can run, and finish the group.
+
+		by_queue = {}  # (queue name, timeout) --> list of Jobs
+		for each_component, wrapper in wrappers:
+			job = (wrapper.function_payload, each_component.job_name(), None)
+			by_queue.setdefault((each_component.queue_name, each_component.max_runtime_seconds), []).append(job)
+
+		for (queue_name, timeout), jobs in by_queue.items():
+			enqueue_many(jobs, queue=queue_name, timeout=timeout, batch_size=batch_size)
+		return sum(len(jobs) for jobs in by_queue.values())
+
+	@staticmethod
+	def map(function, iterable, btu_task_id, chunk_size=100, max_in_flight=4, btu_task_schedule_id=None, queue='default',  # pylint: disable=too-many-arguments
+	        adaptive=True, target_overhead_fraction=0.05, wait_timeout=3600):
+		"""
+		Call 'function' once for every item in 'iterable', using Task Components that each process a chunk of items.
+		Intended for the run() method of a BTU_AWARE_FUNCTION.  Returns when every chunk has finished.
+
+		  * The iterable is read lazily, so it can be very large (for example, a generator of a million item codes)
+		  * Only 'max_in_flight' chunks are in the queue at once.  New chunks are enqueued as earlier ones finish.
+		  * When 'adaptive' is True, 'chunk_size' is only the first chunk's size.  Later chunks are sized so each
+		    Task Component's overhead is about 'target_overhead_fraction' of its run time.
+		  * If no chunk finishes within 'wait_timeout' seconds, TimeoutError is raised.  The wait is also limited to the time
+		    remaining before the calling Task's 'max_task_duration'
+
+		NOTE: The caller waits for the chunks.  So 'queue' must be served by Workers other than the one running the caller.
+
+		Returns a dictionary with keys 'chunks', 'items', 'failed_chunks', and 'final_chunk_size'
+		"""
+		from btu.btu_core.component_map import map_components
+		return map_components(btu_task_id, function, iterable, chunk_size=chunk_size, max_in_flight=max_in_flight,
+		                      btu_task_schedule_id=btu_task_schedule_id, queue=queue, adaptive=adaptive,
+		                      target_overhead_fraction=target_overhead_fraction, wait_timeout=wait_timeout)
 
 
 class TaskComponentWrapper():
@@ -95,6 +171,13 @@ class TaskComponentWrapper():
 		self.debug_mode_enabled = bool(debug_mode_enabled)
 		self.kwarg_dict = None
 		self.max_runtime_seconds = 3600
+		self.task_log_name = None
+		self.write_behind = False
+		self.group_id = None
+		self.max_concurrency = None
+		self.deferrals = 0  # How many times this Component waited for a free slot.
+		self.parent_log_name = None
+		self.aggregated = False  # When True, only a failure gets its own BTU Task Log.
 
 	def add_keyword_arguments(self, **kwargs):
 		if kwargs:
@@ -110,7 +193,7 @@ class TaskComponentWrapper():
 		if self.debug_mode_enabled:
 			print(object_foo)
 
-	def function_payload(self):  # pylint: disable=too-many-locals, too-many-statements
+	def function_payload(self):
 		"""
 		This function is effectively a 'decorator' or 'wrapper' around some other Python function.
 		The code below is complex and very important.
@@ -118,6 +201,52 @@ class TaskComponentWrapper():
 		To help debug and explain what is happening, I've included a 'dprint()' function.
 		This function only prints when TaskRunner argument 'enable_debug_mode' is True.
 		"""
+		self.dprint("\n-------- Begin execution of 'function_payload()' --------\n")
+
+		ensure_site_connection(self.frappe_site_name)  # does nothing if execute_job() already connected to this Site.
+		self.dprint("\u2713 Initialization complete.")
+
+		semaphore_token = None
+		if self.max_concurrency:
+			# Limit how many Components of the same parent run at once.  Over the limit, try again later.
+			semaphore_token = uuid.uuid4().hex
+			if not component_semaphore.try_acquire(self.concurrency_scope(), self.max_concurrency, semaphore_token,
+			                                       lease_seconds=self.max_runtime_seconds + 60):
+				self.defer()
+				return
+		try:
+			self.run_payload()
+		finally:
+			if semaphore_token:
+				component_semaphore.release(self.concurrency_scope(), semaphore_token)
+
+	def concurrency_scope(self):
+		"""
+		Components in a ComponentGroup share the group's limit.  Otherwise, they share their parent BTU Task's limit.
+		"""
+		return self.group_id or self.btu_task_id
+
+	def defer(self):
+		"""
+		Re-enqueue this Component with a delay, instead of waiting inside the Worker for a free slot.
+		"""
+		from rq import get_current_job
+		from btu.btu_api import enqueue_in  # late import required, due to circular reference risks.
+
+		delay_seconds = component_semaphore.defer_delay(self.deferrals)
+		self.deferrals += 1
+		rq_job = get_current_job()
+		enqueue_in(delay_seconds,
+		           method=self.function_payload,
+		           queue=rq_job.origin if rq_job else 'default',
+		           timeout=self.max_runtime_seconds,
+		           job_name=f"{self.btu_task_id}-{self.btu_component_id}")
+		self.dprint(f"{self.max_concurrency} Components of '{self.concurrency_scope()}' are already running.  Deferred by {delay_seconds} seconds.")
+
+	def run_payload(self):  # pylint: disable=too-many-locals, too-many-statements
+		"""
+		Call the function, capturing its standard output, then write the results to BTU Task Log.
+		"""
 		# I'm not confident that importing here (instead of the module level) makes any difference.
 		# Still, it "feels right", given this function is executed independently by the Queue.
 		# It's possible that Python + RQ pickle the entire Class and namespace, though.
@@ -125,12 +254,8 @@ class TaskComponentWrapper():
 
 		from btu import Result, get_system_datetime_now, make_datetime_naive
 		from btu.btu_core.doctype.btu_task_log.btu_task_log import write_log_for_task
-
-		self.dprint("\n-------- Begin execution of 'function_payload()' --------\n")
-
-		frappe.init(site=self.frappe_site_name)
-		frappe.connect()
-		self.dprint("\u2713 Initialization complete.")
+		from btu.btu_core.stdout_capture import delete_live_output, live_tail
+		from btu.btu_core.task_runner import run_if_awaitable
 
 		function_result = None
 		self.dprint(f"Calling function '{self.function_to_run.__name__}'")
@@ -139,20 +264,30 @@ class TaskComponentWrapper():
 		start_datetime = make_datetime_naive(get_system_datetime_now()) # Recording this in the System Time Zone
 		self.create_new_log(start_datetime)  # Create a new BTU Task Log, with a status of "In Progress"
 		execution_start = time.time()
+		run_metrics = RunMetrics().start()  # CPU time and peak memory of this run.
 
+		stdout_buffer_for_log = None
+		live_tail_enabled = False
 		try:
-			stdout_buffer_for_log = None
 			self.dprint(f"Keyword arguments are as follows: {self.kwarg_dict}")
 			datetime_string = get_system_datetime_now().strftime("%m/%d/%Y, %H:%M:%S %Z")
 
 			buffer = io.StringIO()
-			with redirect_stdout(buffer):
-				print(f"--------\nBTU Task Component {self.btu_task_id}-{self.btu_component_id} starting at: {datetime_string}")
-				if self.kwarg_dict:
-					ret = self.function_to_run (**self.kwarg_dict)  # ----call the underlying function----
-				else:
-					ret = self.function_to_run()  # ----call the underlying function----
-				stdout_buffer_for_log = buffer.getvalue()  	 # fetch any Stdout from the buffer.
+			writer = live_tail(buffer, self.task_log_name)  # optionally, also copy lines to Redis while the function runs.
+			live_tail_enabled = writer is not buffer
+			with redirect_task_stdout(writer):
+				try:
+					print(f"--------\nBTU Task Component {self.btu_task_id}-{self.btu_component_id} starting at: {datetime_string}")
+					if self.kwarg_dict:
+						kwargs = payload_store.resolve_kwargs(self.kwarg_dict)  # large, shared values are stored by reference.
+						ret = self.function_to_run (**kwargs)  # ----call the underlying function----
+					else:
+						ret = self.function_to_run()  # ----call the underlying function----
+					ret = run_if_awaitable(ret)  # 'async def' functions are run on an event loop.
+				finally:
+					if live_tail_enabled:
+						writer.close()
+					stdout_buffer_for_log = buffer.getvalue()  	 # fetch any Stdout from the buffer, even if the function failed.
 
 			execution_time = round(time.time() - execution_start,3)
 			function_result = Result(True, ret, execution_time=execution_time)
@@ -163,16 +298,31 @@ class TaskComponentWrapper():
 			function_result = Result(False, str(ex), execution_time=execution_time)
 
 		self.dprint(f"\nEnd Standard Output\nFunction Result: {function_result}")
+		run_metrics = run_metrics.stop()
 
 		# The final step is to update BTU Task Log, and record the results!
 		self.dprint("Attempting to write to BTU Task Logs:")
-		new_log_id = write_log_for_task(task_id=self.btu_task_id,
-							            result=function_result,
-										log_name=self.task_log_name,
-							            stdout=stdout_buffer_for_log or None,
-							            date_time_started=start_datetime,
-										schedule_id=self.btu_task_schedule_id)
-		self.dprint(f"Updated the BTU Task Log record: '{new_log_id}'")
+		if self.aggregated and function_result.okay:
+			new_log_id = None
+		else:
+			new_log_id = write_log_for_task(task_id=self.btu_task_id,
+								            result=function_result,
+											log_name=self.task_log_name,
+								            stdout=stdout_buffer_for_log or None,
+								            date_time_started=start_datetime,
+											schedule_id=self.btu_task_schedule_id,
+											task_component=self.btu_component_id,
+											write_behind=self.write_behind,
+											run_metrics=run_metrics)
+			self.dprint(f"Updated the BTU Task Log record: '{new_log_id}'")
+		if self.aggregated:
+			self.append_component_result(function_result, stdout_buffer_for_log, failure_log=new_log_id)
+			new_log_id = new_log_id or self.parent_log_name
+		if self.group_id:
+			# Count this Component as finished.  If it was the last one in its group, this also completes the group.
+			record_component_result(self.group_id, self.btu_component_id, new_log_id, function_result.okay, function_result.message)
+		if live_tail_enabled:
+			delete_live_output(self.task_log_name)  # The complete output is now in the BTU Task Log.
 		self.dprint("\n-------- End function_wrapper --------\n")
 
 	def create_new_log(self, date_time_started):
@@ -183,7 +333,27 @@ class TaskComponentWrapper():
 		The continued existing of a Log with the status 'In Progress' is a good indicator to administrators that
 		the BTU Task failed inside the RQ, and will never return a result.
 		"""
-		task_description = frappe.get_value("BTU Task", self.btu_task_id, "desc_short")
+		from btu.btu_core import task_log_stream
+
+		task_description, component_log_mode = frappe.get_value("BTU Task", self.btu_task_id,
+		                                                        ["desc_short", "component_log_mode"]) or (None, None)
+		self.write_behind = task_log_stream.is_write_behind_enabled()
+		if component_log_mode == "Aggregated" and self.parent_log_name:
+			# No Log yet.  The outcome becomes a row on the parent's Log; a failure also gets a Log of its own.
+			self.aggregated = True
+			return
+		if self.write_behind:
+			# Append a 'start' event to the Redis stream; the drainer job will write it to SQL later.
+			self.task_log_name = task_log_stream.append_log_event("start", task_log_stream.new_log_name(),
+			                                                      task=self.btu_task_id,
+			                                                      task_desc_short=task_description,
+			                                                      task_component=self.btu_component_id,
+			                                                      schedule=self.btu_task_schedule_id,
+			                                                      date_time_started=date_time_started,
+			                                                      success_fail='In-Progress')
+			self.dprint(f"Appended a new BTU Task Log event for a Component to the Redis stream: '{self.task_log_name}'")
+			return
+
 		new_log = frappe.new_doc("BTU Task Log")  # Create a new Log.
 		new_log.task = self.btu_task_id
 		new_log.task_desc_short = task_description
@@ -195,3 +365,18 @@ class TaskComponentWrapper():
 		frappe.db.commit()
 		self.dprint(f"Created a new BTU Task Log record for a Component: '{new_log.name}'")
 		self.task_log_name = new_log.name
+
+	def append_component_result(self, function_result, stdout, failure_log=None):
+		"""
+		Record the outcome of this Component as a row of the parent Log's 'Component Results'.  The rows are written
+		in batches by the Task Log stream drainer.
+		"""
+		from btu.btu_core import task_log_stream
+
+		task_log_stream.append_component_event(self.parent_log_name,
+		                                       component=str(self.btu_component_id),
+		                                       status="Success" if function_result.okay else "Failed",
+		                                       execution_time=function_result.execution_time,
+		                                       failure_log=failure_log,
+		                                       stdout_excerpt=stdout[-STDOUT_EXCERPT_LENGTH:] if stdout else None)
+		self.dprint(f"Appended the result of this Component to the parent BTU Task Log '{self.parent_log_name}'")
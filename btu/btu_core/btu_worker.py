@@ -0,0 +1,243 @@
+""" btu_worker.py """
+
+# --------
+#
+# A persistent, non-forking RQ Worker for BTU.
+#
+# The standard RQ Worker forks a new "work horse" process for every Job.  Each Job then connects to the Site's
+# database, and disconnects again when finished.  For many short Tasks, that overhead dominates the wall time.
+#
+# The BTUWorker executes Jobs inside its own process, and keeps one database connection per Site open between Jobs.
+# Request-local state (frappe.local) is still released after every Job.  After 'max_jobs' the Worker exits, so a
+# process manager (e.g. supervisor) can start a fresh one.
+#
+# --------
+
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+import threading
+
+import frappe
+from rq.timeouts import BaseDeathPenalty, JobTimeoutException
+from rq.utils import utcnow
+from rq.worker import SimpleWorker, WorkerStatus
+
+_thread_state = threading.local()  # Each thread keeps its own warm connections: Site Name --> frappe Database
+_opened_connections = []  # Every warm connection opened by any thread, so they can all be closed when the Worker stops.
+_opened_connections_lock = threading.Lock()
+_warm_mode = False  # pylint: disable=invalid-name
+
+
+def _warm_connections():
+	if not hasattr(_thread_state, "connections"):
+		_thread_state.connections = {}
+	return _thread_state.connections
+
+
+def is_warm_mode():
+	"""
+	Returns True when the current process is a BTUWorker that keeps Site connections open.
+	"""
+	return _warm_mode
+
+
+def connect_site(site_name):
+	"""
+	Initialize the frappe namespace for a Site, reusing an open database connection if one exists.
+	"""
+	if not _warm_mode:
+		frappe.connect(site_name)
+		return
+
+	frappe.init(site=site_name)
+	warm_db = _warm_connections().get(site_name)
+	if warm_db:
+		try:
+			warm_db.sql("SELECT 1")  # The server may have closed an idle connection.
+		except Exception:
+			_close_quietly(warm_db)
+			warm_db = None
+
+	if warm_db:
+		frappe.local.db = warm_db
+		frappe.set_user("Administrator")
+	else:
+		frappe.connect()
+		_warm_connections()[site_name] = frappe.local.db
+		with _opened_connections_lock:
+			_opened_connections.append(frappe.local.db)
+
+
+def release_site():
+	"""
+	Release request-local state after a Job.  In warm mode, the database connection is kept open for the next Job.
+	"""
+	if _warm_mode and getattr(frappe.local, "db", None):
+		frappe.db.rollback()  # Never carry an open transaction into the next Job.
+		frappe.local.db = None  # Detach, so frappe.destroy() does not close the connection.
+	frappe.destroy()
+
+
+def ensure_site_connection(site_name):
+	"""
+	Used by TaskRunner and TaskComponentWrapper.  Only initializes and connects when the current
+	context is not already connected to the Site.
+	"""
+	if getattr(frappe.local, "site", None) == site_name and getattr(frappe.local, "db", None):
+		return
+	frappe.init(site=site_name)
+	frappe.connect()
+
+
+def close_warm_connections():
+	"""
+	Close the warm connections opened by every thread.  Only call this when no Jobs are running.
+	"""
+	with _opened_connections_lock:
+		for each_db in _opened_connections:
+			_close_quietly(each_db)
+		_opened_connections.clear()
+	_warm_connections().clear()
+
+
+def raise_in_thread(thread_id, exception_class):
+	"""
+	Asynchronously raise 'exception_class' in another thread.  It is delivered when that thread next executes Python bytecode.
+	Passing None clears an exception that was raised, but not yet delivered.
+	"""
+	ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id),
+	                                           ctypes.py_object(exception_class) if exception_class else None)
+
+
+def _close_quietly(database):
+	try:
+		database.close()
+	except Exception:
+		pass
+
+
+class BTUWorker(SimpleWorker):
+	"""
+	A non-forking RQ Worker that keeps Site connections warm across Jobs.
+	"""
+
+	def work(self, *args, **kwargs):  # pylint: disable=signature-differs
+		global _warm_mode  # pylint: disable=global-statement, invalid-name
+		_warm_mode = True
+		try:
+			return super().work(*args, **kwargs)
+		finally:
+			_warm_mode = False
+			close_warm_connections()
+
+
+class ThreadDeathPenalty(BaseDeathPenalty):
+	"""
+	RQ's default death penalty uses SIGALRM, which only works in the main thread.
+	This one uses a Timer to raise JobTimeoutException asynchronously inside the thread running the Job.
+	"""
+
+	def __init__(self, timeout, exception=JobTimeoutException, **kwargs):
+		super().__init__(timeout, exception=exception, **kwargs)
+		self._target_thread_id = threading.current_thread().ident
+		self._timer = None
+
+	def setup_death_penalty(self):
+		if self._timeout <= 0:
+			return
+		self._timer = threading.Timer(self._timeout, self._raise_in_thread)
+		self._timer.daemon = True
+		self._timer.start()
+
+	def cancel_death_penalty(self):
+		if self._timer:
+			self._timer.cancel()
+			self._timer = None
+		# The Timer may have fired just as the Job finished.  Discard that exception, so it is not raised in the next Job.
+		raise_in_thread(self._target_thread_id, None)
+
+	def _raise_in_thread(self):
+		raise_in_thread(self._target_thread_id, self._exception)
+
+
+class BTUThreadedWorker(BTUWorker):
+	"""
+	A BTUWorker that runs up to 'threads' Jobs at the same time, each in its own thread.
+	Intended for I/O-bound Tasks.  Standard output is captured per Task (see stdout_capture.redirect_task_stdout)
+	"""
+	death_penalty_class = ThreadDeathPenalty
+
+	def __init__(self, *args, threads=4, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.thread_count = max(int(threads), 1)
+		self._executor = ThreadPoolExecutor(max_workers=self.thread_count, thread_name_prefix="btu-job",
+		                                    initializer=self._initialize_thread)
+		self._slots = threading.BoundedSemaphore(self.thread_count)
+
+	@staticmethod
+	def _initialize_thread():
+		from btu.btu_core.stdout_capture import install_stdout_router
+		install_stdout_router()
+
+	def execute_job(self, job, queue):
+		"""
+		Instead of running the Job immediately, hand it to the thread pool.
+		Blocks only when all threads are busy, so the Worker never dequeues more Jobs than it can run.
+		Only this (main) thread changes the Worker's state in Redis; the pool threads only update their Jobs.
+		"""
+		# While waiting for a free thread, keep the Worker registered.
+		while not self._slots.acquire(timeout=max(self.worker_ttl // 3, 1)):  # pylint: disable=consider-using-with
+			self.heartbeat()
+		self.set_state(WorkerStatus.BUSY)
+		self._executor.submit(self._perform_job_in_thread, job, queue)
+
+	def _perform_job_in_thread(self, job, queue):
+		try:
+			self.perform_job(job, queue)  # The thread's connections stay warm for its next Job.
+		finally:
+			self._slots.release()
+
+	def prepare_job_execution(self, job, *args, **kwargs):  # pylint: disable=unused-argument
+		"""
+		Runs in a pool thread.  Unlike SimpleWorker, only marks the Job as started; the Worker itself is left alone.
+		"""
+		heartbeat_ttl = self.get_heartbeat_ttl(job)
+		with self.connection.pipeline() as pipeline:
+			job.heartbeat(utcnow(), heartbeat_ttl, pipeline=pipeline)
+			job.prepare_for_execution(self.name, pipeline=pipeline)
+			pipeline.execute()
+
+	def set_current_job_id(self, job_id, pipeline=None):
+		# Several Jobs run at once, so there is no single 'current job'.  RQ calls this from the pool threads; ignore it.
+		pass
+
+	def set_current_job_working_time(self, current_job_working_time, pipeline=None):
+		pass
+
+	def register_death(self):
+		# Before the Worker is unregistered (and its connections are closed), wait for the running Jobs to finish.
+		self._executor.shutdown(wait=True)
+		super().register_death()
+
+
+def start_worker(queue=None, max_jobs=1000, burst=False, quiet=False, threads=1):
+	"""
+	Start a BTUWorker.  Based on 'frappe.utils.background_jobs.start_worker'
+	"""
+	from rq import Connection
+	from frappe.utils.background_jobs import get_queue_list, get_redis_conn, get_worker_name
+
+	with frappe.init_site():
+		redis_connection = get_redis_conn()
+		if queue:
+			queue = [ each.strip() for each in queue.split(",") ]
+		queues = get_queue_list(queue)
+
+	with Connection(redis_connection):
+		logging_level = "WARNING" if quiet else "INFO"
+		worker_name = get_worker_name(f"btu.{queue[0] if queue else 'all'}")
+		if threads and int(threads) > 1:
+			worker = BTUThreadedWorker(queues, name=worker_name, threads=threads)
+		else:
+			worker = BTUWorker(queues, name=worker_name)
+		worker.work(logging_level=logging_level, burst=burst, max_jobs=max_jobs or None)
@@ -0,0 +1,159 @@
+""" component_group.py """
+
+# --------
+#
+# Fan-out / fan-in for Task Components.
+#
+# A ComponentGroup enqueues many Task Components, and counts their completions atomically in Redis.  When the last
+# Component finishes, it:
+#
+#   1. Writes a rolled-up status (total, succeeded, failed) to the parent's BTU Task Log.
+#   2. Optionally enqueues a callback function, or a follow-up BTU Task, with the collected results.
+#
+# Usage (inside the run() method of a BTU_AWARE_FUNCTION):
+#
+#	group = ComponentGroup(self.btu_task_id, parent_log_name=self.btu_task_log_name, callback="my_app.my_module.summarize")
+#	group.enqueue([ TaskComponent(...), TaskComponent(...), ... ])
+#
+# The callback is called with one keyword argument, 'component_results'.  It is a list of dictionaries, with the keys
+# 'component', 'log_name', 'okay' and 'message'.  A follow-up BTU Task receives the same keyword argument.
+#
+# --------
+
+import json
+
+import frappe
+from frappe.utils.background_jobs import get_redis_conn
+
+from btu.btu_core import payload_store, task_log_stream
+
+GROUP_TTL_SECONDS = 7 * 86400  # If a Worker dies, its group never completes.  Eventually, Redis discards it.
+
+
+def _group_key(group_id):
+	return f"btu:{frappe.local.site}:component_group:{group_id}"
+
+
+def _results_key(group_id):
+	return f"btu:{frappe.local.site}:component_group:{group_id}:results"
+
+
+class ComponentGroup():
+
+	def __init__(self, btu_task_id, parent_log_name=None, callback=None, callback_task=None, queue='default',
+	             max_concurrency=None):
+		"""
+		Arguments:
+			btu_task_id:  The BTU Task that spawns the Components.
+			parent_log_name:  The BTU Task Log that receives the rolled-up status.  For a BTU_AWARE_FUNCTION, this is 'self.btu_task_log_name'
+			callback:  Optional.  Dotted path to a function, enqueued when every Component has finished.
+			callback_task:  Optional.  Name of a BTU Task, enqueued when every Component has finished.
+			queue:  The queue for the callback.
+			max_concurrency:  Optional.  How many of the group's Components may run at the same time.
+		"""
+		if callback and callback_task:
+			raise ValueError("A ComponentGroup can have a 'callback' or a 'callback_task', but not both.")
+		self.btu_task_id = btu_task_id
+		self.parent_log_name = parent_log_name
+		self.callback = callback
+		self.callback_task = callback_task
+		self.queue_name = queue
+		self.max_concurrency = max_concurrency
+		self.group_id = frappe.generate_hash(length=16)
+
+	def enqueue(self, task_components, batch_size=1000):
+		"""
+		Register the group in Redis, then enqueue all of its Task Components.
+		"""
+		from btu.btu_core.btu_task_component import TaskComponent  # late import required, due to circular reference risks.
+
+		task_components = list(task_components)
+		pipeline = get_redis_conn().pipeline()
+		pipeline.hset(_group_key(self.group_id), mapping={
+			"btu_task_id": self.btu_task_id,
+			"parent_log_name": self.parent_log_name or "",
+			"callback": self.callback or "",
+			"callback_task": self.callback_task or "",
+			"queue_name": self.queue_name,
+			"total": len(task_components),
+			"remaining": len(task_components)
+		})
+		pipeline.expire(_group_key(self.group_id), GROUP_TTL_SECONDS)
+		pipeline.execute()
+
+		_write_rollup(self.parent_log_name, component_status="Running", components_total=len(task_components),
+		              components_succeeded=0, components_failed=0)
+		if not task_components:
+			finish_group(self.group_id)
+			return 0
+
+		for each_component in task_components:
+			each_component.group_id = self.group_id
+			each_component.parent_log_name = each_component.parent_log_name or self.parent_log_name
+			each_component.max_concurrency = each_component.max_concurrency or self.max_concurrency
+		# Shared keyword arguments live as long as the group can.
+		return TaskComponent.enqueue_many(task_components, batch_size=batch_size, payload_ttl=GROUP_TTL_SECONDS)
+
+
+def record_group_payloads(group_id, digests):
+	"""
+	Remember the payloads (see payload_store.py) used by the group's Components, so finish_group() can release them.
+	"""
+	if not digests:
+		return
+	get_redis_conn().hset(_group_key(group_id), "payload_digests", json.dumps(list(digests)))
+
+
+def record_component_result(group_id, component_id, log_name, okay, message):
+	"""
+	Called by TaskComponentWrapper after each Component finishes.  The Component that finishes last completes the group.
+	"""
+	result = json.dumps({ "component": component_id, "log_name": log_name, "okay": bool(okay), "message": message }, default=str)
+	pipeline = get_redis_conn().pipeline()  # MULTI/EXEC, so a result is always stored before the counter reaches zero.
+	pipeline.rpush(_results_key(group_id), result)
+	pipeline.expire(_results_key(group_id), GROUP_TTL_SECONDS)
+	pipeline.hincrby(_group_key(group_id), "remaining", -1)
+	remaining = pipeline.execute()[-1]
+	if remaining == 0:
+		finish_group(group_id)
+
+
+def finish_group(group_id):
+	"""
+	Write the rolled-up status to the parent's BTU Task Log, then enqueue the callback (if any)
+	"""
+	from btu.btu_api import enqueue  # late import required, due to circular reference risks.
+
+	conn = get_redis_conn()
+	group = { key.decode(): value.decode() for key, value in conn.hgetall(_group_key(group_id)).items() }
+	component_results = [ json.loads(each) for each in conn.lrange(_results_key(group_id), 0, -1) ]
+	conn.delete(_group_key(group_id), _results_key(group_id))
+	if not group:
+		return  # The group expired.
+	# Every Component has finished, so none needs its keyword arguments any more.
+	payload_store.release_payloads(json.loads(group.get("payload_digests") or "[]"))
+
+	failed_count = len([ each for each in component_results if not each["okay"] ])
+	_write_rollup(group["parent_log_name"],
+	              component_status="Failed" if failed_count else "Success",
+	              components_total=int(group["total"]),
+	              components_succeeded=len(component_results) - failed_count,
+	              components_failed=failed_count)
+
+	if group["callback"]:
+		enqueue(method=group["callback"], queue=group["queue_name"], job_name=f"{group['btu_task_id']}-callback",
+		        component_results=component_results)
+	elif group["callback_task"]:
+		frappe.get_doc("BTU Task", group["callback_task"]).push_task_into_queue(
+			extra_arguments={ "component_results": component_results })
+
+
+def _write_rollup(parent_log_name, **values):
+	if not parent_log_name:
+		return
+	if task_log_stream.is_write_behind_enabled():
+		task_log_stream.append_log_event("update", parent_log_name, **values)
+	else:
+		# Only these columns; the parent's TaskRunner may be writing the rest of its Log at the same time.
+		frappe.db.set_value("BTU Task Log", parent_log_name, values, update_modified=False)
+		frappe.db.commit()
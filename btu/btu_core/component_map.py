@@ -0,0 +1,146 @@
+""" component_map.py """
+
+# --------
+#
+# A chunked 'map' over a large iterable, using Task Components.  See TaskComponent.map()
+#
+#   * The iterable is consumed lazily, one chunk at a time.  It is never converted into a list.
+#   * At most 'max_in_flight' chunks are enqueued at once.  Another chunk is enqueued only when an earlier one finishes.
+#     The parent waits with a blocking Redis pop (BLPOP); it does not poll.  The wait never extends past the parent
+#     Task's own deadline ('max_task_duration'), because a thread blocked inside BLPOP cannot receive TaskSoftTimeout.
+#   * When 'adaptive' is True, the chunk size is adjusted using the observed time per item.  The goal is that the fixed
+#     overhead of each Task Component (enqueue, Task Log, etc.) stays below 'target_overhead_fraction' of its run time.
+#
+# --------
+
+import itertools
+import json
+import math
+import time
+
+import frappe
+from frappe.utils.background_jobs import get_redis_conn
+
+from btu.btu_core.task_deadline import get_remaining_seconds
+
+MAP_TTL_SECONDS = 86400
+
+
+def _done_key(map_id, site_name=None):
+	return f"btu:{site_name or frappe.local.site}:component_map:{map_id}"
+
+
+def run_map_chunk(map_function, items, map_id, chunk_number):
+	"""
+	The function executed by each Task Component.  Calls 'map_function' once per item, then tells the parent this chunk is done.
+	"""
+	chunk_start = time.monotonic()
+	okay = False
+	try:
+		for each_item in items:
+			map_function(each_item)
+		okay = True
+	finally:
+		message = { "chunk": chunk_number, "items": len(items), "seconds": time.monotonic() - chunk_start, "okay": okay }
+		pipeline = get_redis_conn().pipeline()
+		pipeline.rpush(_done_key(map_id), json.dumps(message))
+		pipeline.expire(_done_key(map_id), MAP_TTL_SECONDS)
+		pipeline.execute()
+	return f"Processed {len(items)} items."
+
+
+class ChunkSizer():
+	"""
+	Chooses the size of the next chunk.  With adaptive sizing, the size is recalculated after each chunk finishes:
+
+		chunk size = component overhead / (target overhead fraction * average seconds per item)
+	"""
+
+	def __init__(self, chunk_size, adaptive=True, target_overhead_fraction=0.05, component_overhead_seconds=0.25,
+	             min_chunk_size=1, max_chunk_size=10000):
+		self.chunk_size = max(int(chunk_size), 1)
+		self.adaptive = adaptive
+		self.target_overhead_fraction = target_overhead_fraction
+		self.component_overhead_seconds = component_overhead_seconds
+		self.min_chunk_size = min_chunk_size
+		self.max_chunk_size = max_chunk_size
+		self._seconds_per_item = None
+
+	def observe(self, item_count, seconds):
+		if not self.adaptive or not item_count:
+			return
+		observed = seconds / item_count
+		# An exponential moving average, so one unusual chunk does not swing the size too much.
+		self._seconds_per_item = observed if self._seconds_per_item is None else (0.7 * self._seconds_per_item + 0.3 * observed)
+		if self._seconds_per_item > 0:
+			ideal = math.ceil(self.component_overhead_seconds / (self.target_overhead_fraction * self._seconds_per_item))
+		else:
+			ideal = self.max_chunk_size  # The items are effectively free; use the largest chunks allowed.
+		self.chunk_size = min(max(ideal, self.min_chunk_size), self.max_chunk_size)
+
+
+def _clamp_to_deadline(wait_timeout):
+	"""
+	Returns whole seconds to wait: 'wait_timeout', but no longer than the time left before the parent Task's deadline.
+	Returns 0 if the deadline has already passed.  (For BLPOP, a timeout of 0 would mean "wait forever")
+	"""
+	remaining = get_remaining_seconds()
+	timeout = max(int(wait_timeout), 1)
+	if remaining is not None:
+		timeout = min(timeout, math.ceil(remaining))
+	return timeout
+
+
+def map_components(btu_task_id, function, iterable, chunk_size=100, max_in_flight=4, btu_task_schedule_id=None,  # pylint: disable=too-many-arguments, too-many-locals
+                   queue='default', adaptive=True, target_overhead_fraction=0.05, wait_timeout=3600):
+	"""
+	Implements TaskComponent.map().  Returns a dictionary summarizing the chunks.
+	"""
+	from btu.btu_core.btu_task_component import TaskComponent  # late import required, due to circular reference risks.
+
+	map_id = frappe.generate_hash(length=16)
+	sizer = ChunkSizer(chunk_size, adaptive=adaptive, target_overhead_fraction=target_overhead_fraction)
+	items_iterator = iter(iterable)
+	conn = get_redis_conn()
+	summary = { "chunks": 0, "items": 0, "failed_chunks": [] }
+	in_flight = 0
+
+	def enqueue_next_chunk():
+		items = list(itertools.islice(items_iterator, sizer.chunk_size))
+		if not items:
+			return False
+		summary["chunks"] += 1
+		TaskComponent(btu_task_id=btu_task_id,
+		              btu_component_id=f"map-{map_id[:6]}-{summary['chunks']}",
+		              btu_task_schedule_id=btu_task_schedule_id,
+		              frappe_site_name=frappe.local.site,
+		              function=run_map_chunk,
+		              queue=queue,
+		              map_function=function,
+		              items=items,
+		              map_id=map_id,
+		              chunk_number=summary["chunks"]).enqueue()
+		return True
+
+	try:
+		while in_flight < max(int(max_in_flight), 1) and enqueue_next_chunk():
+			in_flight += 1
+
+		while in_flight:
+			timeout = _clamp_to_deadline(wait_timeout)
+			popped = conn.blpop(_done_key(map_id), timeout=timeout) if timeout else None
+			if not popped:
+				raise TimeoutError(f"No Task Component of map '{map_id}' finished within {timeout} seconds.  {in_flight} are still in-flight.")
+			in_flight -= 1
+			message = json.loads(popped[1])
+			summary["items"] += message["items"]
+			if not message["okay"]:
+				summary["failed_chunks"].append(message["chunk"])
+			sizer.observe(message["items"], message["seconds"])
+			if enqueue_next_chunk():
+				in_flight += 1
+	finally:
+		conn.delete(_done_key(map_id))
+
+	summary["final_chunk_size"] = sizer.chunk_size
+	return summary
@@ -0,0 +1,54 @@
+""" component_semaphore.py """
+
+# --------
+#
+# A Redis semaphore that limits how many Task Components of one parent (a BTU Task, or a ComponentGroup) run at once.
+#
+# Each holder is a member of a sorted set, scored by the time its lease expires.  If a Worker dies while holding a
+# slot, the slot is reclaimed when the lease expires.  A Component that cannot get a slot is not held in the Worker;
+# it is re-enqueued with a delay (see TaskComponentWrapper.defer)
+#
+# --------
+
+import random
+import time
+
+import frappe
+from frappe.utils.background_jobs import get_redis_conn
+
+_acquire_script = """
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[1])
+if redis.call('zcard', KEYS[1]) < tonumber(ARGV[2]) then
+	redis.call('zadd', KEYS[1], ARGV[3], ARGV[4])
+	redis.call('expire', KEYS[1], ARGV[5])
+	return 1
+end
+return 0
+"""
+
+
+def _semaphore_key(scope):
+	return f"btu:{frappe.local.site}:component_semaphore:{scope}"
+
+
+def try_acquire(scope, limit, token, lease_seconds):
+	"""
+	Returns True if a slot was acquired.  Never blocks.
+	"""
+	now = time.time()
+	acquired = get_redis_conn().eval(_acquire_script, 1, _semaphore_key(scope),
+	                                 now, int(limit), now + lease_seconds, token, int(lease_seconds) + 60)
+	return bool(acquired)
+
+
+def release(scope, token):
+	get_redis_conn().zrem(_semaphore_key(scope), token)
+
+
+def defer_delay(deferrals, base_seconds=2, max_seconds=60):
+	"""
+	Seconds to wait before a deferred Component tries again.  Grows with each deferral, with jitter so
+	many deferred Components do not all return at the same moment.
+	"""
+	delay = min(base_seconds * (2 ** min(deferrals, 10)), max_seconds)
+	return round(delay * random.uniform(0.5, 1.0), 3)  # nosec: not used for security.
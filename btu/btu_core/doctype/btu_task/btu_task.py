@@ -2,7 +2,6 @@
 # For license information, please see license.txt
 
 import ast
-from contextlib import redirect_stdout
 import importlib
 import inspect
 import io
@@ -14,7 +13,12 @@ from frappe.model.document import Document
 
 # BTU
 from btu import Result, get_system_datetime_now, make_datetime_naive
-from btu.btu_core.task_runner import TaskRunner
+from btu.btu_api import enqueue
+from btu.btu_core import pickled_task_cache
+from btu.btu_core.run_metrics import RunMetrics
+from btu.btu_core.stdout_capture import redirect_task_stdout
+from btu.btu_core.task_deadline import get_queue_timeout
+from btu.btu_core.task_runner import TaskRunner, clear_resolved_callable_cache, resolve_function_string, run_if_awaitable
 from btu.btu_core.doctype.btu_task_log.btu_task_log import write_log_for_task
 
 
@@ -23,6 +27,13 @@ class BTU_AWARE_FUNCTION():  # pylint: disable=invalid-name
 	def __init__(self, btu_task_id):
 		self.btu_task_id = btu_task_id
 		self.btu_task_schedule_id = None
+		self.btu_task_log_name = None  # When run by TaskRunner, the BTU Task Log of this run.
+
+	def on_timeout(self):
+		"""
+		Called when run() exceeds the Task's 'max_task_duration'.  Override this to save or commit partial work.
+		The Task then has 'timeout_grace_seconds' (see BTU Configuration) before it is stopped.
+		"""
 
 
 class BTUTask(Document):
@@ -48,10 +59,7 @@ class BTUTask(Document):
 		"""
 		Return the callable function associated with this BTU Task.
 		"""
-		result = getattr( self._imported_module(), self._function_name())
-		if not hasattr(result, '__call__'):
-			raise Exception(f"The function string '{self.function_string}' is not a callable function.")
-		return result
+		return resolve_function_string(self.function_string).function
 
 	def validate(self, debug=False):
 		"""
@@ -71,6 +79,25 @@ class BTUTask(Document):
 		# 	raise Exception(f"Function '{self. _function_name()}' is not an instance of btu.task_runner.TaskWrapper()")
 		# frappe.msgprint("\u2713 Task module and function exist and are valid.")
 
+	def on_update(self):
+		"""
+		The function string may have changed; discard any cached, resolved callables.
+		"""
+		clear_resolved_callable_cache(self.function_string)
+		doc_before_save = self.get_doc_before_save()
+		if doc_before_save:
+			clear_resolved_callable_cache(doc_before_save.function_string)
+		pickled_task_cache.clear_task(self.name)
+
+	def on_update_after_submit(self):
+		pickled_task_cache.clear_task(self.name)
+
+	def on_cancel(self):
+		pickled_task_cache.clear_task(self.name)
+
+	def on_trash(self):
+		pickled_task_cache.clear_task(self.name)
+
 	def built_in_arguments(self):
 		"""
 		Converts an argument String into an argument Dictionary.
@@ -118,8 +145,11 @@ class BTUTask(Document):
 		if not self.is_this_btu_aware_function():
 			mandatory_argument_names = [ arg['argument_name'] for arg in function_arguments if arg['has_default_value'] is False ]
 		else:
-			# TODO: Find the mandatory arguments by examining the run() method on the BTU-aware class function.
-			mandatory_argument_names = []
+			# Find the mandatory arguments by examining the run() method on the BTU-aware class function.
+			run_signature = resolve_function_string(self.function_string).signature
+			mandatory_argument_names = [ name for name, parameter in run_signature.parameters.items()
+			                             if name != 'self' and parameter.default is inspect.Parameter.empty
+										 and parameter.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY) ] if run_signature else []
 
 		number_of_missing_arguments = 0
 		message = None
@@ -144,16 +174,7 @@ class BTUTask(Document):
 		"""
 		Returns True if the 'function_string' is actually the path to a BTU-Aware class.
 		"""
-		result = False
-		callable_function = self._callable_function()
-		if isinstance(callable_function, type):
-			# To find out if this is a subclass of BTU_AWARE_FUNCTION, we have to instantiate it.
-			# If it's not a subclass, it's going to throw a hard Exception.  So we should catch it and just return False.
-			try:
-				if isinstance(callable_function(btu_task_id=self.name), BTU_AWARE_FUNCTION):
-					result = True
-			except Exception as ex:
-				print(ex)
+		result = resolve_function_string(self.function_string).is_btu_aware
 		if debug:
 			print(f"Is this a BTU-Aware function = {result}")
 		return result
@@ -180,9 +201,10 @@ class BTUTask(Document):
 		success = False
 		execution_start = time.time()
 		start_datetime = make_datetime_naive(get_system_datetime_now())
+		run_metrics = RunMetrics().start()
 
 		try:
-			with redirect_stdout(buffer):
+			with redirect_task_stdout(buffer):
 				datetime_string = get_system_datetime_now().strftime("%m/%d/%Y, %H:%M:%S %Z")
 				print(f"Task '{self.name}' starting at: {datetime_string}")
 				if self.built_in_arguments():
@@ -196,6 +218,7 @@ class BTUTask(Document):
 						any_result = callable_function(self.name).run()  # create an instance of the BTU-aware class, and call its run() method.
 					else:
 						any_result = callable_function()  # read function string, create callable function, and run it.
+				any_result = run_if_awaitable(any_result)  # 'async def' functions are run on an event loop.
 			success = True
 		except Exception as ex:
 			any_result = str(ex)
@@ -204,6 +227,7 @@ class BTUTask(Document):
 			stdout_buffer_for_log = buffer.getvalue()  	 # fetch any Stdout from the buffer.
 
 		execution_time = round(time.time() - execution_start,3)
+		run_metrics = run_metrics.stop()
 		# Create an instance of Result class:
 		result_object = Result(success=success, message=any_result or "", execution_time=execution_time)
 
@@ -211,7 +235,8 @@ class BTUTask(Document):
 		new_log_id = write_log_for_task(task_id=self.name,
 							result=result_object,
 							stdout=stdout_buffer_for_log or None,
-							date_time_started=start_datetime)
+							date_time_started=start_datetime,
+							run_metrics=run_metrics)
 
 		self.reload()
 		# Return a tuple to (probably) btu_task.js.
@@ -245,8 +270,8 @@ class BTUTask(Document):
 		if extra_arguments:
 			task_runner.add_keyword_arguments(**extra_arguments)  # pass them as kwargs
 
-		# Using standard frappe.enqueue() to place the 'function_wrapper' into RQ.
-		frappe.enqueue(method=task_runner.function_wrapper,
+		# Like frappe.enqueue(), place the 'function_wrapper' into RQ.  But executed by BTU, so a BTUWorker can keep connections warm.
+		enqueue(method=task_runner.function_wrapper,
 			queue=self.queue_name,
-			timeout=self.max_task_duration or "3600",
-			is_async=True)
+			timeout=get_queue_timeout(self.max_task_duration),  # leaves room for TaskRunner to enforce the duration itself.
+			job_name=self.desc_short)
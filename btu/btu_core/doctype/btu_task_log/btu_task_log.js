@@ -2,8 +2,85 @@
 // For license information, please see license.txt
 
 frappe.ui.form.on('BTU Task Log', {
-	
+
 	refresh: function(frm) {
 		// frm.add_custom_button(__("Marks as 'Needs Reviewing'"), () => frm.events._revert_to_draft(frm));
+		if (frm.doc.stdout_hash) {
+			frm.add_custom_button(__('View Standard Output'), () => frm.events._view_blob(frm, frm.doc.stdout_hash, __('Standard Output')));
+		}
+		if (frm.doc.result_message_hash) {
+			frm.add_custom_button(__('View Result Message'), () => frm.events._view_blob(frm, frm.doc.result_message_hash, __('Result Message')));
+		}
+		frm.events._stop_live_output(frm);
+		if (frm.doc.success_fail == 'In-Progress') {
+			frm.events._start_live_output(frm);
+		}
+	},
+
+	_start_live_output(frm) {
+		// While the Task is running, poll Redis for new lines of standard output.
+		let output_area = $('<pre style="max-height: 50vh; overflow: auto; white-space: pre-wrap;"></pre>');
+		frm.get_field('live_output').$wrapper.empty().append(output_area);
+		let last_id = null;
+
+		let poll = function() {
+			frappe.call({
+				method: 'btu.btu_core.doctype.btu_task_log.btu_task_log.get_live_output',
+				args: { log_name: frm.doc.name, after_id: last_id },
+				callback: function(r) {
+					if (r.message.text) {
+						output_area.append(document.createTextNode(r.message.text));
+						output_area.scrollTop(output_area.prop('scrollHeight'));
+					}
+					last_id = r.message.last_id;
+					if (r.message.success_fail && r.message.success_fail != 'In-Progress') {
+						frm.events._stop_live_output(frm);
+						frm.reload_doc();  // The Task has concluded; show the final Log.
+					}
+				}
+			});
+		};
+		poll();
+		frm.live_output_timer = setInterval(poll, 2000);
+	},
+
+	_stop_live_output(frm) {
+		if (frm.live_output_timer) {
+			clearInterval(frm.live_output_timer);
+			frm.live_output_timer = null;
+		}
+	},
+
+	_view_blob(frm, content_hash, title) {
+		// Large outputs are stored in the Blob Store.  Read them one chunk at a time, instead of all at once.
+		let my_dialog = new frappe.ui.Dialog({
+			title: title,
+			size: 'extra-large',
+			fields: [ { 'fieldtype': 'HTML', 'fieldname': 'output_html' } ]
+		});
+		let output_area = $('<pre style="max-height: 70vh; overflow: auto; white-space: pre-wrap;"></pre>')
+			.appendTo(my_dialog.fields_dict.output_html.$wrapper);
+		let next_offset = 0;
+
+		let read_next_chunk = function() {
+			frappe.call({
+				method: 'btu.btu_core.doctype.btu_task_log_blob.btu_task_log_blob.read_blob_range',
+				args: { content_hash: content_hash, offset: next_offset },
+				callback: function(r) {
+					output_area.append(document.createTextNode(r.message.data));
+					next_offset = r.message.next_offset;
+					if (next_offset) {
+						my_dialog.set_primary_action(__('Load More ({0} of {1} bytes)', [next_offset, r.message.total_length]), read_next_chunk);
+					}
+					else {
+						my_dialog.get_primary_btn().hide();
+					}
+				}
+			});
+		};
+
+		my_dialog.set_primary_action(__('Load More'), read_next_chunk);
+		my_dialog.show();
+		read_next_chunk();
 	}
 });
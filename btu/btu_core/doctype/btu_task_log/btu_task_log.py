@@ -7,9 +7,33 @@ from frappe.utils import now_datetime
 
 from btu import Result, get_system_datetime_now
 from btu.btu_core import btu_email
+from btu.btu_core.stdout_capture import delete_stdout_files, read_live_output
+from btu.btu_core.doctype.btu_task_log_blob.btu_task_log_blob import (
+	delete_orphaned_blobs, externalize_log_values, is_blob_store_enabled)
 
 class BTUTaskLog(Document):
 
+	def get_stdout(self):
+		"""
+		Returns the complete standard output, even when it was moved into the Blob Store.
+		"""
+		if self.get("stdout_hash") and not self.stdout:
+			from btu.btu_core.doctype.btu_task_log_blob.btu_task_log_blob import read_blob
+			return read_blob(self.stdout_hash)
+		return self.stdout
+
+	def get_result_message(self):
+		"""
+		Returns the complete result message, even when it was moved into the Blob Store.
+		"""
+		if self.get("result_message_hash") and not self.result_message:
+			from btu.btu_core.doctype.btu_task_log_blob.btu_task_log_blob import read_blob
+			return read_blob(self.result_message_hash)
+		return self.result_message
+
+	def on_trash(self):
+		delete_stdout_files(self.get("stdout_file"))
+
 	def after_insert(self):
 
 		if (not self.task_component) or (self.task_component) == 'Main':
@@ -50,7 +74,9 @@ class BTUTaskLog(Document):
 				frappe.db.set_value("BTU Task Log", self.name, "success_fail", "Failed")
 
 
-def write_log_for_task(task_id, result, log_name=None, stdout=None, date_time_started=None, schedule_id=None):
+def write_log_for_task(task_id, result, log_name=None, stdout=None, date_time_started=None, schedule_id=None,
+                       task_component=None, stdout_file=None, write_behind=False, run_metrics=None,
+                       status=None, attempt=None, cached_from_log=None):
 	"""
 	Given a Task and Result, write to SQL table 'BTU Task Log'
 	References:
@@ -61,6 +87,12 @@ def write_log_for_task(task_id, result, log_name=None, stdout=None, date_time_st
 		task_id	: 	Primary key (name) of a BTU Task.
 		result	:	A Result object.
 		log_name :	Optional.  The name of the Task Log.  Useful when updating an existing, pending log.
+		stdout_file :   Optional.  Path to a file containing the complete standard output.  Argument 'stdout' is then only an excerpt.
+		write_behind :  Optional.  When True, append a 'finish' event to the Redis stream instead of writing to SQL.
+		run_metrics :   Optional.  Dictionary of resource usage and profiling fields (see run_metrics.RunMetrics.stop)
+		status :        Optional.  Overrides the Success/Failed value derived from 'result'.  For example, 'Timeout'
+		attempt :       Optional.  When a Task has a retry policy, the number of this attempt (starting with 1)
+		cached_from_log :  Optional.  For a 'Cached' status, the Log of the run that produced the result.
 	"""
 
 	# Important Fields in BTU Task Log:
@@ -84,12 +116,19 @@ def write_log_for_task(task_id, result, log_name=None, stdout=None, date_time_st
 	if task_values:
 		task_values = task_values[0]  # get first Dictionary in the List.
 
+	if write_behind:
+		return _write_log_via_stream(task_id, task_values, result, log_name, stdout,
+		                             date_time_started, schedule_id, task_component, stdout_file, run_metrics, status, attempt,
+		                             cached_from_log)
+
 	if log_name:
 		new_log = frappe.get_doc("BTU Task Log", log_name)
 	else:
 		new_log = frappe.new_doc("BTU Task Log")  # Create a new Log.
 		new_log.task = task_id  # Field 1
 		new_log.task_desc_short = task_values['desc_short'] if task_values else "Unknown"  # Field 2.
+		if task_component:
+			new_log.task_component = task_component
 		if schedule_id:
 			new_log.schedule = schedule_id  # Field 5
 		if date_time_started:
@@ -98,48 +137,119 @@ def write_log_for_task(task_id, result, log_name=None, stdout=None, date_time_st
 	if result.execution_time:
 		new_log.execution_time = result.execution_time  # Field 3
 	new_log.stdout = stdout  # Field 4
+	if stdout_file:
+		new_log.stdout_file = stdout_file
+	if attempt:
+		new_log.attempt = attempt
+	if cached_from_log:
+		new_log.cached_from_log = cached_from_log
+	if run_metrics:
+		new_log.update(run_metrics)  # CPU time, peak memory, queue time, and (optionally) a profile.
 	new_log.result_message = str(result.message)  # Field 6.  Could be a List or Dictionary, so must convert to a String.
-	if result.okay:
+	if status:
+		new_log.success_fail = status
+	elif result.okay:
 		new_log.success_fail = 'Success'
 	else:
 		new_log.success_fail = 'Failed'  # Field 7
 
+	if is_blob_store_enabled():
+		# Replace Fields 4 and 6 with references to compressed, deduplicated Blobs.
+		new_log.update(externalize_log_values({"stdout": new_log.stdout, "result_message": new_log.result_message}))
+
 	# NOTE: Calling new_log.insert() will --not-- trigger Document class controller methods, like 'after_insert'
 	#       Use save() instead.
 	new_log.save(ignore_permissions=True)  # Not even System Administrators are supposed to create and save these.
 	frappe.db.commit()
 
 	if task_values and task_values["repeat_log_in_stdout"]:
-		print(new_log.stdout)
+		print(stdout)
 
 	return new_log.name
 
 
+def _write_log_via_stream(task_id, task_values, result, log_name, stdout, date_time_started, schedule_id, task_component,  # pylint: disable=too-many-arguments
+                          stdout_file, run_metrics, status, attempt, cached_from_log):
+	"""
+	Write-behind equivalent of write_log_for_task().  The drainer job performs the actual SQL upsert later.
+	"""
+	from btu.btu_core import task_log_stream  # late import to avoid circular reference
+
+	log_name = log_name or task_log_stream.new_log_name()
+	task_log_stream.append_log_event("finish", log_name,
+	                                 task=task_id,
+	                                 task_desc_short=task_values['desc_short'] if task_values else "Unknown",
+	                                 task_component=task_component or 'Main',
+	                                 schedule=schedule_id,
+	                                 date_time_started=date_time_started,
+	                                 execution_time=result.execution_time,
+	                                 stdout=stdout,
+	                                 stdout_file=stdout_file,
+	                                 result_message=str(result.message),
+	                                 success_fail=status or ('Success' if result.okay else 'Failed'),
+	                                 attempt=attempt,
+	                                 cached_from_log=cached_from_log,
+	                                 **(run_metrics or {}))
+
+	if task_values and task_values["repeat_log_in_stdout"]:
+		print(stdout)
+
+	return log_name
+
+
 @frappe.whitelist()
 def delete_logs_by_dates(from_date, to_date):
 	"""
 	Delete records in 'BTU Task Log' where execution date is between a date range.
 	"""
 
-	# Count the rows first, so we can return this value to the web page.
-	sql_statement = """ SELECT count(*) as RowCount FROM `tabBTU Task Log`
+	# Find the rows first, so we can return their count to the web page, and delete their stdout files.
+	sql_statement = """ SELECT name, stdout_file FROM `tabBTU Task Log`
 	                    WHERE DATE(date_time_started) between %(from_date)s and %(to_date)s """
 
 	result = frappe.db.sql(sql_statement,
 	                       values={"from_date": from_date, "to_date": to_date},
 				           debug=False,
 				           explain=False)
-	rows_to_delete = result[0][0]
+	rows_to_delete = len(result)
+
+	# Delete the rows, and their 'Component Results', in the same transaction:
+	sql_statement = """ DELETE Component FROM `tabBTU Task Log Component` AS Component
+	                    INNER JOIN `tabBTU Task Log` AS TaskLog
+	                    ON TaskLog.name = Component.parent
+	                    WHERE Component.parenttype = 'BTU Task Log'
+	                    AND DATE(TaskLog.date_time_started) between %(from_date)s and %(to_date)s """
+	frappe.db.sql(sql_statement,
+	              values={"from_date": from_date, "to_date": to_date})
 
-	# Delete the rows:
 	sql_statement = """ DELETE FROM `tabBTU Task Log`
 	                    WHERE DATE(date_time_started) between %(from_date)s and %(to_date)s """
 	frappe.db.sql(sql_statement,
-	              values={"from_date": from_date, "to_date": to_date},
-				  auto_commit=True)
+	              values={"from_date": from_date, "to_date": to_date})
+
+	# Blobs are shared by many Logs, so only delete those that are no longer referenced.
+	delete_orphaned_blobs()
+	frappe.db.commit()
+
+	# The rows are gone, so their files (and rotated backups) are no longer reachable from a Log.
+	for _, stdout_file in result:
+		delete_stdout_files(stdout_file)
 
 	return rows_to_delete
 
+@frappe.whitelist()
+def get_live_output(log_name, after_id=None):
+	"""
+	Called by the BTU Task Log web page, to tail the standard output of a Task that is still running.
+	"""
+	frappe.only_for("System Manager")
+	text, last_id = read_live_output(log_name, after_id=after_id or None)
+	return {
+		"text": text,
+		"last_id": last_id,
+		"success_fail": frappe.db.get_value("BTU Task Log", log_name, "success_fail")
+	}
+
 @frappe.whitelist()
 def check_in_progress_logs_for_timeout():
 	"""
@@ -158,9 +268,13 @@ def check_in_progress_logs_for_timeout():
 			max_task_duration = int(max_task_duration)
 		except Exception as ex:
 			raise Exception("Value of 'Max Task Duration' should be an integer representing seconds.") from ex
-		seconds_since_log_creation = (doc_log.creation - now_datetime()).total_seconds()
+		seconds_since_log_creation = (now_datetime() - doc_log.creation).total_seconds()
 		if seconds_since_log_creation > max_task_duration:
 			print(f"BTU Task Log {doc_log.name}.  {seconds_since_log_creation} seconds have passed since creation.  Changing status from 'In-Progress' to 'Failed'")
+			# The Worker may have been killed.  Stitch any live output it sent to Redis into the Log.
+			live_output, _ = read_live_output(doc_log.name)
+			if live_output:
+				doc_log.stdout = (doc_log.stdout or "") + live_output
 			doc_log.success_fail = 'Failed'
 			doc_log.save()
 			frappe.db.commit()
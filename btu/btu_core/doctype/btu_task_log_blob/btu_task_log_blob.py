@@ -0,0 +1,185 @@
+# Copyright (c) 2026, Datahenge LLC and contributors
+# For license information, please see license.txt
+
+import base64
+import hashlib
+import json
+import zlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, now_datetime
+
+DEFAULT_CHUNK_SIZE = 65536  # bytes returned per call to read_blob_range()
+BLOB_CHUNK_BYTES = 1024 * 1024  # The compressed stream is flushed after every chunk of this many uncompressed bytes.
+ORPHAN_GRACE_MINUTES = 60  # Recently stored Blobs are never deleted as orphans; a Log may be about to reference them.
+ZLIB_HEADER_BYTES = 2
+
+
+class BTUTaskLogBlob(Document):
+	pass
+
+
+def is_blob_store_enabled():
+	"""
+	Returns True if BTU Configuration says Task Log output should be kept in the Blob Store.
+	"""
+	return bool(frappe.db.get_single_value("BTU Configuration", "store_log_output_as_blobs", cache=True))
+
+
+def store_blob(text):
+	"""
+	Compress and store a string.  If identical content is already stored, only its 'modified' time is refreshed.
+	Returns a tuple of (content_hash, byte_length)
+	"""
+	if text is None:
+		return None, 0
+	raw_bytes = str(text).encode("utf-8")
+	content_hash = hashlib.sha256(raw_bytes).hexdigest()
+	compressed_bytes, chunk_index = compress_in_chunks(raw_bytes)
+	timestamp = now_datetime()
+	# Always write, instead of checking whether the Blob exists first.  That check could race with
+	# delete_orphaned_blobs().  Refreshing 'modified' keeps the Blob out of its reach, until a Log references it.
+	frappe.db.sql(""" INSERT INTO `tabBTU Task Log Blob`
+	                  (name, creation, modified, modified_by, owner, docstatus, byte_length, compressed_length, compression,
+	                   chunk_index, data)
+	                  VALUES (%(name)s, %(timestamp)s, %(timestamp)s, 'Administrator', 'Administrator', 0,
+	                          %(byte_length)s, %(compressed_length)s, 'zlib-chunked', %(chunk_index)s, %(data)s)
+	                  ON DUPLICATE KEY UPDATE modified = VALUES(modified) """,
+	              values={"name": content_hash,
+	                      "timestamp": timestamp,
+	                      "byte_length": len(raw_bytes),
+	                      "compressed_length": len(compressed_bytes),
+	                      "chunk_index": json.dumps(chunk_index),
+	                      "data": base64.b64encode(compressed_bytes).decode("ascii")})
+	return content_hash, len(raw_bytes)
+
+
+def compress_in_chunks(raw_bytes, chunk_bytes=BLOB_CHUNK_BYTES):
+	"""
+	Compress into a single zlib stream, with a full flush after every 'chunk_bytes' of input.  Decompression can
+	start at any flush point, so read_blob_range() never has to decompress the content before the requested page.
+
+	Returns a tuple (compressed_bytes, chunk_index).  chunk_index[N] is the compressed offset where the raw bytes
+	starting at N * chunk_bytes can be decompressed (as raw deflate)
+	"""
+	compressor = zlib.compressobj(6)
+	parts = []
+	chunk_index = []
+	position = 0
+	for start in range(0, len(raw_bytes), chunk_bytes):
+		part = compressor.compress(raw_bytes[start:start + chunk_bytes])
+		part += compressor.flush(zlib.Z_FULL_FLUSH)
+		# The first chunk follows the zlib header.  Every other chunk starts exactly where the previous flush ended.
+		chunk_index.append(ZLIB_HEADER_BYTES if start == 0 else position)
+		parts.append(part)
+		position += len(part)
+	parts.append(compressor.flush())
+	return b"".join(parts), chunk_index
+
+
+def externalize_log_values(values):
+	"""
+	Given a dictionary of BTU Task Log column values, move 'stdout' and 'result_message' into the Blob Store.
+	The dictionary is modified in place, and also returned.
+	"""
+	for column in ("stdout", "result_message"):
+		if values.get(column) is None:
+			continue
+		content_hash, byte_length = store_blob(values[column])
+		values[f"{column}_hash"] = content_hash
+		values[f"{column}_length"] = byte_length
+		values[column] = None
+	return values
+
+
+def _compressed_bytes(content_hash):
+	encoded = frappe.db.get_value("BTU Task Log Blob", content_hash, "data")
+	if encoded is None:
+		raise frappe.DoesNotExistError(f"No BTU Task Log Blob with hash '{content_hash}'")
+	return base64.b64decode(encoded)
+
+
+def read_blob(content_hash):
+	"""
+	Return the entire, decompressed content as a string.
+	"""
+	if not content_hash:
+		return None
+	return zlib.decompress(_compressed_bytes(content_hash)).decode("utf-8")
+
+
+@frappe.whitelist()
+def read_blob_range(content_hash, offset=0, length=DEFAULT_CHUNK_SIZE):
+	"""
+	Return a range of bytes from the decompressed content, so web pages can page through very large outputs.
+	Decompression stops as soon as the requested range is available.
+	"""
+	frappe.only_for("System Manager")
+	offset = max(int(offset or 0), 0)
+	length = min(max(int(length or DEFAULT_CHUNK_SIZE), 1), BLOB_CHUNK_BYTES)
+	blob = frappe.db.get_value("BTU Task Log Blob", content_hash, ["byte_length", "chunk_index"], as_dict=True)
+	if not blob:
+		raise frappe.DoesNotExistError(f"No BTU Task Log Blob with hash '{content_hash}'")
+	total_length = blob.byte_length or 0
+
+	if blob.chunk_index:
+		# Start decompressing at the flush point just before 'offset', instead of at the beginning.
+		chunk_index = json.loads(blob.chunk_index)
+		chunk_number = min(offset // BLOB_CHUNK_BYTES, len(chunk_index) - 1)
+		base_offset = chunk_number * BLOB_CHUNK_BYTES
+		# 'length' is at most one chunk, so the range always ends before the second flush point after the start.
+		end_chunk = chunk_number + 2
+		compressed = _compressed_range(content_hash, chunk_index[chunk_number],
+		                               chunk_index[end_chunk] if end_chunk < len(chunk_index) else None)
+		decompressor = zlib.decompressobj(-zlib.MAX_WBITS)  # raw deflate; there is no zlib header at a flush point.
+	else:
+		base_offset = 0  # Stored before chunking existed.
+		compressed = _compressed_bytes(content_hash)
+		decompressor = zlib.decompressobj()
+
+	wanted = (offset - base_offset) + length + 4  # a few extra bytes, so a multi-byte character is never split.
+	raw_bytes = decompressor.decompress(compressed, wanted)
+	start = offset - base_offset
+
+	end = min(start + length, len(raw_bytes))
+	# Move the end of the range forward to a UTF-8 character boundary.
+	while end < len(raw_bytes) and (raw_bytes[end] & 0xC0) == 0x80:
+		end += 1
+
+	return {
+		"content_hash": content_hash,
+		"offset": offset,
+		"next_offset": base_offset + end if base_offset + end < total_length else None,
+		"total_length": total_length,
+		"data": raw_bytes[start:end].decode("utf-8", errors="replace")
+	}
+
+
+def _compressed_range(content_hash, start, end=None):
+	"""
+	Returns the compressed bytes from 'start' up to 'end' (or the end of the Blob), reading only the
+	corresponding part of the Base64 text from the database.
+	"""
+	first_char = (start // 3) * 4  # Base64 encodes every 3 bytes as 4 characters.
+	char_count = (((end - first_char // 4 * 3) + 2) // 3) * 4 if end is not None else None
+	if char_count is None:
+		rows = frappe.db.sql(""" SELECT SUBSTRING(data, %(position)s) FROM `tabBTU Task Log Blob` WHERE name = %(name)s """,
+		                     values={"position": first_char + 1, "name": content_hash})
+	else:
+		rows = frappe.db.sql(""" SELECT SUBSTRING(data, %(position)s, %(count)s) FROM `tabBTU Task Log Blob` WHERE name = %(name)s """,
+		                     values={"position": first_char + 1, "count": char_count, "name": content_hash})
+	decoded = base64.b64decode(rows[0][0])
+	return decoded[start - (first_char // 4 * 3):]
+
+
+def delete_orphaned_blobs():
+	"""
+	Delete any Blobs that are no longer referenced by a BTU Task Log.
+	Blobs stored (or re-stored) recently are kept; the Log that references them may not be written yet.
+	"""
+	frappe.db.sql(""" DELETE FROM `tabBTU Task Log Blob`
+	                  WHERE modified < %(cutoff)s
+	                  AND name NOT IN (SELECT stdout_hash FROM `tabBTU Task Log` WHERE stdout_hash IS NOT NULL)
+	                  AND name NOT IN (SELECT result_message_hash FROM `tabBTU Task Log` WHERE result_message_hash IS NOT NULL) """,
+	              values={"cutoff": add_to_date(now_datetime(), minutes=-ORPHAN_GRACE_MINUTES)})
@@ -0,0 +1,87 @@
+# Copyright (c) 2026, Datahenge LLC and Contributors
+# See license.txt
+
+import random
+import types
+import unittest
+from unittest import mock
+
+from btu.btu_core.doctype.btu_task_log_blob import btu_task_log_blob
+
+
+class FakeBlobTable():
+	"""
+	Just enough of `tabBTU Task Log Blob` for store_blob() and the readers.
+	"""
+	def __init__(self):
+		self.rows = {}
+		self.insert_count = 0
+
+	def sql(self, statement, values=None):
+		if "INSERT INTO" in statement:
+			self.insert_count += 1
+			self.rows.setdefault(values["name"], dict(values))["timestamp"] = values["timestamp"]
+			return ()
+		if "SUBSTRING" in statement:
+			data = self.rows[values["name"]]["data"]
+			start = values["position"] - 1
+			return ((data[start:start + values["count"]] if "count" in values else data[start:],),)
+		raise AssertionError(f"Unexpected SQL: {statement}")
+
+	def get_value(self, _doctype, name, fieldname, as_dict=False):
+		row = self.rows.get(name)
+		if not row:
+			return None
+		if as_dict:
+			return types.SimpleNamespace(**{ each: row[each] for each in fieldname })
+		return row[fieldname]
+
+
+class TestBTUTaskLogBlob(unittest.TestCase):
+
+	def setUp(self):
+		self.table = FakeBlobTable()
+		patcher = mock.patch.object(btu_task_log_blob, "frappe")
+		mock_frappe = patcher.start()
+		self.addCleanup(patcher.stop)
+		mock_frappe.db.sql.side_effect = self.table.sql
+		mock_frappe.db.get_value.side_effect = self.table.get_value
+
+		chunk_patcher = mock.patch.object(btu_task_log_blob, "BLOB_CHUNK_BYTES", 4096)  # Many chunks, from small content.
+		chunk_patcher.start()
+		self.addCleanup(chunk_patcher.stop)
+
+	def make_text(self, line_count):
+		generator = random.Random(42)
+		return "".join(f"Line {each} é中 {generator.random()}\n" for each in range(line_count))
+
+	def test_round_trip(self):
+		text = self.make_text(2000)
+		content_hash, byte_length = btu_task_log_blob.store_blob(text)
+		self.assertEqual(byte_length, len(text.encode("utf-8")))
+		self.assertEqual(btu_task_log_blob.read_blob(content_hash), text)
+
+	def test_storing_identical_content_always_writes(self):
+		first_hash, _ = btu_task_log_blob.store_blob("same content")
+		second_hash, _ = btu_task_log_blob.store_blob("same content")
+		self.assertEqual(first_hash, second_hash)
+		self.assertEqual(self.table.insert_count, 2)  # No cached existence check that could race with deletion.
+
+	def test_pages_reassemble_the_content(self):
+		text = self.make_text(2000)
+		content_hash, _ = btu_task_log_blob.store_blob(text)
+		pages = []
+		offset = 0
+		while offset is not None:
+			page = btu_task_log_blob.read_blob_range(content_hash, offset=offset, length=1000)
+			pages.append(page["data"])
+			offset = page["next_offset"]
+		self.assertGreater(len(pages), 10)
+		self.assertEqual("".join(pages), text)
+
+	def test_blob_without_chunk_index_can_be_paged(self):
+		text = self.make_text(200)
+		content_hash, _ = btu_task_log_blob.store_blob(text)
+		self.table.rows[content_hash]["chunk_index"] = None  # As stored before chunking existed.
+		page = btu_task_log_blob.read_blob_range(content_hash, offset=0, length=100)
+		self.assertEqual(page["data"], text.encode("utf-8")[:page["next_offset"]].decode("utf-8"))
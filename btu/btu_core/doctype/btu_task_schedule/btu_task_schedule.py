@@ -24,6 +24,7 @@ from frappe.model.document import Document
 # BTU
 from btu import ( validate_cron_string, Result, get_system_datetime_now)
 from btu.btu_api.scheduler import SchedulerAPI
+from btu.btu_core import pickled_task_cache
 
 NoneType = type(None)
 cron_day_dictionary = {'Sun': 0, 'Mon': 1, 'Tue': 2, 'Wed': 3, 'Thu': 4, 'Fri': 5, 'Sat': 6}
@@ -36,8 +37,15 @@ class BTUTaskSchedule(Document):  # pylint: disable=too-many-instance-attributes
 		After deleting this Task Schedule, delete the corresponding Redis data.
 		"""
 		self.cancel_schedule()
+		pickled_task_cache.clear_task(self.task)
 		# btu_core.redis_cancel_by_queue_job_id(self.redis_job_id)
 
+	def on_update(self):
+		"""
+		The Schedule's arguments may have changed; discard the Task's cached payloads.
+		"""
+		pickled_task_cache.clear_task(self.task)
+
 	def before_validate(self):
 
 		self.task_description = self.get_task_doc().desc_short
@@ -290,18 +298,47 @@ def resubmit_all_task_schedules():
 	NOTE: This does -not- immediately execute an RQ Job; it only schedules it.
 	"""
 	filters = { "enabled": True }
-	task_schedule_ids = frappe.db.get_all("BTU Task Schedule", filters=filters, pluck='name')
-	for task_schedule_id in task_schedule_ids:
+	# One query for every enabled Task Schedule, instead of one get_doc() each.  (validate() only reads fields)
+	schedule_docs = [ frappe.get_doc({ "doctype": "BTU Task Schedule", **row })
+	                  for row in frappe.get_all("BTU Task Schedule", filters=filters, fields=["*"]) ]
+	failed = {}  # Task Schedule ID --> error message
+	valid_ids = []
+	for doc_schedule in schedule_docs:
 		try:
-			doc_schedule = frappe.get_doc("BTU Task Schedule", task_schedule_id)
 			doc_schedule.validate()
-			doc_schedule.resubmit_task_schedule()
+			valid_ids.append(doc_schedule.name)
 		except Exception as ex:
-			message = f"Error from BTU Scheduler while submitting Task {doc_schedule.name} : {ex}"
-			frappe.msgprint(message)
-			print(message)
-			doc_schedule.enabled = False
-			doc_schedule.save()
+			failed[doc_schedule.name] = str(ex)
+
+	# Reload every valid Task Schedule with a single request to the BTU Scheduler daemon.
+	results = SchedulerAPI.reload_task_schedules(valid_ids) if valid_ids else {}
+	if results is None:
+		# This daemon does not support batch requests.  Submit the Task Schedules one at a time.
+		single_ids = valid_ids
+	else:
+		# Only an explicit failure from the daemon disables a Task Schedule.  Those without a result are submitted again, one at a time.
+		failed.update({ task_schedule_id: result["message"] for task_schedule_id, result in results.items() if result["okay"] is False })
+		single_ids = [ task_schedule_id for task_schedule_id, result in results.items() if result["okay"] is None ]
+		reloaded_count = len([ result for result in results.values() if result["okay"] ])
+		message = f"BTU Scheduler daemon reloaded {reloaded_count} of {len(schedule_docs)} Task Schedules."
+		if single_ids:
+			message += f"  There was no result for {len(single_ids)}; submitting them one at a time."
+		print(message)
+		frappe.msgprint(message)
+
+	for task_schedule_id in single_ids:
+		try:
+			frappe.get_doc("BTU Task Schedule", task_schedule_id).resubmit_task_schedule()
+		except Exception as ex:
+			failed[task_schedule_id] = str(ex)
+
+	for task_schedule_id, error_message in failed.items():
+		message = f"Error from BTU Scheduler while submitting Task {task_schedule_id} : {error_message}"
+		frappe.msgprint(message)
+		print(message)
+		doc_schedule = frappe.get_doc("BTU Task Schedule", task_schedule_id)
+		doc_schedule.enabled = False
+		doc_schedule.save()
 
 def get_utc_timezone():
 	return pytz.timezone('UTC')
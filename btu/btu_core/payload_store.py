@@ -0,0 +1,191 @@
+""" payload_store.py """
+
+# --------
+#
+# A content-addressed store for large Task Component keyword arguments.
+#
+# RQ pickles each Task Component's keyword arguments into its Job hash.  When a fan-out passes the same large value
+# (a lookup table, a list of item codes) to every Component, Redis would hold one copy per Component.  Instead,
+# TaskComponent.enqueue_many() writes each large value to Redis once, under the SHA-256 of its pickle, and the Jobs
+# only carry a small PayloadReference.
+#
+# Workers resolve references through a process-local LRU cache.  Because BTUWorker does not fork, the cache survives
+# from one Job to the next, so a Worker usually fetches and unpickles a shared value only once.
+#
+# Each write also increments a reference count.  A ComponentGroup records the digests of its payloads, and releases them
+# when its last Component finishes; a payload is deleted when no group references it.  Payloads written outside a group
+# are never released, so they (and, as a backstop, every payload) expire with their TTL.
+#
+# NOTE: Components running in the same Worker receive the *same* object.  Treat shared values as read-only.
+#
+# --------
+
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+
+import frappe
+from frappe.utils.background_jobs import get_redis_conn
+
+DEFAULT_TTL_SECONDS = 86400
+INLINE_THRESHOLD_BYTES = 64 * 1024  # Smaller values stay inside the Job.
+LOCAL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_SCALAR_TYPES = (type(None), bool, int, float, complex)
+
+_release_script = """
+for index = 1, #KEYS, 2 do
+	if redis.call('decr', KEYS[index + 1]) <= 0 then
+		redis.call('del', KEYS[index], KEYS[index + 1])
+	end
+end
+return 0
+"""
+
+
+class PayloadMissing(Exception):
+	"""
+	The payload expired from Redis before the Task Component ran.
+	"""
+
+
+class PayloadReference():
+	"""
+	What a Job carries instead of the value itself.
+	"""
+	__slots__ = ("digest", "size")
+
+	def __init__(self, digest, size):
+		self.digest = digest
+		self.size = size
+
+	def __getstate__(self):
+		return (self.digest, self.size)
+
+	def __setstate__(self, state):
+		self.digest, self.size = state
+
+	def __repr__(self):
+		return f"<PayloadReference {self.digest[:12]} ({self.size} bytes)>"
+
+
+def _payload_key(digest):
+	return f"btu:{frappe.local.site}:payload:{digest}"
+
+
+def _references_key(digest):
+	return f"btu:{frappe.local.site}:payload:{digest}:references"
+
+
+class _LocalCache():
+	"""
+	A least-recently-used cache of unpickled payloads, bounded by their pickled size.
+	"""
+
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.current_bytes = 0
+		self._entries = OrderedDict()  # key --> (value, size)
+		self._lock = threading.Lock()  # BTUThreadedWorker runs several Jobs at once.
+
+	def get(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				return None
+			self._entries.move_to_end(key)
+			return entry
+
+	def put(self, key, value, size):
+		if size > self.max_bytes:
+			return
+		with self._lock:
+			if key in self._entries:
+				return
+			self._entries[key] = (value, size)
+			self.current_bytes += size
+			while self.current_bytes > self.max_bytes:
+				_, (_, evicted_size) = self._entries.popitem(last=False)
+				self.current_bytes -= evicted_size
+
+
+_local_cache = _LocalCache(LOCAL_CACHE_MAX_BYTES)
+
+
+def store_kwargs(kwarg_dicts, ttl_seconds=DEFAULT_TTL_SECONDS, threshold_bytes=INLINE_THRESHOLD_BYTES):
+	"""
+	Replace large values in a sequence of keyword argument dictionaries with PayloadReferences, in place.
+
+	A value shared by many dictionaries is pickled and written to Redis only once.  Returns the digests of the distinct
+	payloads written.  Pass them to release_payloads() when the Jobs no longer need them.
+	"""
+	references = {}  # id(value) --> PayloadReference, or None if the value stays inline.
+	keep_alive = []  # Holds the values, so their id() cannot be reused while this function runs.
+	pipeline = get_redis_conn().pipeline(transaction=False)
+	written = set()
+
+	for kwarg_dict in kwarg_dicts:
+		if not kwarg_dict:
+			continue
+		for argument, value in kwarg_dict.items():
+			if isinstance(value, _SCALAR_TYPES + (PayloadReference,)):
+				continue
+			if id(value) not in references:
+				keep_alive.append(value)
+				pickled = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+				if len(pickled) < threshold_bytes:
+					references[id(value)] = None
+					continue
+				digest = hashlib.sha256(pickled).hexdigest()
+				references[id(value)] = PayloadReference(digest, len(pickled))
+				if digest not in written:
+					# Identical content gets the same key, so writing it again only refreshes the TTL.
+					pipeline.set(_payload_key(digest), pickled, ex=int(ttl_seconds))
+					pipeline.incr(_references_key(digest))
+					pipeline.expire(_references_key(digest), int(ttl_seconds))
+					written.add(digest)
+			if references[id(value)] is not None:
+				kwarg_dict[argument] = references[id(value)]
+
+	if written:
+		pipeline.execute()
+	return sorted(written)
+
+
+def release_payloads(digests):
+	"""
+	Release one reference to each payload.  Payloads without any remaining references are deleted immediately.
+	"""
+	if not digests:
+		return
+	keys = []
+	for digest in digests:
+		keys.extend((_payload_key(digest), _references_key(digest)))
+	get_redis_conn().eval(_release_script, len(keys), *keys)
+
+
+def resolve(reference):
+	"""
+	Returns the value of a PayloadReference, preferably from the local cache.
+	"""
+	key = _payload_key(reference.digest)
+	entry = _local_cache.get(key)
+	if entry is not None:
+		return entry[0]
+	pickled = get_redis_conn().get(key)
+	if pickled is None:
+		raise PayloadMissing(f"Payload {reference.digest} is no longer in Redis.  It probably expired before the Task Component ran.")
+	value = pickle.loads(pickled)
+	_local_cache.put(key, value, len(pickled))
+	return value
+
+
+def resolve_kwargs(kwarg_dict):
+	"""
+	Returns a copy of 'kwarg_dict', with every PayloadReference replaced by its value.
+	"""
+	if not kwarg_dict:
+		return kwarg_dict
+	return { argument: resolve(value) if isinstance(value, PayloadReference) else value
+	         for argument, value in kwarg_dict.items() }
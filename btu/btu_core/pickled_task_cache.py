@@ -0,0 +1,125 @@
+""" pickled_task_cache.py """
+
+# --------
+#
+# Cache of the pickled RQ Jobs returned by the endpoint 'get_pickled_task'
+#
+# The BTU Scheduler daemon calls that endpoint every time a Task Schedule fires.  Building the payload requires
+# loading the BTU Task and Task Schedule, constructing a TaskRunner, and pickling it.  For an unchanged Task and
+# Schedule, the result is always the same.  So the bytes are stored in Redis, next to the 'modified' timestamps of
+# the Task and Schedule they were built from (and the Job Serialization mode)  If any of them has changed since, the
+# entry is ignored and rebuilt.
+# Saving or deleting either Document also discards the Task's entries immediately.  The version also includes the
+# BTU version, and 'bench migrate' discards every entry of the Site; cached payloads pickle BTU classes, so entries
+# built by older code must not be served after an upgrade.
+#
+# The hits and misses are counted, and can be read with get_cache_statistics()
+#
+# --------
+
+import pickle
+
+import frappe
+from frappe.utils.background_jobs import get_redis_conn
+
+from btu import __version__ as btu_version
+
+ENTRY_TTL_SECONDS = 86400  # Entries for Schedules that no longer fire eventually disappear.
+
+
+def _entry_key(task_id):
+	return f"btu:{frappe.local.site}:pickled_task:{task_id}"
+
+
+def _statistics_key():
+	return f"btu:{frappe.local.site}:pickled_task_statistics"
+
+
+def _entry_field(task_schedule_id, user):
+	# The payload includes the session user, who becomes the user of the RQ Job.
+	return f"{task_schedule_id or ''}|{user}"
+
+
+def get_version(task_id, task_schedule_id=None):
+	"""
+	Returns the 'modified' timestamps of the Task and Schedule as a single string, or None if the Task does not exist.
+	One query, instead of loading either Document.
+	"""
+	rows = frappe.db.sql(""" SELECT Task.modified, Schedule.modified
+	                         FROM `tabBTU Task` AS Task
+	                         LEFT JOIN `tabBTU Task Schedule` AS Schedule
+	                         ON Schedule.name = %(task_schedule_id)s
+	                         WHERE Task.name = %(task_id)s """,
+	                     values={"task_id": task_id, "task_schedule_id": task_schedule_id or ""})
+	if not rows:
+		return None
+	return make_version(rows[0][0], rows[0][1])
+
+
+def make_version(task_modified, schedule_modified=None):
+	"""
+	Changing the Task, the Schedule, the Job Serialization mode, or the BTU version invalidates a cached payload.
+	"""
+	serialization = frappe.db.get_single_value("BTU Configuration", "job_serialization", cache=True) or "Full"
+	return f"{task_modified}|{schedule_modified or ''}|{serialization}|{btu_version}"
+
+
+def get_payload(task_id, task_schedule_id, user, version):
+	"""
+	Returns the cached bytes, or None if there is no entry for this version of the Task and Schedule.
+	"""
+	conn = get_redis_conn()
+	entry = conn.hget(_entry_key(task_id), _entry_field(task_schedule_id, user)) if version else None
+	payload = None
+	if entry:
+		cached_version, cached_payload = pickle.loads(entry)
+		if cached_version == version:
+			payload = cached_payload
+	conn.hincrby(_statistics_key(), "hits" if payload is not None else "misses", 1)
+	return payload
+
+
+def store_payload(task_id, task_schedule_id, user, version, payload):
+	if not version:
+		return
+	pipeline = get_redis_conn().pipeline()
+	pipeline.hset(_entry_key(task_id), _entry_field(task_schedule_id, user),
+	              pickle.dumps((version, payload), protocol=pickle.HIGHEST_PROTOCOL))
+	pipeline.expire(_entry_key(task_id), ENTRY_TTL_SECONDS)
+	pipeline.execute()
+
+
+def clear_task(task_id):
+	"""
+	Discard every cached payload of a BTU Task.  Called when the Task, or one of its Schedules, is saved or deleted.
+	"""
+	if task_id:
+		get_redis_conn().delete(_entry_key(task_id))
+
+
+def clear_all():
+	"""
+	Discard every cached payload of the Site.  Called by the 'after_migrate' hook, because migrating may change the code
+	that the payloads were pickled from.
+	"""
+	conn = get_redis_conn()
+	keys = list(conn.scan_iter(match=_entry_key("*"), count=1000))
+	for index in range(0, len(keys), 1000):
+		conn.delete(*keys[index:index + 1000])
+
+
+def get_cache_statistics():
+	"""
+	Returns a dictionary with keys 'hits', 'misses', and 'hit_ratio'
+	"""
+	statistics = { key.decode(): int(value) for key, value in get_redis_conn().hgetall(_statistics_key()).items() }
+	hits, misses = statistics.get("hits", 0), statistics.get("misses", 0)
+	return {
+		"hits": hits,
+		"misses": misses,
+		"hit_ratio": round(hits / (hits + misses), 4) if (hits + misses) else None
+	}
+
+
+def reset_cache_statistics():
+	get_redis_conn().delete(_statistics_key())
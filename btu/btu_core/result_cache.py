@@ -0,0 +1,76 @@
+""" result_cache.py """
+
+# --------
+#
+# Optional memoization of BTU Task results.
+#
+# When 'Cache Results' is marked on a BTU Task, a successful run stores its result in Redis, keyed by the Task's
+# function string plus the keyword arguments that TaskRunner merged from the Task and Schedule.  Until the entry
+# expires, another run with the same arguments does not call the function.  It writes a 'Cached' BTU Task Log
+# that points to the Log of the original run.
+#
+# Besides the TTL, the number of entries per Site is bounded.  A sorted set records when each entry was last used,
+# and the least recently used entries are evicted first.
+#
+# --------
+
+import hashlib
+import json
+import time
+
+import frappe
+from frappe.utils import cint
+from frappe.utils.background_jobs import get_redis_conn
+
+DEFAULT_MAX_ENTRIES = 1000
+
+
+def make_cache_key(function_string, kwarg_dict):
+	"""
+	A stable key for a function string and its keyword arguments.  Argument order does not matter.
+	"""
+	serialized = json.dumps([function_string, kwarg_dict or {}], sort_keys=True, default=str)
+	return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _entry_key(cache_key):
+	return f"btu:{frappe.local.site}:result_cache:{cache_key}"
+
+
+def _usage_key():
+	return f"btu:{frappe.local.site}:result_cache_lru"
+
+
+def get_cached_result(cache_key):
+	"""
+	Returns a dictionary with keys 'log_name' and 'message', or None if there is no (unexpired) entry.
+	"""
+	conn = get_redis_conn()
+	entry = conn.get(_entry_key(cache_key))
+	if not entry:
+		conn.zrem(_usage_key(), cache_key)  # The entry expired; forget it.
+		return None
+	conn.zadd(_usage_key(), {cache_key: time.time()})  # Mark it as recently used.
+	return json.loads(entry)
+
+
+def store_result(cache_key, log_name, message, ttl_seconds):
+	"""
+	Store the result of a successful run.  Then evict the least recently used entries, beyond the maximum.
+
+	The message is stored as a string, exactly as BTU Task Log records it.  So any result can be cached (dates, Decimals,
+	etc.), and a cache hit reports the same message as the original Log.
+	"""
+	max_entries = cint(frappe.db.get_single_value("BTU Configuration", "result_cache_max_entries", cache=True)) or DEFAULT_MAX_ENTRIES
+	conn = get_redis_conn()
+	pipeline = conn.pipeline()
+	pipeline.set(_entry_key(cache_key), json.dumps({"log_name": log_name, "message": str(message)}), ex=max(cint(ttl_seconds), 1))
+	pipeline.zadd(_usage_key(), {cache_key: time.time()})
+	pipeline.zcard(_usage_key())
+	entry_count = pipeline.execute()[-1]
+
+	if entry_count > max_entries:
+		evicted = conn.zpopmin(_usage_key(), entry_count - max_entries)
+		if evicted:
+			conn.delete(*[ _entry_key(each_key.decode()) for each_key, _ in evicted ])
+
@@ -0,0 +1,98 @@
+""" retry_policy.py """
+
+# --------
+#
+# Retry policies for BTU Tasks and Jobs.
+#
+# Instead of sleeping inside the Worker, a failed attempt is re-enqueued with a delay (see btu_api.enqueue_in)
+# The delay grows exponentially:  base_delay * multiplier ^ (attempt - 1), plus or minus a random jitter.
+#
+# --------
+
+import random
+
+import frappe
+from frappe.utils import cint, flt
+
+
+class RetryPolicy():
+
+	def __init__(self, max_attempts=6, base_delay=1.0, multiplier=2.0, jitter=0.1, retryable_exceptions=None):
+		"""
+		Arguments:
+			max_attempts:  The total number of attempts, including the first.  A value of 1 means 'never retry'
+			base_delay:  Seconds to wait before the first retry.
+			multiplier:  Each subsequent delay is multiplied by this.
+			jitter:  A fraction of the delay.  For example, 0.1 adds or removes up to 10 percent.
+			retryable_exceptions:  A list of dotted paths to exception classes.
+		"""
+		self.max_attempts = max(cint(max_attempts), 1)
+		self.base_delay = max(flt(base_delay), 0)
+		self.multiplier = max(flt(multiplier), 1)
+		self.jitter = min(max(flt(jitter), 0), 1)
+		self.retryable_exceptions = retryable_exceptions or []
+
+	@staticmethod
+	def for_task(btu_task):
+		"""
+		Returns the retry policy of a BTU Task, or None if the Task does not define one.
+		"""
+		if cint(btu_task.get("retry_max_attempts")) <= 1:
+			return None
+		exception_paths = [ each.strip() for each in (btu_task.get("retry_exceptions") or "").splitlines() if each.strip() ]
+		return RetryPolicy(max_attempts=btu_task.retry_max_attempts,
+		                   base_delay=btu_task.get("retry_base_delay") or 1,
+		                   multiplier=btu_task.get("retry_multiplier") or 2,
+		                   jitter=btu_task.get("retry_jitter"),
+		                   retryable_exceptions=exception_paths)
+
+	def delay_for(self, attempt):
+		"""
+		Seconds to wait, after attempt number 'attempt' failed, before the next attempt.
+		"""
+		delay = self.base_delay * (self.multiplier ** (max(attempt, 1) - 1))
+		if self.jitter:
+			delay *= random.uniform(1 - self.jitter, 1 + self.jitter)  # nosec: not used for security.
+		return round(delay, 3)
+
+	def should_retry(self, exception, attempt):
+		"""
+		Returns True if attempt number 'attempt' failed with a retryable exception, and attempts remain.
+		"""
+		return attempt < self.max_attempts and self.is_retryable(exception)
+
+	def is_retryable(self, exception):
+		if is_transient_database_error(exception):
+			return True
+		for each_path in self.retryable_exceptions:
+			try:
+				exception_class = frappe.get_attr(each_path)
+			except Exception:
+				continue  # The module may not be importable in this process.
+			if isinstance(exception_class, type) and isinstance(exception, exception_class):
+				return True
+		return False
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def is_transient_database_error(exception):
+	"""
+	Deadlocks, lock wait timeouts, and RetryBackgroundJobError are always worth retrying.
+	"""
+	if isinstance(exception, frappe.RetryBackgroundJobError):
+		return True
+	if getattr(frappe.local, "db", None) and isinstance(exception, frappe.db.InternalError):
+		# 1213 = deadlock
+		# 1205 = lock wait timeout
+		return bool(frappe.db.is_deadlocked(exception) or frappe.db.is_timedout(exception))
+	return False
+
+
+def get_retry_policy(method):
+	"""
+	The retry policy for a Job's method.  TaskRunner methods use their BTU Task's policy, when it has one.
+	"""
+	btu_task = getattr(getattr(method, "__self__", None), "btu_task", None)
+	return (btu_task and RetryPolicy.for_task(btu_task)) or DEFAULT_RETRY_POLICY
@@ -0,0 +1,76 @@
+""" run_metrics.py """
+
+# --------
+#
+# Resource accounting for a single run of a BTU Task or Task Component:  CPU time, peak memory, and time spent in the queue.
+#
+# --------
+
+import sys
+
+try:
+	import resource  # Unix only
+except ImportError:
+	resource = None
+
+
+def _get_rusage():
+	if not resource:
+		return None
+	# RUSAGE_THREAD (Linux) keeps CPU times accurate when a BTUThreadedWorker runs several Jobs at once.
+	return resource.getrusage(getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF))
+
+
+def _get_peak_rss_in_mb():
+	if not resource:
+		return 0
+	# Linux reports 'ru_maxrss' in kilobytes, but macOS reports it in bytes.
+	divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+def get_queue_time():
+	"""
+	Returns the seconds between the current RQ Job being enqueued and being started, or None if unknown.
+	"""
+	try:
+		from rq import get_current_job
+		rq_job = get_current_job()
+	except Exception:
+		return None
+	if not rq_job or not rq_job.enqueued_at or not rq_job.started_at:
+		return None
+	return round(max((rq_job.started_at - rq_job.enqueued_at).total_seconds(), 0), 3)
+
+
+class RunMetrics():
+	"""
+	Usage:
+		metrics = RunMetrics().start()
+		... call the function ...
+		values = metrics.stop()   # a dictionary of BTU Task Log fields.
+	"""
+
+	def __init__(self):
+		self._usage_start = None
+		self._max_rss_start = 0
+
+	def start(self):
+		self._usage_start = _get_rusage()
+		self._max_rss_start = _get_peak_rss_in_mb()
+		return self
+
+	def stop(self):
+		"""
+		Returns a dictionary, where the keys are fields on BTU Task Log.
+		"""
+		usage_end = _get_rusage()
+		values = {
+			"queue_time": get_queue_time()
+		}
+		if self._usage_start and usage_end:
+			values["cpu_user_time"] = round(usage_end.ru_utime - self._usage_start.ru_utime, 3)
+			values["cpu_system_time"] = round(usage_end.ru_stime - self._usage_start.ru_stime, 3)
+			# The process' peak memory can only grow.  So this is how far the run pushed the peak, not its total usage.
+			values["peak_rss_delta_mb"] = round(_get_peak_rss_in_mb() - self._max_rss_start, 2)
+		return values
@@ -0,0 +1,168 @@
+""" schedule_overlap.py """
+
+# --------
+#
+# Overlap policies for BTU Task Schedules.
+#
+# When one run of a Schedule takes longer than its cron interval, the next run may start before the previous one ends.
+# Each BTU Task Schedule chooses what happens then:
+#
+#   * Allow:            Both runs execute at the same time (the original behavior)
+#   * Skip:             The new run does nothing.
+#   * Coalesce:         The new run does nothing, but marks the Schedule as 'pending'.  When the active run ends, it
+#                       enqueues exactly one more run.  However many runs arrived in the meantime, only one is kept.
+#   * Cancel Previous:  The new run takes the lock.  The previous run notices at its next lease renewal, and is stopped.
+#
+# The lock is a Redis key with a short lease.  While the Task runs, a background thread renews the lease (every 1/3 lease).
+# If a Worker dies, the lease expires, and the Schedule is not blocked forever.
+#
+# --------
+
+from contextlib import contextmanager
+import threading
+
+import frappe
+from frappe.utils.background_jobs import get_redis_conn
+
+from btu.btu_core.btu_worker import raise_in_thread
+
+LEASE_SECONDS = 30
+
+_renew_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+	return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_release_script = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+	return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class TaskCancelled(BaseException):
+	"""
+	Raised inside a Task whose run was replaced by a newer run of the same Schedule ('Cancel Previous' policy)
+	"""
+
+
+def get_lock_key(schedule_id, site_name=None):
+	return f"btu:{site_name or frappe.local.site}:schedule_lock:{schedule_id}"
+
+
+def get_pending_key(schedule_id, site_name=None):
+	return f"btu:{site_name or frappe.local.site}:schedule_pending:{schedule_id}"
+
+
+class ScheduleOverlapGuard():
+	"""
+	Usage:
+		guard = ScheduleOverlapGuard.for_schedule(schedule_id, token)
+		if guard and not guard.acquire():
+			return  # another run of this Schedule is active.
+		try:
+			with guard.cancellable():
+				...  # call the Task's function
+		finally:
+			if guard and guard.release():
+				...  # enqueue the pending (coalesced) run.
+	"""
+
+	@staticmethod
+	def for_schedule(schedule_id, token):
+		"""
+		Returns a guard for the Schedule, or None when overlapping runs are allowed.
+		"""
+		if not schedule_id:
+			return None
+		policy = frappe.db.get_value("BTU Task Schedule", schedule_id, "overlap_policy")
+		if not policy or policy == "Allow":
+			return None
+		return ScheduleOverlapGuard(schedule_id, policy, token)
+
+	def __init__(self, schedule_id, policy, token, lease_seconds=LEASE_SECONDS):
+		self.schedule_id = schedule_id
+		self.policy = policy
+		self.token = str(token)
+		self.lease_milliseconds = int(lease_seconds * 1000)
+		self.cancelled = False
+		self._conn = get_redis_conn()
+		self._lock_key = get_lock_key(schedule_id)
+		self._pending_key = get_pending_key(schedule_id)
+		self._stop_renewing = threading.Event()
+		self._renewal_thread = None
+		self._task_thread_id = None
+		self._cancellable = False
+		self._cancel_lock = threading.Lock()
+
+	def acquire(self):
+		"""
+		Try to take the Schedule's lock.  Returns False if this run should not execute.
+		"""
+		if self.policy == "Cancel Previous":
+			# Take the lock unconditionally.  The previous owner's renewal thread will see it no longer owns it.
+			self._conn.set(self._lock_key, self.token, px=self.lease_milliseconds)
+		elif not self._conn.set(self._lock_key, self.token, px=self.lease_milliseconds, nx=True):
+			if self.policy == "Coalesce":
+				self._conn.set(self._pending_key, self.token, ex=86400)
+				print(f"BTU Task Schedule '{self.schedule_id}' is already running.  This run will execute once it finishes.")
+			else:
+				print(f"BTU Task Schedule '{self.schedule_id}' is already running.  Skipping this run.")
+			return False
+
+		self._task_thread_id = threading.current_thread().ident
+		self._renewal_thread = threading.Thread(target=self._renew_lease, name=f"btu-lease-{self.schedule_id}", daemon=True)
+		self._renewal_thread.start()
+		return True
+
+	@contextmanager
+	def cancellable(self):
+		"""
+		TaskCancelled is only raised while the Task's function is running; never while its Log is being written.
+		"""
+		with self._cancel_lock:
+			if self.cancelled:
+				raise TaskCancelled()
+			self._cancellable = True
+		try:
+			yield self
+		finally:
+			with self._cancel_lock:
+				self._cancellable = False
+			raise_in_thread(self._task_thread_id, None)  # discard a cancellation that arrived as the function ended.
+
+	def release(self):
+		"""
+		Release the lock, if this run still owns it.  Returns True if a coalesced run is waiting to be enqueued.
+		"""
+		self._stop_renewing.set()
+		if self._renewal_thread:
+			self._renewal_thread.join()
+		self._conn.eval(_release_script, 1, self._lock_key, self.token)
+		if self.policy != "Coalesce" or self.cancelled:
+			return False
+		pipeline = self._conn.pipeline()
+		pipeline.get(self._pending_key)
+		pipeline.delete(self._pending_key)
+		pending, _ = pipeline.execute()
+		return bool(pending)
+
+	def _renew_lease(self):
+		while not self._stop_renewing.wait(self.lease_milliseconds / 3000):
+			try:
+				still_owner = self._conn.eval(_renew_script, 1, self._lock_key, self.token, self.lease_milliseconds)
+			except Exception as ex:
+				print(f"Unable to renew the lock for BTU Task Schedule '{self.schedule_id}': {ex}")
+				continue  # Redis may only be unavailable briefly; try again at the next interval.
+			if still_owner:
+				continue
+			if self.policy == "Cancel Previous":
+				print(f"A newer run of BTU Task Schedule '{self.schedule_id}' has replaced this one.")
+				with self._cancel_lock:
+					self.cancelled = True
+					if self._cancellable:
+						raise_in_thread(self._task_thread_id, TaskCancelled)
+			return
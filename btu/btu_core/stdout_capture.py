@@ -0,0 +1,311 @@
+""" stdout_capture.py """
+
+# --------
+#
+# File-like objects that can replace 'sys.stdout' while a BTU Task is running.
+#
+# --------
+
+from contextlib import contextmanager
+import contextvars
+import glob
+import io
+import os
+import sys
+import threading
+import time
+
+import frappe
+
+# The file-like object that receives standard output for the Task running in the current thread (or coroutine).
+_task_stdout = contextvars.ContextVar("btu_task_stdout", default=None)
+_router_lock = threading.Lock()
+
+
+class ContextStdout():
+	"""
+	Installed once as 'sys.stdout'.  Each write is routed to the Task's writer for the current context,
+	or to the original standard output when no Task is capturing.
+
+	Unlike contextlib.redirect_stdout(), this never swaps the process-global 'sys.stdout' per Task.
+	So Tasks running in different threads of the same Worker cannot capture each other's output.
+	"""
+
+	def __init__(self, original):
+		self.original = original
+
+	def _target(self):
+		return _task_stdout.get() or self.original
+
+	def write(self, text):
+		return self._target().write(text)
+
+	def flush(self):
+		return self._target().flush()
+
+	def __getattr__(self, name):
+		return getattr(self._target(), name)
+
+
+def install_stdout_router():
+	if not isinstance(sys.stdout, ContextStdout):
+		with _router_lock:
+			if not isinstance(sys.stdout, ContextStdout):
+				sys.stdout = ContextStdout(sys.stdout)
+
+
+@contextmanager
+def redirect_task_stdout(writer):
+	"""
+	A thread-safe replacement for contextlib.redirect_stdout(), used while running a Task's function.
+	"""
+	install_stdout_router()
+	token = _task_stdout.set(writer)
+	try:
+		yield writer
+	finally:
+		_task_stdout.reset(token)
+
+
+def get_stdout_directory():
+	"""
+	Returns the directory where BTU writes Task standard output files.  Creates it, if necessary.
+	"""
+	directory = frappe.get_site_path("logs", "btu")
+	os.makedirs(directory, exist_ok=True)
+	return directory
+
+
+def delete_stdout_files(file_path):
+	"""
+	Delete a Task Log's standard output file, and its rotated backups (file.log.1, file.log.2 ...)
+	Only files inside the BTU stdout directory are deleted.  Returns the number of files deleted.
+	"""
+	if not file_path:
+		return 0
+	if os.path.dirname(os.path.realpath(file_path)) != os.path.realpath(get_stdout_directory()):
+		return 0
+	deleted = 0
+	for each_path in [file_path] + glob.glob(glob.escape(file_path) + ".*"):
+		if each_path != file_path and not each_path[len(file_path) + 1:].isdigit():
+			continue
+		try:
+			os.remove(each_path)
+			deleted += 1
+		except FileNotFoundError:
+			pass
+	return deleted
+
+
+class RotatingStdoutFile(io.TextIOBase):
+	"""
+	Streams standard output to a file on disk, instead of holding it in memory.
+
+	  * When the file exceeds 'max_bytes', it is rotated (file.log --> file.log.1 --> file.log.2 ...)
+	  * Only 'backup_count' rotated files are kept, so the total disk usage per Task Log is bounded.
+	  * The first and last 'excerpt_chars' characters are kept in memory, so they can be saved in the BTU Task Log.
+	"""
+
+	def __init__(self, file_path, max_bytes=10 * 1024 * 1024, backup_count=3, excerpt_chars=4000):
+		super().__init__()
+		if not max_bytes or int(max_bytes) <= 0:
+			raise ValueError("Argument 'max_bytes' must be a positive integer.")
+		self.file_path = file_path
+		self.max_bytes = int(max_bytes)
+		self.backup_count = max(int(backup_count or 0), 0)
+		self.excerpt_chars = int(excerpt_chars)
+		self.total_chars = 0
+		self._head = ""
+		self._tail = ""
+		self._current_bytes = 0
+		self._file = open(self.file_path, mode="w", encoding="utf-8")  # pylint: disable=consider-using-with
+
+	def writable(self):
+		return True
+
+	def write(self, text):
+		if not text:
+			return 0
+		self._capture_excerpt(text)
+		byte_length = len(text.encode("utf-8"))
+		if self._current_bytes and (self._current_bytes + byte_length > self.max_bytes):
+			self._rotate()
+		self._file.write(text)
+		self._current_bytes += byte_length
+		return len(text)
+
+	def flush(self):
+		if not self._file.closed:
+			self._file.flush()
+
+	def close(self):
+		if not self._file.closed:
+			self._file.close()
+		super().close()
+
+	def excerpt(self):
+		"""
+		Return a head/tail excerpt of everything written, suitable for storing in the BTU Task Log.
+		"""
+		if self.total_chars <= self.excerpt_chars:
+			return self._head
+		if self.total_chars <= self.excerpt_chars * 2:
+			return self._head + self._tail[-(self.total_chars - self.excerpt_chars):]
+		omitted = self.total_chars - (self.excerpt_chars * 2)
+		return f"{self._head}\n\n... [{omitted} characters omitted; see file '{self.file_path}'] ...\n\n{self._tail}"
+
+	def _capture_excerpt(self, text):
+		if len(self._head) < self.excerpt_chars:
+			self._head += text[:self.excerpt_chars - len(self._head)]
+		self._tail = (self._tail + text)[-self.excerpt_chars:]
+		self.total_chars += len(text)
+
+	def _rotate(self):
+		self._file.close()
+		if self.backup_count:
+			for index in range(self.backup_count - 1, 0, -1):
+				source = f"{self.file_path}.{index}"
+				if os.path.exists(source):
+					os.replace(source, f"{self.file_path}.{index + 1}")
+			os.replace(self.file_path, f"{self.file_path}.1")
+		self._file = open(self.file_path, mode="w", encoding="utf-8")  # pylint: disable=consider-using-with
+		self._current_bytes = 0
+
+
+def get_live_output_key(log_name, site_name=None):
+	"""
+	The Redis key of the stream that holds a running Task's standard output.
+	"""
+	return f"btu:{site_name or frappe.local.site}:task_log_tail:{log_name}"
+
+
+class LiveTailWriter(io.TextIOBase):
+	"""
+	Wraps another file-like object (such as a StringIO), and also copies complete lines of output to a capped Redis stream.
+
+	  * Writes to Redis are rate-limited: at most one every 'flush_interval' seconds.  A timer sends lines that
+	    arrived since the last write, so output is shown even when the Task then works quietly.
+	  * Each entry holds at most 'max_entry_bytes', and at most 'max_total_bytes' are sent per Task.  Beyond that, the
+	    complete output is still written to 'inner' (and so to the BTU Task Log, or its file)
+	  * The stream keeps roughly 'max_entries' entries, and expires 'ttl_seconds' after the last write.
+	  * If the Worker is killed, the output already sent to Redis survives, and can be stitched into the BTU Task Log.
+	"""
+
+	def __init__(self, inner, log_name, flush_interval=1.0, max_entries=2000, ttl_seconds=86400,  # pylint: disable=too-many-arguments
+	             max_entry_bytes=64 * 1024, max_total_bytes=4 * 1024 * 1024):
+		from frappe.utils.background_jobs import get_redis_conn
+		super().__init__()
+		self.inner = inner
+		self.key = get_live_output_key(log_name)
+		self.flush_interval = flush_interval
+		self.max_entries = max_entries
+		self.ttl_seconds = ttl_seconds
+		self.max_entry_bytes = max_entry_bytes
+		self.max_total_bytes = max_total_bytes
+		self._conn = get_redis_conn()
+		self._pending = ""
+		self._last_flush = 0.0
+		self._bytes_sent = 0
+		self._lock = threading.Lock()  # The timer thread and the Task's thread both push.
+		self._timer = None
+
+	def writable(self):
+		return True
+
+	def write(self, text):
+		written = self.inner.write(text)
+		with self._lock:
+			if self._bytes_sent >= self.max_total_bytes:
+				return written  # The limit was reached; only 'inner' receives output now.
+			self._pending += text
+			if "\n" in text:
+				if (time.monotonic() - self._last_flush) >= self.flush_interval:
+					self._push(final=False)
+				elif self._timer is None:
+					self._start_timer()
+		return written
+
+	def flush(self):
+		self.inner.flush()
+
+	def close(self):
+		with self._lock:
+			if self._timer:
+				self._timer.cancel()
+				self._timer = None
+			self._push(final=True)
+		super().close()
+
+	def _start_timer(self):
+		delay = max(self.flush_interval - (time.monotonic() - self._last_flush), 0.0)
+		self._timer = threading.Timer(delay, self._on_timer)
+		self._timer.daemon = True
+		self._timer.start()
+
+	def _on_timer(self):
+		with self._lock:
+			self._timer = None
+			if not self.closed:
+				self._push(final=False)
+
+	def _push(self, final):
+		"""
+		Send pending output to Redis.  The caller must hold 'self._lock'.
+		"""
+		if final:
+			lines, self._pending = self._pending, ""
+		else:
+			# Only send complete lines; keep any partial line for the next write.
+			last_newline = self._pending.rfind("\n")
+			lines, self._pending = self._pending[:last_newline + 1], self._pending[last_newline + 1:]
+		self._last_flush = time.monotonic()
+		if not lines or self._bytes_sent >= self.max_total_bytes:
+			return
+
+		encoded = lines.encode("utf-8")
+		budget = min(self.max_entry_bytes, self.max_total_bytes - self._bytes_sent)
+		if len(encoded) > budget:
+			# Keep the most recent output; that is what someone watching a running Task wants to see.
+			notice = f"... [{len(encoded) - budget} bytes of output not shown live] ...\n".encode("utf-8")
+			encoded = notice + encoded[-max(budget - len(notice), 0):]
+			lines = encoded.decode("utf-8", errors="ignore")
+		self._bytes_sent += len(encoded)
+		if self._bytes_sent >= self.max_total_bytes:
+			lines += "\n(BTU: the limit for live output was reached.  The complete output will be in the BTU Task Log.)\n"
+			self._pending = ""
+		try:
+			pipeline = self._conn.pipeline(transaction=False)
+			pipeline.xadd(self.key, {"lines": lines}, maxlen=self.max_entries, approximate=True)
+			pipeline.expire(self.key, self.ttl_seconds)
+			pipeline.execute()
+		except Exception as ex:
+			# Live output is a convenience; it must never cause the Task itself to fail.
+			self.inner.write(f"\n(BTU: unable to send live output to Redis: {ex})\n")
+
+
+def live_tail(inner, log_name):
+	"""
+	Returns a LiveTailWriter around 'inner' if live tailing is enabled in BTU Configuration.  Otherwise returns 'inner'.
+	"""
+	if not log_name or not frappe.db.get_single_value("BTU Configuration", "live_stdout_tailing", cache=True):
+		return inner
+	return LiveTailWriter(inner, log_name)
+
+
+def read_live_output(log_name, after_id=None):
+	"""
+	Returns a tuple (text, last_id) containing the live output written after stream entry 'after_id'.
+	"""
+	from frappe.utils.background_jobs import get_redis_conn
+	entries = get_redis_conn().xrange(get_live_output_key(log_name), min=after_id or "-", max="+")
+	if after_id and entries and entries[0][0].decode() == after_id:
+		entries = entries[1:]  # 'min' is inclusive; skip the entry the caller already has.
+	if not entries:
+		return "", after_id
+	text = "".join(fields[b"lines"].decode("utf-8") for _, fields in entries)
+	return text, entries[-1][0].decode()
+
+
+def delete_live_output(log_name):
+	from frappe.utils.background_jobs import get_redis_conn
+	get_redis_conn().delete(get_live_output_key(log_name))
@@ -0,0 +1,140 @@
+""" task_deadline.py """
+
+# --------
+#
+# Enforce a BTU Task's 'max_task_duration' inside the TaskRunner, instead of waiting for the In-Progress sweeper.
+#
+#   1. Soft deadline:  When the Task exceeds 'max_task_duration', TaskSoftTimeout is raised inside the Task.
+#                      Tasks may catch it (or implement BTU_AWARE_FUNCTION.on_timeout) to commit partial work.
+#   2. Hard deadline:  If the Task is still running 'timeout_grace_seconds' later, TaskHardTimeout is raised.
+#                      It derives from BaseException, so a bare 'except Exception' in the Task cannot swallow it.
+#
+# Both are asynchronous exceptions, delivered the next time the Task's thread executes Python bytecode.  A Task that is
+# blocked inside a C extension for a long time is still stopped by RQ's own Job timeout (see get_queue_timeout)
+#
+# --------
+
+import contextvars
+import threading
+import time
+
+import frappe
+from frappe.utils import cint
+
+from btu.btu_core.btu_worker import raise_in_thread
+
+DEFAULT_GRACE_SECONDS = 30
+
+# The TaskDeadline of the Task running in the current thread (or coroutine), so code inside the Task can respect it.
+_current_deadline = contextvars.ContextVar("btu_task_deadline", default=None)
+
+
+class TaskSoftTimeout(Exception):
+	"""
+	Raised inside a Task that has exceeded its 'max_task_duration'.
+	"""
+
+
+class TaskHardTimeout(BaseException):
+	"""
+	Raised inside a Task that is still running after its grace period.
+	"""
+
+
+def get_grace_seconds():
+	"""
+	Seconds between the soft and hard deadlines, from BTU Configuration.
+	"""
+	grace_seconds = frappe.db.get_single_value("BTU Configuration", "timeout_grace_seconds", cache=True)
+	return DEFAULT_GRACE_SECONDS if grace_seconds is None else max(cint(grace_seconds), 0)
+
+
+def get_remaining_seconds():
+	"""
+	Seconds until the soft deadline of the Task running in the current thread, or None if it has no deadline.
+	"""
+	deadline = _current_deadline.get()
+	return deadline.remaining_seconds() if deadline else None
+
+
+def get_queue_timeout(max_task_duration):
+	"""
+	The RQ Job timeout for a Task.  It must be longer than the hard deadline, so TaskRunner can finalize
+	the BTU Task Log before RQ kills the Job.
+	"""
+	max_task_duration = cint(max_task_duration)
+	if not max_task_duration:
+		return 3600
+	return max_task_duration + get_grace_seconds() + DEFAULT_GRACE_SECONDS
+
+
+class TaskDeadline():
+	"""
+	A context manager that raises TaskSoftTimeout, then TaskHardTimeout, in the thread that entered it.
+
+	Usage:
+		with TaskDeadline(600, 30) as deadline:
+			call_some_function()
+		if deadline.expired:
+			...
+	"""
+
+	def __init__(self, max_seconds, grace_seconds):
+		self.max_seconds = cint(max_seconds)
+		self.grace_seconds = max(cint(grace_seconds), 0)
+		self.soft_expired = False
+		self.hard_expired = False
+		self._thread_id = None
+		self._timers = []
+		self._active = False
+		self._lock = threading.Lock()
+		self._started = None
+		self._context_token = None
+
+	@property
+	def expired(self):
+		return self.soft_expired or self.hard_expired
+
+	def remaining_seconds(self):
+		"""
+		Seconds until the soft deadline.  Zero once it has passed.
+		"""
+		if not self._started:
+			return float(self.max_seconds)
+		return max(self.max_seconds - (time.monotonic() - self._started), 0.0)
+
+	def __enter__(self):
+		if self.max_seconds <= 0:
+			return self  # No duration, so nothing to enforce.
+		self._thread_id = threading.current_thread().ident
+		self._started = time.monotonic()
+		self._context_token = _current_deadline.set(self)
+		self._active = True
+		self._timers = [ threading.Timer(self.max_seconds, self._expire, args=(TaskSoftTimeout,)),
+		                 threading.Timer(self.max_seconds + self.grace_seconds, self._expire, args=(TaskHardTimeout,)) ]
+		for each_timer in self._timers:
+			each_timer.daemon = True
+			each_timer.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if not self._active:
+			return False
+		with self._lock:
+			self._active = False
+			for each_timer in self._timers:
+				each_timer.cancel()
+		_current_deadline.reset(self._context_token)
+		# A timer may have fired just before it was cancelled.  Never let that exception escape into unrelated code.
+		raise_in_thread(self._thread_id, None)
+		return False
+
+	def _expire(self, exception_class):
+		with self._lock:
+			if not self._active:
+				return
+			if exception_class is TaskSoftTimeout:
+				self.soft_expired = True
+			else:
+				self.hard_expired = True
+			raise_in_thread(self._thread_id, exception_class)
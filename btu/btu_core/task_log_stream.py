@@ -0,0 +1,313 @@
+""" task_log_stream.py """
+
+# --------
+#
+# Write-behind pipeline for 'BTU Task Log'
+#
+# When enabled in BTU Configuration, the TaskRunner and TaskComponentWrapper do not write Task Logs directly to MariaDB.
+# Instead they append small events (start, finish) to a Redis stream.  A drainer job (see hooks.py) periodically reads
+# the stream, and bulk-upserts the events into `tabBTU Task Log`.
+#
+# Task Components of a BTU Task whose 'Component Log Mode' is 'Aggregated' also use this stream (whether or not
+# write-behind is enabled)  Their 'component' events become rows of the parent Log's child table 'Component Results'.
+#
+# --------
+
+import json
+
+import frappe
+from frappe.utils import now_datetime
+from frappe.utils.background_jobs import get_redis_conn
+
+from btu import get_system_datetime_now
+from btu.btu_core.doctype.btu_task_log_blob.btu_task_log_blob import externalize_log_values, is_blob_store_enabled
+
+DEAD_LETTER_MAX_LENGTH = 10000
+
+# The columns that a stream event is allowed to populate.
+LOG_COLUMNS = (
+	"task",
+	"task_desc_short",
+	"task_component",
+	"schedule",
+	"date_time_started",
+	"execution_time",
+	"attempt",
+	"cpu_user_time",
+	"cpu_system_time",
+	"peak_rss_delta_mb",
+	"queue_time",
+	"profile_file",
+	"profile_summary",
+	"stdout",
+	"stdout_file",
+	"stdout_hash",
+	"stdout_length",
+	"result_message",
+	"result_message_hash",
+	"result_message_length",
+	"success_fail",
+	"cached_from_log",
+	"component_status",
+	"components_total",
+	"components_succeeded",
+	"components_failed",
+)
+
+# The columns of a 'component' event.  These become rows of the child table 'BTU Task Log Component'
+COMPONENT_COLUMNS = (
+	"component",
+	"status",
+	"execution_time",
+	"failure_log",
+	"stdout_excerpt",
+)
+
+
+def is_write_behind_enabled():
+	"""
+	Returns True if BTU Configuration says Task Logs should be written via the Redis stream.
+	"""
+	return bool(frappe.db.get_single_value("BTU Configuration", "write_behind_task_logs", cache=True))
+
+
+def get_stream_key(site_name=None):
+	"""
+	The Redis key of the stream.  Because the RQ Redis is shared by every Site on the bench, the key includes the Site.
+	"""
+	return f"btu:{site_name or frappe.local.site}:task_log_stream"
+
+
+def new_log_name():
+	"""
+	In write-behind mode there is no database round-trip to obtain the next Naming Series value.
+	So, like Transient Tasks, these Logs just get hash names.
+	"""
+	return f"BTLOG-{frappe.generate_hash(length=10)}"
+
+
+def append_log_event(event_type, log_name, **values):
+	"""
+	Append a single event to the Task Log stream.
+
+	Arguments
+		event_type:	Either 'start', 'finish', or 'update'.
+		log_name:	The primary key that the drainer will use for 'BTU Task Log'
+		values:		Any of the column names in LOG_COLUMNS.
+	"""
+	unknown_columns = set(values.keys()) - set(LOG_COLUMNS)
+	if unknown_columns:
+		raise ValueError(f"Cannot write these columns to BTU Task Log: {unknown_columns}")
+
+	payload = {
+		"event_type": event_type,
+		"name": log_name,
+		"values": values,
+		"timestamp": str(now_datetime())
+	}
+	get_redis_conn().xadd(get_stream_key(), {"data": json.dumps(payload, default=str)})
+	return log_name
+
+
+def append_component_event(parent_log_name, **values):
+	"""
+	Append the outcome of one Task Component to the stream.  The drainer adds it to the parent Log's 'Component Results'
+
+	Arguments
+		parent_log_name:	The BTU Task Log that receives the row.
+		values:				Any of the column names in COMPONENT_COLUMNS.
+	"""
+	unknown_columns = set(values.keys()) - set(COMPONENT_COLUMNS)
+	if unknown_columns:
+		raise ValueError(f"Cannot write these columns to BTU Task Log Component: {unknown_columns}")
+
+	payload = {
+		"event_type": "component",
+		"name": parent_log_name,
+		"values": values,
+		"timestamp": str(now_datetime())
+	}
+	get_redis_conn().xadd(get_stream_key(), {"data": json.dumps(payload, default=str)})
+
+
+def get_dead_letter_key(site_name=None):
+	"""
+	Stream entries that cannot be written to SQL are moved here, so they do not block the entries behind them.
+	"""
+	return f"{get_stream_key(site_name)}:dead_letter"
+
+
+def drain_task_log_stream(batch_size=500, max_batches=20):
+	"""
+	Read events from the Redis stream, and upsert them into `tabBTU Task Log`
+	This function is called via a cron schedule in BTU hooks.py
+	"""
+	conn = get_redis_conn()
+	stream_key = get_stream_key()
+
+	# Only one drainer per Site should be running at a time.
+	lock = conn.lock(f"{stream_key}:lock", timeout=300)
+	if not lock.acquire(blocking=False):
+		print("Another process is already draining the BTU Task Log stream.")
+		return 0
+
+	rows_written = 0
+	try:
+		for _ in range(int(max_batches)):
+			entries = conn.xrange(stream_key, min="-", max="+", count=int(batch_size))
+			if not entries:
+				break
+			try:
+				rows_written += _write_batch(entries)
+			except Exception as ex:
+				frappe.db.rollback()
+				print(f"Error while writing a batch of BTU Task Log events ({ex}).  Writing them one at a time.")
+				rows_written += _write_entries_individually(conn, entries)
+			conn.xdel(stream_key, *[entry_id for entry_id, _ in entries])
+			if len(entries) < int(batch_size):
+				break
+	finally:
+		lock.release()
+
+	if rows_written:
+		print(f"Drained {rows_written} BTU Task Log rows from the Redis stream.")
+	return rows_written
+
+
+def _write_entries_individually(conn, entries):
+	"""
+	After a batch fails, find the entries responsible.  Each entry that still fails alone goes to the dead-letter stream.
+	"""
+	rows_written = 0
+	for entry_id, fields in entries:
+		try:
+			rows_written += _write_batch([(entry_id, fields)])
+		except Exception as ex:
+			frappe.db.rollback()
+			print(f"Moving BTU Task Log stream entry {entry_id} to the dead-letter stream: {ex}")
+			conn.xadd(get_dead_letter_key(), {"data": fields[b"data"], "entry_id": entry_id, "error": str(ex)},
+			          maxlen=DEAD_LETTER_MAX_LENGTH, approximate=True)
+	return rows_written
+
+
+def _write_batch(entries):
+	"""
+	Merge a batch of stream entries by Log name, then upsert them with as few SQL statements as possible.
+	"""
+	merged_rows = {}  # Dictionary preserves the order of the stream.
+	started = set()
+	component_rows = []
+	for entry_id, fields in entries:
+		event = json.loads(fields[b"data"])
+		if event["event_type"] == "component":
+			component_rows.append((component_row_name(entry_id), event["name"], event["values"]))
+			continue
+		row = merged_rows.setdefault(event["name"], {})
+		row.update(event["values"])
+		if event["event_type"] == "start":
+			started.add(event["name"])
+
+	if is_blob_store_enabled():
+		# Compression and hashing happen here in the drainer, not on the hot path of the Task.
+		for row in merged_rows.values():
+			externalize_log_values(row)
+
+	# Group the rows by their set of columns, so each group can be written with one multi-row INSERT.
+	groups = {}
+	for log_name, row in merged_rows.items():
+		columns = tuple(column for column in LOG_COLUMNS if column in row)
+		groups.setdefault(columns, []).append((log_name, row))
+
+	timestamp = now_datetime()
+	for columns, rows in groups.items():
+		all_columns = ("name", "creation", "modified", "modified_by", "owner", "docstatus") + columns
+		values = []
+		for log_name, row in rows:
+			values.append((log_name, timestamp, timestamp, "Administrator", "Administrator", 0)
+			              + tuple(row[column] for column in columns))
+
+		placeholders = ", ".join(["(" + ", ".join(["%s"] * len(all_columns)) + ")"] * len(values))
+		updates = ", ".join(f"`{column}` = VALUES(`{column}`)" for column in ("modified",) + columns)
+		sql_statement = f""" INSERT INTO `tabBTU Task Log` ({", ".join(f"`{column}`" for column in all_columns)})
+		                     VALUES {placeholders}
+		                     ON DUPLICATE KEY UPDATE {updates} """
+		frappe.db.sql(sql_statement, values=[value for each_row in values for value in each_row])
+
+	if component_rows:
+		_write_component_rows(component_rows, timestamp)
+
+	_update_last_runtime(merged_rows)  # Same transaction, so a failure here cannot leave half of the batch committed.
+	frappe.db.commit()
+	_after_batch_written(merged_rows, started)
+	return len(merged_rows) + len(component_rows)
+
+
+def component_row_name(entry_id):
+	"""
+	The name of the 'BTU Task Log Component' row written for a stream entry.  Derived from the entry ID, so writing
+	the same entry again (for example, after a failed batch) cannot create a second row.
+	"""
+	return f"BTLC-{entry_id.decode() if isinstance(entry_id, bytes) else entry_id}"
+
+
+def _write_component_rows(component_rows, timestamp):
+	"""
+	Upsert the 'component' events as rows of the child table 'BTU Task Log Component', with one multi-row INSERT.
+	"""
+	row_names = tuple(row_name for row_name, _, _ in component_rows)
+	parent_names = tuple({ parent_name for _, parent_name, _ in component_rows })
+	# Only one drainer runs at a time, so it is safe to continue each parent's row numbering (idx) from here.
+	# Rows of this batch that were already written are excluded, so writing the batch again assigns the same numbers.
+	next_idx = dict(frappe.db.sql(""" SELECT parent, MAX(idx) FROM `tabBTU Task Log Component`
+	                                  WHERE parenttype = 'BTU Task Log' AND parent IN %(parents)s
+	                                  AND name NOT IN %(row_names)s
+	                                  GROUP BY parent """, values={"parents": parent_names, "row_names": row_names}))
+
+	all_columns = ("name", "creation", "modified", "modified_by", "owner", "docstatus",
+	               "parent", "parenttype", "parentfield", "idx") + COMPONENT_COLUMNS
+	values = []
+	for row_name, parent_name, row in component_rows:
+		next_idx[parent_name] = (next_idx.get(parent_name) or 0) + 1
+		values.append((row_name, timestamp, timestamp, "Administrator", "Administrator", 0,
+		               parent_name, "BTU Task Log", "component_results", next_idx[parent_name])
+		              + tuple(row.get(column) for column in COMPONENT_COLUMNS))
+
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * len(all_columns)) + ")"] * len(values))
+	sql_statement = f""" INSERT INTO `tabBTU Task Log Component` ({", ".join(f"`{column}`" for column in all_columns)})
+	                     VALUES {placeholders}
+	                     ON DUPLICATE KEY UPDATE `modified` = VALUES(`modified`) """
+	frappe.db.sql(sql_statement, values=[value for each_row in values for value in each_row])
+
+
+def _update_last_runtime(merged_rows):
+	"""
+	Bulk writes do not trigger the BTU Task Log controller methods.  Like after_insert(), update 'Last Runtime' of the Tasks.
+	The caller commits.
+	"""
+	task_ids = { row["task"] for row in merged_rows.values()
+	             if row.get("task") and row.get("task_component") in (None, "", "Main") }
+	if task_ids:
+		datetime_string = frappe.utils.data.get_datetime_str(get_system_datetime_now())
+		frappe.db.sql(""" UPDATE `tabBTU Task` SET last_runtime = %(last_runtime)s WHERE name IN %(task_ids)s """,
+		              values={"last_runtime": datetime_string, "task_ids": tuple(task_ids)})
+
+
+def _after_batch_written(merged_rows, started):
+	"""
+	The side effects of the BTU Task Log controller methods that follow the commit.  The batch is already written, so
+	these must never raise; a failure here would cause the drainer to write the batch again.
+	"""
+	from btu.btu_core import btu_email
+
+	# Emails are only sent for Logs that belong to a Task Schedule.
+	for log_name, row in merged_rows.items():
+		if not row.get("schedule") or row.get("task_component") not in (None, "", "Main"):
+			continue
+		try:
+			doc_log = frappe.get_doc("BTU Task Log", log_name)
+			if log_name in started:
+				btu_email.email_on_task_start(doc_log)
+			if doc_log.success_fail != "In-Progress":
+				btu_email.email_on_task_conclusion(doc_log)
+		except Exception as ex:
+			print(f"Error while sending email about BTU Task Log {log_name}: {ex}")
@@ -0,0 +1,107 @@
+""" task_profiler.py """
+
+# --------
+#
+# On-demand profiling of BTU Tasks.
+#
+# An administrator sets 'Profile Next Runs' on a BTU Task (or a BTU Task Schedule) to a number N.  The next N runs
+# of the Task are wrapped in cProfile.  The raw stats are attached to the BTU Task Log as a '.prof' file (readable
+# with pstats, snakeviz, etc.), and a summary of the most expensive functions is shown on the Log's form.
+#
+# When the counters are zero, the profiler is never created.
+#
+# --------
+
+import cProfile
+import io
+import marshal
+import pstats
+
+import frappe
+
+SUMMARY_LINE_COUNT = 30
+
+
+def claim_profiled_run(task_id, schedule_id=None, task_runs=None):
+	"""
+	Returns True if this run of the Task should be profiled.  If so, decrements the counter that requested it.
+	The Schedule's counter is used first, then the Task's.
+
+	Arguments
+		task_runs:	Optional.  The Task's counter, from the BTU Task document already loaded by the caller.
+
+	When profiling was not requested, no SQL is executed: the Task's counter comes from the caller, and the
+	Schedule's from the document cache.  Only when either is positive are the counters read (and claimed) in SQL.
+	"""
+	if task_runs is None:
+		task_runs = frappe.get_cached_value("BTU Task", task_id, "profile_next_runs")
+	schedule_runs = frappe.get_cached_value("BTU Task Schedule", schedule_id, "profile_next_runs") if schedule_id else 0
+	if not ((task_runs or 0) > 0 or (schedule_runs or 0) > 0):
+		return False
+
+	row = frappe.db.sql("""
+		SELECT
+			 IFNULL(Task.profile_next_runs, 0)		AS task_runs
+			,IFNULL(Schedule.profile_next_runs, 0)	AS schedule_runs
+		FROM
+			`tabBTU Task`	AS Task
+		LEFT JOIN
+			`tabBTU Task Schedule`	AS Schedule
+		ON
+			Schedule.name = %(schedule_id)s
+		WHERE
+			Task.name = %(task_id)s
+	""", values={"task_id": task_id, "schedule_id": schedule_id or ""}, as_dict=True)
+	if not row or not (row[0].task_runs > 0 or row[0].schedule_runs > 0):
+		return False
+
+	doctype, name = ("BTU Task Schedule", schedule_id) if row[0].schedule_runs > 0 else ("BTU Task", task_id)
+	# Direct SQL, so saving the document does not (for example) reload the Schedule into the RQ Scheduler.
+	frappe.db.sql(f""" UPDATE `tab{doctype}` SET profile_next_runs = GREATEST(profile_next_runs - 1, 0)
+	                   WHERE name = %(name)s """, values={"name": name})
+	frappe.db.commit()
+	frappe.clear_document_cache(doctype, name)  # The cached counter is now out of date.
+	return True
+
+
+class TaskProfiler():
+	"""
+	Usage:
+		profiler = TaskProfiler()
+		ret = profiler.runcall(some_function, *args, **kwargs)
+		log_values = profiler.save(log_name)  # attaches the stats to BTU Task Log 'log_name'
+	"""
+
+	def __init__(self):
+		self.profile = cProfile.Profile()
+
+	def runcall(self, function, *args, **kwargs):
+		return self.profile.runcall(function, *args, **kwargs)
+
+	def summary(self, line_count=SUMMARY_LINE_COUNT):
+		"""
+		Returns the top functions, sorted by cumulative time, as text.
+		"""
+		buffer = io.StringIO()
+		stats = pstats.Stats(self.profile, stream=buffer)
+		stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(line_count)
+		return buffer.getvalue()
+
+	def save(self, log_name):
+		"""
+		Attach the raw stats to the BTU Task Log, and return a dictionary of Task Log fields.
+		"""
+		self.profile.create_stats()
+		stats_file = frappe.get_doc({
+			"doctype": "File",
+			"file_name": f"{log_name}.prof",
+			"attached_to_doctype": "BTU Task Log",
+			"attached_to_name": log_name,
+			"is_private": 1,
+			"content": marshal.dumps(self.profile.stats)  # the same format as pstats.Stats.dump_stats()
+		})
+		stats_file.save(ignore_permissions=True)
+		return {
+			"profile_file": stats_file.file_url,
+			"profile_summary": self.summary()
+		}
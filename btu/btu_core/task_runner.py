@@ -2,15 +2,31 @@
 btu.task_runner.py
 """
 
-from contextlib import redirect_stdout
+import asyncio
+from collections import namedtuple
+from contextlib import nullcontext
 from enum import Enum
+import importlib
+import inspect
 import io
+import os
 import sys
 import time
 import uuid
 
 # Frappe
 import frappe
+from rq import get_current_job
+
+# BTU
+from btu.btu_core.btu_worker import ensure_site_connection
+from btu.btu_core.result_cache import get_cached_result, make_cache_key, store_result
+from btu.btu_core.retry_policy import RetryPolicy
+from btu.btu_core.run_metrics import RunMetrics
+from btu.btu_core.schedule_overlap import ScheduleOverlapGuard, TaskCancelled
+from btu.btu_core.stdout_capture import redirect_task_stdout
+from btu.btu_core.task_deadline import TaskDeadline, TaskHardTimeout, TaskSoftTimeout, get_grace_seconds, get_queue_timeout
+from btu.btu_core.task_profiler import TaskProfiler, claim_profiled_run
 
 class StandardOutput(Enum):
 	NONE = 0
@@ -18,6 +34,79 @@ class StandardOutput(Enum):
 	DB_LOG = 2
 	FILE = 3
 
+
+# A process-level cache of function strings that were already imported and resolved.
+ResolvedCallable = namedtuple("ResolvedCallable", ["function_string", "function", "is_btu_aware", "is_async", "signature"])
+_resolved_callables = {}
+
+
+def is_btu_aware_class(callable_function):
+	"""
+	Returns True if the callable is a subclass of BTU_AWARE_FUNCTION.  The class is never instantiated.
+	"""
+	from btu.btu_core.doctype.btu_task.btu_task import BTU_AWARE_FUNCTION  # late import required, due to circular reference risks.
+	return isinstance(callable_function, type) and issubclass(callable_function, BTU_AWARE_FUNCTION)
+
+
+def resolve_function_string(function_string):
+	"""
+	Given a path like 'btu.manual_tests.ping_with_wait', return a ResolvedCallable.
+
+	Results are cached per process.  A cached entry is discarded when its module has been reloaded,
+	because the module's attribute will no longer be the same object.
+	"""
+	module_path, function_name = TaskRunner.split_function_path(function_string)
+	cached = _resolved_callables.get(function_string)
+	if cached:
+		module_object = sys.modules.get(module_path)
+		if module_object and getattr(module_object, function_name, None) is cached.function:
+			return cached
+
+	module_object = importlib.import_module(module_path)
+	function = getattr(module_object, function_name)
+	if not callable(function):
+		raise TypeError(f"The function string '{function_string}' is not a callable function.")
+
+	is_btu_aware = is_btu_aware_class(function)
+	target = function.run if is_btu_aware else function
+	try:
+		signature = inspect.signature(target)
+	except (TypeError, ValueError):
+		signature = None  # some builtins do not have a signature.
+
+	resolved = ResolvedCallable(function_string, function, is_btu_aware, inspect.iscoroutinefunction(target), signature)
+	_resolved_callables[function_string] = resolved
+	return resolved
+
+
+def run_if_awaitable(result):
+	"""
+	If a Task's function was an 'async def' (or a BTU-aware class with an 'async def run()'), calling it only created
+	a coroutine.  Run that coroutine to completion on a new event loop, and return its result.
+	"""
+	if not inspect.isawaitable(result):
+		return result
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(_await(result))
+	result.close()  # avoid a 'coroutine was never awaited' warning.
+	raise RuntimeError("Cannot run an asynchronous BTU Task from inside an event loop that is already running.")
+
+
+async def _await(awaitable):
+	return await awaitable
+
+
+def clear_resolved_callable_cache(function_string=None):
+	"""
+	Remove one function string (or everything) from the process-level cache.
+	"""
+	if function_string:
+		_resolved_callables.pop(function_string, None)
+	else:
+		_resolved_callables.clear()
+
 # Further Reading:
 # https://www.geeksforgeeks.org/decorators-with-parameters-in-python/
 # http://gael-varoquaux.info/programming/decoration-in-python-done-right-decorating-and-pickling.html
@@ -34,11 +123,12 @@ class TaskRunner():
 		function_name = function_path.split('.')[-1]
 		return (module_path, function_name)
 
-	def __init__(self, btu_task, site_name, schedule_id=None, enable_debug_mode=True):
+	def __init__(self, btu_task, site_name, schedule_id=None, enable_debug_mode=True, schedule_doc=None):
 		"""
 		args:
 			btu_task : Either a Document or string that represents the primary key of a BTU Task.
 			site_name : Name of the calling Site.
+			schedule_doc : Optional.  The BTU Task Schedule Document, if the caller already has it.
 		"""
 		from btu.btu_core.doctype.btu_task.btu_task import BTUTask as BTUTaskType  # late import required, due to circular reference risks.
 
@@ -62,13 +152,21 @@ class TaskRunner():
 		self.schedule_id = schedule_id
 		self.debug_mode_enabled = enable_debug_mode
 		self.redis_job_id = uuid.uuid4().hex
-		self.standard_output = StandardOutput.DB_LOG
+		self.standard_output = StandardOutput.FILE if self.btu_task.get("stdout_to_file") else StandardOutput.DB_LOG
+		self.stdout_file_path = None
+		self.captured_stdout = None
+		self.live_tail_enabled = False
+		self.task_log_name = None
+		self.write_behind = False
+		self.profiler = None
+		self.attempt = 1  # Increases each time a retry policy re-enqueues the Task.
 
 		# Fetch the Task's built-in arguments.
 		self.kwarg_dict = self.btu_task.built_in_arguments() or {}
 		if self.schedule_id:
 			# Override any keys with those specified by the Task Schedule's arguments:
-			schedule_arguments = frappe.get_doc("BTU Task Schedule", self.schedule_id).built_in_arguments() or {}
+			schedule_doc = schedule_doc or frappe.get_doc("BTU Task Schedule", self.schedule_id)
+			schedule_arguments = schedule_doc.built_in_arguments() or {}
 			if sys.version_info >= (3,9,0):
 				self.kwarg_dict = self.kwarg_dict | schedule_arguments # merge the 2 dictionaries.
 			else:
@@ -106,21 +204,12 @@ class TaskRunner():
 		"""
 		Returns True if the 'function_string' is actually the path to a BTU-Aware class.
 		"""
-		from btu.btu_core.doctype.btu_task.btu_task import BTU_AWARE_FUNCTION
-		result = False
-		if isinstance(callable_function, type):
-			# To find out if this is a subclass of BTU_AWARE_FUNCTION, we have to instantiate it.
-			# If it's not a subclass, it's going to throw a hard Exception.  So we should catch it and just return False.
-			try:
-				if isinstance(callable_function(btu_task_id=self.btu_task.name), BTU_AWARE_FUNCTION):
-					result = True
-			except Exception as ex:
-				print(ex)
+		result = is_btu_aware_class(callable_function)
 		if debug:
 			print(f"Is this a BTU-Aware function = {result}")
 		return result
 
-	def function_wrapper(self):  # pylint: disable=too-many-locals, too-many-statements, too-many-branches
+	def function_wrapper(self):
 		"""
 		This function is effectively a 'decorator' or 'wrapper' around some other Python function.
 		The code below is complex and very important.
@@ -128,58 +217,122 @@ class TaskRunner():
 		To help debug and explain what is happening, I've included a 'dprint()' function.
 		This function only prints when TaskRunner argument 'enable_debug_mode' is True.
 		"""
-		# I'm not confident that importing here (instead of the module level) makes any difference.
-		# Still, it "feels right", given this function is executed independently by the Queue.
-		# It's possible that Python + RQ pickle the entire Class and namespace, though.
-		import importlib
-		from btu import Result, get_system_datetime_now, make_datetime_naive
-		from btu.btu_core.doctype.btu_task_log.btu_task_log import write_log_for_task
-
+		self.redis_job_id = uuid.uuid4().hex  # The same pickled TaskRunner may be run many times. (see pickled_task_cache.py)
 		self.dprint(f"\n-------- Begin function_wrapper (Redis Job = {self.redis_job_id})--------\n")
 		if not hasattr(frappe, 'boot'):
 			# The missing 'boot' object is the best-indication that this function is running on RQ, not the web server.
 			# This means we have to initialize the frappe namespace, choose a Site, and connect to the MySQL DB.
 			self.dprint("This code is running independently from the Web Server.  Need to initialize a few things:")
-			frappe.init(site=self.site_name)
-			frappe.connect()
+			ensure_site_connection(self.site_name)  # does nothing if execute_job() already connected to this Site.
 			self.dprint("\u2713 Initialization complete.")
 		else:
 			self.dprint("This code is being executed directly by the Web Server.")
 
-		module_object = importlib.import_module(self.module_path())  # Need to import the function's module into scope.
-		function_to_call = getattr(module_object, self.function_name())
+		function_to_call = resolve_function_string(self.btu_task.function_string).function  # imports the module, unless cached.
+
+		# The Schedule's overlap policy may prevent this run, if a previous run is still active.
+		overlap_guard = ScheduleOverlapGuard.for_schedule(self.schedule_id, token=uuid.uuid4().hex)
+		if overlap_guard and not overlap_guard.acquire():
+			self.dprint("\n-------- End function_wrapper (a previous run is still active) --------\n")
+			return
+		try:
+			self.run_function_and_log(function_to_call, overlap_guard)
+		finally:
+			if overlap_guard and overlap_guard.release():
+				self.enqueue_coalesced_run()
+		self.dprint("\n-------- End function_wrapper --------\n")
+
+	def run_function_and_log(self, function_to_call, overlap_guard=None):  # pylint: disable=too-many-locals, too-many-statements
+		"""
+		Call the function, capturing its standard output, then write the results to BTU Task Log.
+		"""
+		# I'm not confident that importing here (instead of the module level) makes any difference.
+		# Still, it "feels right", given this function is executed independently by the Queue.
+		# It's possible that Python + RQ pickle the entire Class and namespace, though.
+		from btu import Result, get_system_datetime_now, make_datetime_naive
+		from btu.btu_core.doctype.btu_task_log.btu_task_log import write_log_for_task
+		from btu.btu_core.stdout_capture import delete_live_output
+
 		function_result = None
 
 		self.dprint(f"Calling function '{self.function_name()}' in module '{self.module_path()}'.")
 		self.dprint("Begin Standard Output (TaskRunner.function_wrapper):\n")
 
 		start_datetime = make_datetime_naive(get_system_datetime_now()) # Recording this in the System Time Zone
+		cache_key = None
+		if self.btu_task.get("cache_results"):
+			cache_key = make_cache_key(self.btu_task.function_string, self.kwarg_dict)
+			if self.log_cached_result(cache_key, start_datetime):
+				return  # An earlier run with the same arguments already produced the result.
+
 		self.create_new_log(start_datetime)  # Create a new BTU Task Log, with a status of "In Progress"
+		if claim_profiled_run(self.btu_task.name, self.schedule_id, task_runs=self.btu_task.get("profile_next_runs") or 0):
+			self.dprint("Profiling is enabled for this run.")
+			self.profiler = TaskProfiler()
 		execution_start = time.time()
+		run_metrics = RunMetrics().start()  # CPU time and peak memory of this run.
+		deadline = TaskDeadline(self.btu_task.max_task_duration, get_grace_seconds())
+		timeout_message = f"Task exceeded its Max Task Duration of {deadline.max_seconds} seconds."
+		retry_delay = None
 
 		try:
 			stdout_buffer_for_log = None
 			self.dprint(f"Keyword arguments are as follows: {self.kwarg_dict}")
 			datetime_string = get_system_datetime_now().strftime("%m/%d/%Y, %H:%M:%S %Z")
 
-			# Option 1: Function output will be routed to Standard Output, and saved to a log file on disk.
-			if self.standard_output == StandardOutput.STDOUT:
-				ret = self.option_standard_output(datetime_string, function_to_call)
-			# Option 2: Standard output intercepted, and saved to a SQL table `tabBTU Task Log`
-			elif self.standard_output == StandardOutput.DB_LOG:
-				ret, stdout_buffer_for_log = self.option_log_to_sql(datetime_string, function_to_call)
+			# Enforce 'max_task_duration' while the function runs.  Also allow a newer run of the Schedule to cancel this one.
+			with deadline, (overlap_guard.cancellable() if overlap_guard else nullcontext()):
+				# Option 1: Function output will be routed to Standard Output, and saved to a log file on disk.
+				if self.standard_output == StandardOutput.STDOUT:
+					ret = self.option_standard_output(datetime_string, function_to_call)
+				# Option 2: Standard output intercepted, and saved to a SQL table `tabBTU Task Log`
+				elif self.standard_output == StandardOutput.DB_LOG:
+					ret, stdout_buffer_for_log = self.option_log_to_sql(datetime_string, function_to_call)
+				# Option 3: Standard output streamed to a rotating file on disk; only an excerpt is saved to `tabBTU Task Log`
+				elif self.standard_output == StandardOutput.FILE:
+					ret, stdout_buffer_for_log = self.option_log_to_file(datetime_string, function_to_call)
+				else:
+					raise Exception(f"No code implemented for Standard Output = '{self.standard_output}'")
+
+			execution_time = round(time.time() - execution_start,3)
+			if deadline.expired:
+				# The function caught TaskSoftTimeout (probably to save partial work), then returned.
+				function_result = Result(False, ret or timeout_message, execution_time=execution_time)
 			else:
-				raise Exception(f"No code implemented for Standard Output = '{self.standard_output}'")
+				function_result = Result(True, ret, execution_time=execution_time)
+
+		except (TaskSoftTimeout, TaskHardTimeout):
+			self.dprint(f"Function '{self.function_name()}' was stopped after {deadline.max_seconds} seconds.")
+			execution_time = round(time.time() - execution_start,3)
+			function_result = Result(False, timeout_message, execution_time=execution_time)
+			if deadline.hard_expired:
+				frappe.db.rollback()  # The function was interrupted at an arbitrary point; discard its uncommitted work.
+			stdout_buffer_for_log = stdout_buffer_for_log or self.captured_stdout
 
+		except TaskCancelled:
+			self.dprint(f"Function '{self.function_name()}' was cancelled by a newer run of Schedule '{self.schedule_id}'")
 			execution_time = round(time.time() - execution_start,3)
-			function_result = Result(True, ret, execution_time=execution_time)
+			function_result = Result(False, f"Cancelled: a newer run of BTU Task Schedule '{self.schedule_id}' replaced this one.",
+			                         execution_time=execution_time)
+			stdout_buffer_for_log = stdout_buffer_for_log or self.captured_stdout
+			frappe.db.rollback()  # The function was interrupted at an arbitrary point; discard its uncommitted work.
 
 		except Exception as ex:
 			self.dprint(f"Error in call to function '{self.function_name()}'\n{ex}")
 			execution_time = round(time.time() - execution_start,3)
 			function_result = Result(False, str(ex), execution_time=execution_time)
+			stdout_buffer_for_log = stdout_buffer_for_log or self.captured_stdout
+			retry_policy = RetryPolicy.for_task(self.btu_task)
+			if retry_policy and not deadline.expired and retry_policy.should_retry(ex, self.attempt):
+				frappe.db.rollback()  # The next attempt starts from a clean transaction.
+				retry_delay = retry_policy.delay_for(self.attempt)
+				function_result = Result(False, f"{ex}\n(Attempt {self.attempt} of {retry_policy.max_attempts}.  Retrying in {retry_delay} seconds.)",
+				                         execution_time=execution_time)
 
 		self.dprint(f"\nEnd Standard Output\nFunction Result: {function_result}")
+		run_metrics = run_metrics.stop()
+		if self.profiler:
+			run_metrics.update(self.save_profile())
 
 		# The final step is to update BTU Task Log, and record the results!
 		self.dprint("Attempting to write to BTU Task Logs:")
@@ -188,46 +341,178 @@ class TaskRunner():
 										log_name=self.task_log_name,
 							            stdout=stdout_buffer_for_log or None,
 							            date_time_started=start_datetime,
-										schedule_id=self.schedule_id)
+										schedule_id=self.schedule_id,
+										stdout_file=self.stdout_file_path,
+										write_behind=self.write_behind,
+										run_metrics=run_metrics,
+										status='Timeout' if deadline.expired else None,
+										attempt=self.attempt)
 		self.dprint(f"Updated the BTU Task Log record: '{new_log_id}'")
-		self.dprint("\n-------- End function_wrapper --------\n")
+		if self.live_tail_enabled:
+			delete_live_output(self.task_log_name)  # The complete output is now in the BTU Task Log.
+		if retry_delay is not None:
+			self.enqueue_retry(retry_delay)
+		if cache_key and function_result.okay and not deadline.expired:
+			try:
+				store_result(cache_key, new_log_id, function_result.message, self.btu_task.get("cache_ttl_seconds"))
+			except Exception as ex:
+				print(f"Unable to cache the result of BTU Task '{self.btu_task.name}': {ex}")
+
+	def log_cached_result(self, cache_key, start_datetime):
+		"""
+		If a result is cached for these arguments, write a 'Cached' BTU Task Log instead of calling the function.
+		Returns True when the cache was used.
+		"""
+		from btu import Result
+		from btu.btu_core import task_log_stream
+		from btu.btu_core.doctype.btu_task_log.btu_task_log import write_log_for_task
+
+		try:
+			cached = get_cached_result(cache_key)
+		except Exception as ex:
+			print(f"Unable to read the result cache for BTU Task '{self.btu_task.name}': {ex}")
+			return False
+		if not cached:
+			return False
+
+		new_log_id = write_log_for_task(task_id=self.btu_task.name,
+		                                result=Result(True, cached["message"], execution_time=0),
+		                                date_time_started=start_datetime,
+		                                schedule_id=self.schedule_id,
+		                                write_behind=task_log_stream.is_write_behind_enabled(),
+		                                status='Cached',
+		                                cached_from_log=cached["log_name"])
+		self.dprint(f"Used the cached result of BTU Task Log '{cached['log_name']}'.  Wrote BTU Task Log '{new_log_id}'")
+		return True
+
+	def new_runner_for_next_run(self):
+		"""
+		Returns a fresh TaskRunner for the same Task, Schedule, and keyword arguments.
+		"""
+		next_runner = TaskRunner(self.btu_task.name, site_name=self.site_name, schedule_id=self.schedule_id,
+		                         enable_debug_mode=self.debug_mode_enabled)
+		next_runner.kwarg_dict = self.kwarg_dict
+		return next_runner
+
+	def queue_name_for_next_run(self):
+		rq_job = get_current_job()
+		if rq_job:
+			return rq_job.origin
+		if self.schedule_id:
+			return frappe.db.get_value("BTU Task Schedule", self.schedule_id, "queue_name") or self.btu_task.queue_name
+		return self.btu_task.queue_name
+
+	def enqueue_coalesced_run(self):
+		"""
+		Under the 'Coalesce' overlap policy, runs that arrived while this one was active were combined into one.  Enqueue it now.
+		"""
+		from btu.btu_api import enqueue  # late import required, due to circular reference risks.
+
+		next_runner = self.new_runner_for_next_run()
+		enqueue(method=next_runner.function_wrapper,
+		        queue=self.queue_name_for_next_run(),
+		        timeout=get_queue_timeout(next_runner.btu_task.max_task_duration),
+		        job_name=next_runner.btu_task.desc_short)
+		self.dprint(f"Enqueued the pending run of BTU Task Schedule '{self.schedule_id}'")
+
+	def enqueue_retry(self, delay_seconds):
+		"""
+		Schedule the next attempt of this Task, according to its retry policy.  The Worker does not wait for it.
+		"""
+		from btu.btu_api import enqueue_in  # late import required, due to circular reference risks.
+
+		next_runner = self.new_runner_for_next_run()
+		next_runner.attempt = self.attempt + 1
+		enqueue_in(delay_seconds,
+		           method=next_runner.function_wrapper,
+		           queue=self.queue_name_for_next_run(),
+		           timeout=get_queue_timeout(next_runner.btu_task.max_task_duration),
+		           job_name=next_runner.btu_task.desc_short)
+		self.dprint(f"Attempt {next_runner.attempt} of BTU Task '{self.btu_task.name}' will start in {delay_seconds} seconds.")
+
+	def call_task_function(self, function_to_call):
+		"""
+		Call the Task's function (or the run() method of a BTU-aware class), passing any keyword arguments.
+		"""
+		if self.profiler:
+			return self.profiler.runcall(self._call_task_function, function_to_call)
+		return self._call_task_function(function_to_call)
+
+	def _call_task_function(self, function_to_call):
+		keyword_arguments = self.kwarg_dict or {}
+		if self.is_this_btu_aware_function(function_to_call):
+			btu_aware_instance = function_to_call(self.btu_task.name)  # create an instance of the BTU-aware class, and call its run() method.
+			btu_aware_instance.btu_task_schedule_id = self.schedule_id
+			btu_aware_instance.btu_task_log_name = self.task_log_name  # for example, so a ComponentGroup can update it.
+			try:
+				return run_if_awaitable(btu_aware_instance.run(**keyword_arguments))
+			except TaskSoftTimeout:
+				btu_aware_instance.on_timeout()  # During the grace period, the Task may commit its partial work.
+				raise
+
+		ret = function_to_call(**keyword_arguments)  # ---- call the underlying function + arguments ----
+		return run_if_awaitable(ret)  # Coroutines are run on an event loop, inside the same stdout capture.
+
+	def save_profile(self):
+		"""
+		Attach the profiler's stats to the BTU Task Log.  Returns a dictionary of Task Log fields.
+		"""
+		try:
+			return self.profiler.save(self.task_log_name)
+		except Exception as ex:
+			# A profile is diagnostic information; it must never cause the Task itself to fail.
+			return { "profile_summary": f"Unable to save the profile: {ex}" }
+		finally:
+			self.profiler = None
 
 	def option_standard_output(self, datetime_string, function_to_call):
 		print(f"--------\nBTU Task {self.btu_task.name} starting at: {datetime_string}")
-		if self.kwarg_dict:
-			if self.is_this_btu_aware_function(function_to_call):
-				ret = function_to_call(self.btu_task.name).run(**self.kwarg_dict)    # create an instance of the BTU-aware class, and call its run() method.
-			else:
-				ret = function_to_call(**self.kwarg_dict)  # ---- call the underlying function + arguments ----
-		else:
-			# No keyword arguments for this Task:
-			if self.is_this_btu_aware_function(function_to_call):
-				ret = function_to_call(self.btu_task.name).run()    # create an instance of the BTU-aware class, and call its run() method.
-			else:
-				ret = function_to_call()  # ----call the underlying function----
-		return ret
+		return self.call_task_function(function_to_call)
 
 	def option_log_to_sql(self, datetime_string, function_to_call):
 		"""
 		Call the function, and capture STDOUT so we can write it to BTU Task Logs.
 		"""
+		from btu.btu_core.stdout_capture import live_tail
 		print(f"--------\nBTU Task {self.btu_task.name} starting at: {datetime_string}")
 		buffer = io.StringIO()
-		with redirect_stdout(buffer):
-			# Yes, has keyword arguments:
-			if self.kwarg_dict:
-				if self.is_this_btu_aware_function(function_to_call):
-					ret = function_to_call(self.btu_task.name).run(**self.kwarg_dict)    # create an instance of the BTU-aware class, and call its run() method.
-				else:
-					ret = function_to_call(**self.kwarg_dict)  # ---- call the underlying function + arguments ----
-			# No, does not have keyword arguments for this Task:
-			else:
-				if self.is_this_btu_aware_function(function_to_call):
-					ret = function_to_call(self.btu_task.name).run()    # create an instance of the BTU-aware class, and call its run() method.
-				else:
-					ret = function_to_call()  # ----call the underlying function----
-			stdout_buffer_for_log = buffer.getvalue()  	 # fetch any Stdout from the buffer.
-		return ret, stdout_buffer_for_log
+		writer = live_tail(buffer, self.task_log_name)  # optionally, also copy lines to Redis while the function runs.
+		self.live_tail_enabled = writer is not buffer
+		with redirect_task_stdout(writer):
+			try:
+				ret = self.call_task_function(function_to_call)
+			finally:
+				if self.live_tail_enabled:
+					writer.close()
+				self.captured_stdout = buffer.getvalue()  	 # fetch any Stdout from the buffer, even if the function failed.
+		return ret, self.captured_stdout
+
+	def option_log_to_file(self, datetime_string, function_to_call):
+		"""
+		Call the function, and stream STDOUT to a size-capped, rotating file on disk.
+		Only a head/tail excerpt of the output is returned, for writing to BTU Task Logs.
+		"""
+		from btu.btu_core.stdout_capture import RotatingStdoutFile, get_stdout_directory, live_tail
+
+		config = frappe.get_cached_doc("BTU Configuration")
+		self.stdout_file_path = os.path.join(get_stdout_directory(), f"{self.task_log_name or self.redis_job_id}.log")
+		print(f"--------\nBTU Task {self.btu_task.name} starting at: {datetime_string}")
+		print(f"Standard output is being written to file '{self.stdout_file_path}'")
+
+		stdout_file = RotatingStdoutFile(self.stdout_file_path,
+		                                 max_bytes=(config.stdout_file_max_size_mb or 10) * 1024 * 1024,
+		                                 backup_count=config.stdout_file_backup_count)
+		writer = live_tail(stdout_file, self.task_log_name)
+		self.live_tail_enabled = writer is not stdout_file
+		try:
+			with redirect_task_stdout(writer):
+				ret = self.call_task_function(function_to_call)
+		finally:
+			if self.live_tail_enabled:
+				writer.close()
+			stdout_file.close()
+			self.captured_stdout = stdout_file.excerpt()
+		return ret, self.captured_stdout
 
 	def create_new_log(self, date_time_started):
 		"""
@@ -237,6 +522,21 @@ class TaskRunner():
 		The continued existing of a Log with the status 'In Progress' is a good indicator to administrators that
 		the BTU Task failed inside the RQ, and will never return a result.
 		"""
+		from btu.btu_core import task_log_stream
+
+		self.write_behind = task_log_stream.is_write_behind_enabled()
+		if self.write_behind:
+			# Append a 'start' event to the Redis stream; the drainer job will write it to SQL later.
+			self.task_log_name = task_log_stream.append_log_event("start", task_log_stream.new_log_name(),
+			                                                      task=self.btu_task.name,
+			                                                      task_desc_short=self.btu_task.desc_short,
+			                                                      schedule=self.schedule_id,
+			                                                      task_component='Main',
+			                                                      date_time_started=date_time_started,
+			                                                      success_fail='In-Progress')
+			self.dprint(f"Appended a new BTU Task Log event to the Redis stream: '{self.task_log_name}'")
+			return
+
 		new_log = frappe.new_doc("BTU Task Log")  # Create a new Log.
 		new_log.task = self.btu_task.name
 		new_log.task_desc_short = self.btu_task.desc_short
@@ -248,3 +548,19 @@ class TaskRunner():
 		frappe.db.commit()
 		self.dprint(f"Created a new BTU Task Log record: '{new_log.name}'")
 		self.task_log_name = new_log.name
+
+
+def run_task_by_reference(task_id, schedule_id=None, task_kwargs=None, enable_debug_mode=True):
+	"""
+	The RQ Job function when BTU Configuration 'Job Serialization' is 'By Reference'.
+
+	The Job only carries these small arguments.  The BTU Task and Schedule are loaded from the Frappe document cache,
+	and a TaskRunner is created here, in the Worker.
+	"""
+	task_runner = TaskRunner(btu_task=frappe.get_cached_doc("BTU Task", task_id),
+	                         site_name=frappe.local.site,
+	                         schedule_id=schedule_id,
+	                         enable_debug_mode=enable_debug_mode,
+	                         schedule_doc=frappe.get_cached_doc("BTU Task Schedule", schedule_id) if schedule_id else None)
+	task_runner.add_keyword_arguments(**(task_kwargs or {}))  # exactly the arguments a 'Full' Job would have carried.
+	return task_runner.function_wrapper()
@@ -0,0 +1,42 @@
+# Copyright (c) 2026, Datahenge LLC and contributors
+# For license information, please see license.txt
+
+import unittest
+from unittest import mock
+
+from btu.btu_core import retry_policy
+from btu.btu_core.retry_policy import RetryPolicy
+
+
+class RetryableError(Exception):
+	pass
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+	def test_delay_grows_exponentially(self):
+		policy = RetryPolicy(base_delay=2, multiplier=3, jitter=0)
+		self.assertEqual([ policy.delay_for(attempt) for attempt in (1, 2, 3, 4) ], [2, 6, 18, 54])
+
+	def test_jitter_stays_within_bounds(self):
+		policy = RetryPolicy(base_delay=10, multiplier=2, jitter=0.1)
+		for _ in range(200):
+			self.assertTrue(9 <= policy.delay_for(1) <= 11)
+
+	def test_values_are_clamped(self):
+		policy = RetryPolicy(max_attempts=0, base_delay=-5, multiplier=0.5, jitter=3)
+		self.assertEqual((policy.max_attempts, policy.base_delay, policy.multiplier, policy.jitter), (1, 0, 1, 1))
+
+	def test_no_retry_after_the_last_attempt(self):
+		policy = RetryPolicy(max_attempts=3, retryable_exceptions=[f"{__name__}.RetryableError"])
+		with mock.patch.object(retry_policy, "frappe") as mock_frappe:
+			mock_frappe.RetryBackgroundJobError = type("RetryBackgroundJobError", (Exception,), {})
+			mock_frappe.local.db = None
+			mock_frappe.get_attr.return_value = RetryableError
+			self.assertTrue(policy.should_retry(RetryableError(), attempt=1))
+			self.assertTrue(policy.should_retry(RetryableError(), attempt=2))
+			self.assertFalse(policy.should_retry(RetryableError(), attempt=3))
+			self.assertFalse(policy.should_retry(ValueError(), attempt=1))
+
+	def test_task_without_attempts_has_no_policy(self):
+		self.assertIsNone(RetryPolicy.for_task({"retry_max_attempts": 1}))
@@ -0,0 +1,107 @@
+# Copyright (c) 2026, Datahenge LLC and contributors
+# For license information, please see license.txt
+
+from datetime import datetime
+import json
+import unittest
+from unittest import mock
+
+from btu.btu_core import task_log_stream
+
+
+def make_entry(entry_id, event_type, log_name, **values):
+	payload = { "event_type": event_type, "name": log_name, "values": values, "timestamp": "2026-01-01 00:00:00" }
+	return (entry_id, { b"data": json.dumps(payload).encode() })
+
+
+class TestTaskLogStream(unittest.TestCase):
+
+	def setUp(self):
+		patches = [
+			mock.patch.object(task_log_stream, "frappe"),
+			mock.patch.object(task_log_stream, "is_blob_store_enabled", return_value=False),
+			mock.patch.object(task_log_stream, "_after_batch_written"),
+			mock.patch.object(task_log_stream, "get_redis_conn"),
+			mock.patch.object(task_log_stream, "get_system_datetime_now", return_value=datetime(2026, 1, 1)),
+		]
+		self.mock_frappe, _, _, self.mock_get_redis_conn, _ = [ each.start() for each in patches ]
+		for each in patches:
+			self.addCleanup(each.stop)
+		self.mock_frappe.local.site = "test.site"
+
+	def log_inserts(self):
+		return [ each for each in self.mock_frappe.db.sql.call_args_list if "INSERT INTO `tabBTU Task Log`" in each.args[0] ]
+
+	def test_append_log_event_rejects_unknown_columns(self):
+		with self.assertRaises(ValueError):
+			task_log_stream.append_log_event("start", "BTLOG-1", not_a_column=1)
+
+	def test_start_and_finish_are_merged_into_one_upsert(self):
+		entries = [
+			make_entry(b"1-0", "start", "BTLOG-1", task="TASK-1", success_fail="In-Progress"),
+			make_entry(b"2-0", "finish", "BTLOG-1", task="TASK-1", success_fail="Success", execution_time=1.5),
+		]
+		rows_written = task_log_stream._write_batch(entries)  # pylint: disable=protected-access
+
+		self.assertEqual(rows_written, 1)
+		sql_calls = self.log_inserts()
+		self.assertEqual(len(sql_calls), 1)
+		statement, values = sql_calls[0].args[0], sql_calls[0].kwargs["values"]
+		self.assertIn("ON DUPLICATE KEY UPDATE", statement)
+		# Columns follow the order of LOG_COLUMNS, and the later event wins.
+		self.assertEqual(values[0], "BTLOG-1")
+		self.assertEqual(values[6:], ["TASK-1", 1.5, "Success"])
+
+	def test_last_runtime_is_updated_in_the_same_transaction(self):
+		events = []
+		self.mock_frappe.db.sql.side_effect = lambda statement, values=None: events.append(statement.split()[0])
+		self.mock_frappe.db.commit.side_effect = lambda: events.append("COMMIT")
+		task_log_stream._write_batch([  # pylint: disable=protected-access
+			make_entry(b"1-0", "finish", "BTLOG-1", task="TASK-1", success_fail="Success")])
+		self.assertEqual(events, ["INSERT", "UPDATE", "COMMIT"])
+
+	def test_rows_with_different_columns_are_grouped(self):
+		entries = [
+			make_entry(b"1-0", "finish", "BTLOG-1", task="TASK-1", success_fail="Success"),
+			make_entry(b"2-0", "finish", "BTLOG-2", task="TASK-2", success_fail="Success"),
+			make_entry(b"3-0", "update", "BTLOG-3", components_total=5),
+		]
+		self.assertEqual(task_log_stream._write_batch(entries), 3)  # pylint: disable=protected-access
+		self.assertEqual(len(self.log_inserts()), 2)
+
+	def test_component_rows_are_named_after_their_stream_entry(self):
+		entries = [ make_entry(b"5-0", "component", "BTLOG-1", component="C-1", status="Success", execution_time=0.1) ]
+		self.mock_frappe.db.sql.return_value = ()
+		task_log_stream._write_batch(entries)  # pylint: disable=protected-access
+		# Write the same entry again, as the drainer does after a failed batch.
+		task_log_stream._write_batch(entries)  # pylint: disable=protected-access
+
+		inserts = [ each for each in self.mock_frappe.db.sql.call_args_list
+		            if "INSERT INTO `tabBTU Task Log Component`" in each.args[0] ]
+		self.assertEqual(len(inserts), 2)
+		self.assertIn("ON DUPLICATE KEY UPDATE", inserts[0].args[0])
+		# The same row name both times, so the second write cannot add a duplicate row.
+		self.assertEqual(inserts[0].kwargs["values"][0], "BTLC-5-0")
+		self.assertEqual(inserts[0].kwargs["values"], inserts[1].kwargs["values"])
+
+	def test_failing_entry_is_moved_to_dead_letter_stream(self):
+		conn = self.mock_get_redis_conn.return_value
+		good_entry = make_entry(b"1-0", "finish", "BTLOG-1", task="TASK-1", success_fail="Success")
+		bad_entry = make_entry(b"2-0", "finish", "BTLOG-2", task="TASK-2", success_fail="Not A Status")
+		conn.xrange.side_effect = [ [good_entry, bad_entry], [] ]
+		conn.lock.return_value.acquire.return_value = True
+
+		def fake_sql(statement, values=None):
+			if "Not A Status" in values:
+				raise ValueError("Data truncated for column 'success_fail'")
+		self.mock_frappe.db.sql.side_effect = fake_sql
+
+		rows_written = task_log_stream.drain_task_log_stream(batch_size=10)
+
+		self.assertEqual(rows_written, 1)
+		dead_letters = [ each for each in conn.xadd.call_args_list if each.args[0].endswith(":dead_letter") ]
+		self.assertEqual(len(dead_letters), 1)
+		self.assertEqual(dead_letters[0].args[1]["entry_id"], b"2-0")
+		# Both entries leave the main stream, so the next drain does not re-read the failing one.
+		conn.xdel.assert_called_once_with(task_log_stream.get_stream_key(), b"1-0", b"2-0")
+		conn.lock.return_value.release.assert_called_once()
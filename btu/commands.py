@@ -0,0 +1,24 @@
+""" btu/commands.py """
+
+# Bench commands provided by BTU.  Frappe discovers these through the 'commands' list below.
+
+import click
+
+
+@click.command("btu-worker")
+@click.option("--queue", type=str, help="Comma-separated names of the queues to consume (default is all queues).")
+@click.option("--max-jobs", type=int, default=1000, help="Exit after this many Jobs, so the process manager can start a fresh Worker.")
+@click.option("--burst", is_flag=True, default=False, help="Exit when all queues are empty.")
+@click.option("--quiet", is_flag=True, default=False, help="Hide the Worker's INFO logging.")
+@click.option("--threads", type=int, default=1, help="Run up to this many Jobs at the same time, in threads.  For I/O-bound Tasks.")
+def start_btu_worker(queue, max_jobs, burst, quiet, threads):
+	"""
+	Start a persistent, non-forking BTU Worker that keeps Site connections open between Jobs.
+	"""
+	from btu.btu_core.btu_worker import start_worker
+	start_worker(queue=queue, max_jobs=max_jobs, burst=burst, quiet=quiet, threads=threads)
+
+
+commands = [
+	start_btu_worker
+]
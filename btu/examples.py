@@ -9,6 +9,7 @@ from frappe.model.sync import sync_for
 # --------------------
 from btu.btu_core.doctype.btu_task.btu_task import BTU_AWARE_FUNCTION
 from btu.btu_core.btu_task_component import TaskComponent
+from btu.btu_core.component_group import ComponentGroup
 
 
 class btu_aware_example1(BTU_AWARE_FUNCTION):  # pylint: disable=invalid-name
@@ -20,19 +21,49 @@ class btu_aware_example1(BTU_AWARE_FUNCTION):  # pylint: disable=invalid-name
 
 		self.btu_task_schedule_id = None
 
+		task_components = []
 		for each_number in range(0, 50):
-			# For each loop, spawn another Task Component
+			# For each loop, create another Task Component
 
 			print(f"* Spawning task component #{each_number}")
-			TaskComponent(btu_task_id=self.btu_task_id,
-			              btu_component_id=each_number+1,
-						  btu_task_schedule_id=self.btu_task_schedule_id,
-						  frappe_site_name=frappe.local.site,
-						  function=ordinary_function,
-						  number_to_count=30).enqueue()
+			task_components.append(TaskComponent(btu_task_id=self.btu_task_id,
+			                                     btu_component_id=each_number+1,
+			                                     btu_task_schedule_id=self.btu_task_schedule_id,
+			                                     frappe_site_name=frappe.local.site,
+			                                     function=ordinary_function,
+			                                     number_to_count=30))
+		# Enqueue all of them together.  (Calling enqueue() on each Task Component also works, but is slower.)
+		TaskComponent.enqueue_many(task_components)
 		return "I am the result of 'btu_aware_example1'"
 
 
+class btu_aware_example_group(BTU_AWARE_FUNCTION):  # pylint: disable=invalid-name
+
+	def run(self, **kwargs):
+		"""
+		Like 'btu_aware_example1', except a ComponentGroup tracks the Components.  When all of them have finished,
+		the parent's Task Log shows how many succeeded, and 'summarize_components' is called with their results.
+		"""
+		task_components = [ TaskComponent(btu_task_id=self.btu_task_id,
+		                                  btu_component_id=each_number+1,
+		                                  btu_task_schedule_id=self.btu_task_schedule_id,
+		                                  frappe_site_name=frappe.local.site,
+		                                  function=ordinary_function,
+		                                  number_to_count=30) for each_number in range(0, 50) ]
+		group = ComponentGroup(self.btu_task_id, parent_log_name=self.btu_task_log_name,
+		                       callback="btu.examples.summarize_components")
+		group.enqueue(task_components)
+		return f"Spawned {len(task_components)} Task Components."
+
+
+def summarize_components(component_results):
+	"""
+	The callback of 'btu_aware_example_group'.  Called once, after the last Task Component has finished.
+	"""
+	failed = [ each["component"] for each in component_results if not each["okay"] ]
+	print(f"{len(component_results)} Task Components finished.  These failed: {failed or 'None'}")
+
+
 def ordinary_function(number_to_count):
 	"""
 	This is an ordinary function, with no knowledge of BTU.
@@ -44,6 +75,22 @@ def ordinary_function(number_to_count):
 	print(f"An ordinary function finished counting to {number_to_count}.")
 
 
+async def async_example(number_of_requests=100):
+	"""
+	An 'async def' function can be used as a BTU Task.  TaskRunner runs it on an event loop inside the Worker.
+	Here, 100 simulated I/O-bound requests overlap, so the Task takes about 1 second instead of 100.
+	"""
+	import asyncio
+
+	async def simulated_request(request_number):
+		await asyncio.sleep(1)
+		return request_number
+
+	results = await asyncio.gather(*[ simulated_request(each) for each in range(int(number_of_requests)) ])
+	print(f"Completed {len(results)} simulated requests concurrently.")
+	return f"Completed {len(results)} requests."
+
+
 @frappe.whitelist()
 def wait_then_throw_error():
 	"""
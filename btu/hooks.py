@@ -12,12 +12,21 @@ app_color = "grey"
 app_email = "brian@datahenge.com"
 app_license = "MIT"
 
+# Cached payloads of 'get_pickled_task' were pickled by the code before the migration.
+after_migrate = ["btu.btu_core.pickled_task_cache.clear_all"]
+
 # Uses the native ERPNext Scheduler to investigate BTU Tasks that are still In-Progress after N minutes.
 scheduler_events = {
 
 	"cron": {
 	 	"0/5 * * * *": [
 	 		"btu.btu_core.doctype.btu_task_log.btu_task_log.check_in_progress_logs_for_timeout",
-	 	]
+	 	],
+		# When 'Write-Behind Task Logs' is enabled, moves Task Log events from Redis into SQL.
+		"* * * * *": [
+			"btu.btu_core.task_log_stream.drain_task_log_stream",
+			# Moves delayed Jobs (retries, deferred Task Components) into their queues, when they are due.
+			"btu.btu_api.promote_scheduled_jobs",
+		]
 	}
 }